@@ -0,0 +1,186 @@
+"""Shared aiohttp client for the --async runtime: one pooled session, named concurrency limits.
+
+Only the async runtime imports this module (and aiohttp); the stage modules take
+an AsyncHTTP argument in their *_async functions and never import aiohttp themselves.
+Requests go through the same per-host circuit breakers, adaptive timeouts and
+retry policy as http_client.
+"""
+import asyncio
+import json
+import logging
+import re
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Mapping, Optional
+
+import aiohttp
+
+from config import ASYNC_CONNECTIONS_PER_HOST, ASYNC_MAX_CONNECTIONS
+import http_client
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 16 * 1024
+
+
+@dataclass(slots=True)
+class AsyncResponse:
+    status: int
+    url: str
+    headers: Mapping[str, str]  # case-insensitive
+    content: bytes
+
+    def json(self) -> Any:
+        return json.loads(self.content) if self.content else None
+
+
+class AsyncHTTP:
+    """
+    One aiohttp.ClientSession (connection pool bounded overall and per host) for a
+    whole async run. limit(name, n) returns a semaphore shared by every caller
+    using that name, e.g. to bound concurrent feed downloads.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = ASYNC_MAX_CONNECTIONS,
+        per_host: int = ASYNC_CONNECTIONS_PER_HOST,
+    ):
+        self.max_connections = max_connections
+        self.per_host = per_host
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._limits: dict[str, asyncio.Semaphore] = {}
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=self.per_host)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    def limit(self, name: str, n: int) -> asyncio.Semaphore:
+        sem = self._limits.get(name)
+        if sem is None:
+            sem = self._limits[name] = asyncio.Semaphore(max(1, n))
+        return sem
+
+    async def _request(
+        self,
+        method: str,
+        url: str,
+        read: Callable[[aiohttp.ClientResponse], Awaitable[Any]],
+        timeout: float,
+        retries: Optional[int] = None,
+        adaptive: bool = True,
+        **kwargs,
+    ) -> Any:
+        """
+        Send through url's host circuit breaker and return await read(response).
+        timeout is the adaptive timeout's ceiling (with adaptive=False, the timeout
+        used as is); retries as in http_client.request.
+        Raises CircuitOpenError, the last network error, or whatever read raises.
+        """
+        state = http_client.host_state(url)
+        retries = http_client.default_retries(method) if retries is None else retries
+        attempt = 0
+        while True:
+            http_client.check(state)
+            started = time.monotonic()
+            total = state.timeout(timeout) if adaptive else timeout
+            try:
+                async with self.session.request(method, url, timeout=aiohttp.ClientTimeout(total=total), **kwargs) as r:
+                    delay = None
+                    if attempt < retries and (r.status >= 500 or r.status == 429):
+                        delay = http_client.retry_delay(attempt, r.status, r.headers.get("Retry-After"))
+                    if delay is None:
+                        result = await read(r)
+                        state.record(r.status < 500, time.monotonic() - started)
+                        return result
+                    state.record(r.status < 500, time.monotonic() - started)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                state.record(False, total if isinstance(e, asyncio.TimeoutError) else None)
+                if attempt >= retries:
+                    raise
+                delay = http_client.retry_delay(attempt)
+                logger.debug("Retrying %s %s after %r", method, url, e)
+            except aiohttp.ClientResponseError as e:
+                # raised by read() for an error status
+                state.record(e.status < 500, time.monotonic() - started)
+                raise
+            except Exception:
+                state.record(None)
+                raise
+            metrics.inc("http_retries_total", host=state.host)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def get(
+        self,
+        url: str,
+        params: Optional[dict] = None,
+        headers: Optional[dict] = None,
+        timeout: float = 15,
+    ) -> AsyncResponse:
+        """GET and read the whole body. Raises on network errors, not on HTTP status."""
+
+        async def read(r: aiohttp.ClientResponse) -> AsyncResponse:
+            return AsyncResponse(r.status, str(r.url), r.headers.copy(), await r.read())
+
+        return await self._request("GET", url, read, timeout, params=params, headers=headers)
+
+    async def get_json(self, url: str, params: Optional[dict] = None, timeout: float = 15) -> Any:
+        """GET a JSON document; raises on network errors and non-2xx replies."""
+
+        async def read(r: aiohttp.ClientResponse) -> Any:
+            r.raise_for_status()
+            return await r.json(content_type=None)
+
+        return await self._request("GET", url, read, timeout, params=params)
+
+    async def post_json(
+        self, url: str, payload: dict, timeout: float = 30, adaptive: bool = True
+    ) -> tuple[int, Any]:
+        """POST JSON (not retried); returns (status, decoded JSON body or None). Raises on network errors only."""
+
+        async def read(r: aiohttp.ClientResponse) -> tuple[int, Any]:
+            body = await r.read()
+            try:
+                return r.status, json.loads(body) if body else None
+            except ValueError:
+                return r.status, None
+
+        return await self._request("POST", url, read, timeout, adaptive=adaptive, json=payload)
+
+    async def read_head(
+        self,
+        url: str,
+        headers: Optional[dict] = None,
+        timeout: float = 10,
+        max_bytes: int = 256 * 1024,
+        stop: Optional[re.Pattern] = None,
+    ) -> tuple[str, str]:
+        """Stream url until `stop` matches or max_bytes are read (no retries); return (final url, decoded text)."""
+
+        async def read(r: aiohttp.ClientResponse) -> tuple[str, str]:
+            r.raise_for_status()
+            buf = bytearray()
+            async for chunk in r.content.iter_chunked(CHUNK_SIZE):
+                buf.extend(chunk)
+                if (stop is not None and stop.search(buf, max(0, len(buf) - len(chunk) - 8))) or len(buf) >= max_bytes:
+                    if r.connection is None:
+                        # The whole body already arrived and the connection went back to the pool with
+                        # reading paused on the unread buffer; drain it so the next request can be read
+                        r.content.read_nowait()
+                    else:
+                        # Drop the connection: with the rest of the body unread it must not be reused
+                        r.close()
+                    break
+            encoding = r.charset or "utf-8"
+            return str(r.url), bytes(buf[:max_bytes]).decode(encoding, errors="replace")
+
+        return await self._request("GET", url, read, timeout, retries=0, headers=headers, allow_redirects=True)
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
@@ -0,0 +1,379 @@
+"""Offline end-to-end benchmark: drive run_job and the individual fetchers against local stand-ins.
+
+Usage (from the repo root):
+    python -m benchmarks.run_bench --feeds 5,50,200,1000 --iterations 3
+    python -m benchmarks.run_bench --feeds 50 --latency-ms 100 --error-rate 0.05 --compare old.json
+
+Every iteration runs in a fresh worker process with its own DATA_DIR (pass --warm
+to keep state between iterations), pointed at one stand-in server for RSS, article
+pages, CoinGecko, Etherscan, CryptoPanic, Telegram and the LLM. Telegram and
+Etherscan client-side rate limits are lifted unless --real-limits is given, so the
+numbers measure the bot rather than its throttles. Results (wall time per stage,
+p50/p99, request counts per upstream, peak memory) are written as JSON, tagged
+with the current git commit, for comparison between commits.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Optional
+
+from benchmarks.stand_ins import StandInServer, UpstreamProfile
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+TARGETS = ("fetchers", "run_job", "run_job_async")
+
+
+def _percentile(values: list[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+def _summary(values: list[float]) -> dict:
+    return {
+        "n": len(values),
+        "p50": _percentile(values, 50),
+        "p99": _percentile(values, 99),
+        "mean": statistics.fmean(values) if values else None,
+        "max": max(values) if values else None,
+    }
+
+
+# --- worker (runs inside a fresh process) -----------------------------------------
+
+
+def _timed(fn: Callable, timings: dict, name: str) -> Callable:
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            timings[name] = timings.get(name, 0.0) + time.perf_counter() - started
+    return wrapper
+
+
+def _point_at_stand_ins(base_url: str) -> None:
+    """Redirect the hardcoded upstream URLs of the bot modules to the stand-in server."""
+    from urllib.parse import urlparse
+
+    import image_fetcher
+    import opinions_fetcher
+    import price_oracle
+    import telegram_poster
+    import whale_tracker
+
+    price_oracle.COINGECKO_URL = f"{base_url}/coingecko/coins/markets"
+    whale_tracker.ETHERSCAN_URL = f"{base_url}/etherscan/api"
+    opinions_fetcher.CRYPTOPANIC_URL = f"{base_url}/cryptopanic/api/posts/"
+    telegram_poster.BASE_URL = f"{base_url}/telegram/bot"
+
+    # Stand-ins are plain http; let the og:image path accept them
+    def _is_http_url(url):
+        parsed = urlparse((url or "").strip())
+        return parsed.scheme in ("http", "https") and bool(parsed.netloc)
+    image_fetcher._is_https_url = _is_http_url
+
+
+def _run_fetchers(timings: dict) -> None:
+    import image_fetcher
+    import market_data
+    import news_fetcher
+    import opinions_fetcher
+    import rewriter
+    import whale_tracker
+
+    items = _timed(news_fetcher.fetch_all, timings, "fetch_all")()
+    _timed(market_data.get_market_snapshot, timings, "get_market_snapshot")()
+    _timed(whale_tracker.get_whale_alerts, timings, "get_whale_alerts")()
+    _timed(opinions_fetcher.fetch_opinions, timings, "fetch_opinions")()
+    sample = items[:5]
+    _timed(rewriter.rewrite_batch, timings, "rewrite_batch")(sample)
+    lookup = _timed(image_fetcher.get_image_url, timings, "get_image_url")
+    for item in sample:
+        lookup(item)
+    timings["items"] = len(items)
+
+
+def _run_job(timings: dict) -> None:
+    import scheduler
+
+    for name in ("_market_stage", "_whale_stage", "_opinions_stage", "_news_stage", "_publish"):
+        setattr(scheduler, name, _timed(getattr(scheduler, name), timings, name.strip("_")))
+    _timed(scheduler.run_job, timings, "run_job")()
+
+
+def _run_job_async(timings: dict) -> None:
+    import asyncio
+
+    import scheduler
+
+    async def _timed_async(fn, name, *args):
+        started = time.perf_counter()
+        try:
+            return await fn(*args)
+        finally:
+            timings[name] = timings.get(name, 0.0) + time.perf_counter() - started
+
+    for name in ("_market_stage_async", "_whale_stage_async", "_opinions_stage_async", "_news_stage_async", "_publish_async"):
+        fn = getattr(scheduler, name)
+        setattr(scheduler, name, lambda *a, fn=fn, name=name: _timed_async(fn, name.strip("_"), *a))
+    _timed(asyncio.run, timings, "run_job_async")(scheduler.run_async())
+
+
+def worker(target: str, base_url: str, feeds: int, trace_memory: bool = True) -> dict:
+    """Run one iteration in this process and return its measurements."""
+    started = time.perf_counter()
+    import news_fetcher  # noqa: F401 - imports counted in startup time
+    import scheduler  # noqa: F401
+    import_seconds = time.perf_counter() - started
+
+    _point_at_stand_ins(base_url)
+    news_fetcher.RSS_FEED_URLS = [f"{base_url}/rss/{n}.xml" for n in range(feeds)]
+
+    timings: dict = {}
+    if trace_memory:
+        tracemalloc.start()
+    wall_started = time.perf_counter()
+    if target == "fetchers":
+        _run_fetchers(timings)
+    elif target == "run_job_async":
+        _run_job_async(timings)
+    else:
+        _run_job(timings)
+    wall = time.perf_counter() - wall_started
+    peak = None
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {
+        "wall_seconds": wall,
+        "import_seconds": import_seconds,
+        "stages": timings,
+        "peak_traced_bytes": peak,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+# --- driver ---------------------------------------------------------------------
+
+
+def _worker_env(args, base_url: str, data_dir: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "DATA_DIR": data_dir,
+        "TELEGRAM_BOT_TOKEN": "bench-token",
+        "TELEGRAM_CHANNEL_ID": "@bench",
+        "REWRITE_PROVIDER": args.provider,
+        "OPENAI_API_KEY": "bench-key",
+        "OPENAI_BASE_URL": f"{base_url}/openai/v1",
+        "OLLAMA_BASE_URL": f"{base_url}/ollama",
+        "ETHERSCAN_API_KEY": "bench-key",
+        "CRYPTOPANIC_API_KEY": "bench-key",
+        "DEFAULT_IMAGE_URL": f"{base_url}/img/default.jpg",
+        "MAX_POSTS_PER_RUN": str(args.max_posts),
+    })
+    if not args.real_limits:
+        env.update({
+            "TELEGRAM_CHAT_RATE_PER_MINUTE": "0",
+            "TELEGRAM_GLOBAL_RATE": "0",
+            "ETHERSCAN_RPS": "0",
+            "OPENAI_RPM": "0",
+            "GROQ_RPM": "0",
+        })
+    return env
+
+
+def _run_worker(args, server: StandInServer, target: str, feeds: int, data_dir: str) -> dict:
+    cmd = [
+        sys.executable, "-m", "benchmarks.run_bench", "--worker",
+        "--target", target, "--base-url", server.base_url, "--worker-feeds", str(feeds),
+    ]
+    if args.no_tracemalloc:
+        cmd.append("--no-tracemalloc")
+    proc = subprocess.run(
+        cmd, cwd=REPO_ROOT, env=_worker_env(args, server.base_url, data_dir),
+        capture_output=True, text=True, timeout=args.worker_timeout,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"worker failed ({target}, {feeds} feeds):\n{proc.stderr[-4000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def _request_summary(snapshot: dict) -> dict:
+    out = {}
+    for route, count in sorted(snapshot["counts"].items()):
+        lat_ms = [s * 1000 for s in snapshot["latencies"].get(route, [])]
+        out[route] = {
+            "count": count,
+            "errors": snapshot["errors"].get(route, 0),
+            "p50_ms": _percentile(lat_ms, 50),
+            "p99_ms": _percentile(lat_ms, 99),
+        }
+    return out
+
+
+def run_scenario(args, server: StandInServer, target: str, feeds: int) -> dict:
+    iterations = []
+    requests_per_iteration = []
+    all_latencies: dict[str, list[float]] = {}
+    with tempfile.TemporaryDirectory(prefix="bench-data-") as shared_dir:
+        for _ in range(args.iterations):
+            server.stats.reset()
+            if args.warm:
+                result = _run_worker(args, server, target, feeds, shared_dir)
+            else:
+                with tempfile.TemporaryDirectory(prefix="bench-data-") as data_dir:
+                    result = _run_worker(args, server, target, feeds, data_dir)
+            snap = server.stats.snapshot()
+            result["requests"] = snap["counts"]
+            iterations.append(result)
+            requests_per_iteration.append(snap)
+            for route, lats in snap["latencies"].items():
+                all_latencies.setdefault(route, []).extend(lats)
+
+    stage_names = sorted({k for it in iterations for k, v in it["stages"].items() if isinstance(v, float)})
+    merged = {
+        "counts": {},
+        "errors": {},
+        "latencies": all_latencies,
+    }
+    for snap in requests_per_iteration:
+        for route, c in snap["counts"].items():
+            merged["counts"][route] = merged["counts"].get(route, 0) + c
+        for route, c in snap["errors"].items():
+            merged["errors"][route] = merged["errors"].get(route, 0) + c
+    return {
+        "target": target,
+        "feeds": feeds,
+        "iterations": iterations,
+        "wall_seconds": _summary([it["wall_seconds"] for it in iterations]),
+        "import_seconds": _summary([it["import_seconds"] for it in iterations]),
+        "stages": {name: _summary([it["stages"][name] for it in iterations if name in it["stages"]]) for name in stage_names},
+        "peak_traced_bytes": max((it["peak_traced_bytes"] or 0) for it in iterations) or None,
+        "max_rss_kb": max(it["max_rss_kb"] for it in iterations),
+        "requests": _request_summary(merged),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def _compare(current: dict, baseline_path: Path) -> None:
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+    old = {(s["target"], s["feeds"]): s for s in baseline.get("scenarios", [])}
+    print(f"\nCompared with {baseline_path} ({baseline.get('meta', {}).get('commit')}):")
+    for s in current["scenarios"]:
+        prev = old.get((s["target"], s["feeds"]))
+        if not prev:
+            continue
+        for name, cur in [("wall", s["wall_seconds"])] + sorted(s["stages"].items()):
+            before = prev["wall_seconds"] if name == "wall" else prev["stages"].get(name)
+            if not before or not before.get("p50") or cur.get("p50") is None:
+                continue
+            delta = (cur["p50"] - before["p50"]) / before["p50"] * 100
+            print(f"  {s['target']:>8} {s['feeds']:>5} feeds  {name:<22} p50 {before['p50']:.3f}s -> {cur['p50']:.3f}s ({delta:+.1f}%)")
+
+
+def _print_scenario(s: dict) -> None:
+    w = s["wall_seconds"]
+    traced = f"peak traced {s['peak_traced_bytes'] / 1e6:.1f} MB, " if s["peak_traced_bytes"] else ""
+    print(f"{s['target']:>8} {s['feeds']:>5} feeds: wall p50 {w['p50']:.3f}s p99 {w['p99']:.3f}s, "
+          f"{traced}max RSS {s['max_rss_kb'] / 1024:.0f} MB")
+    for name, st in sorted(s["stages"].items()):
+        print(f"           {name:<22} p50 {st['p50']:.3f}s p99 {st['p99']:.3f}s")
+    reqs = ", ".join(f"{r}={v['count']}" + (f" ({v['errors']} err)" if v["errors"] else "") for r, v in s["requests"].items())
+    print(f"           requests: {reqs}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline benchmark for the crypto news bot")
+    parser.add_argument("--feeds", default="5,50,200,1000", help="Comma-separated feed counts (scenarios)")
+    parser.add_argument("--targets", default=",".join(TARGETS), help="fetchers, run_job and/or run_job_async")
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--warm", action="store_true", help="Keep DATA_DIR (caches, cursors) between iterations")
+    parser.add_argument("--provider", default="openai", choices=["openai", "ollama", "extractive"])
+    parser.add_argument("--max-posts", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--entries-per-feed", type=int, default=20)
+    parser.add_argument("--summary-bytes", type=int, default=400)
+    parser.add_argument("--article-bytes", type=int, default=200_000)
+    parser.add_argument("--real-limits", action="store_true", help="Keep Telegram/Etherscan/LLM rate limits")
+    parser.add_argument("--no-tracemalloc", action="store_true", help="Skip tracemalloc (it slows CPU-bound stages)")
+    parser.add_argument("--worker-timeout", type=float, default=600.0)
+    parser.add_argument("--output", type=Path, help="Result JSON path (default: benchmarks/results/<commit>-<time>.json)")
+    parser.add_argument("--compare", type=Path, help="Earlier result JSON to compare p50s against")
+    # Internal: worker mode
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--target", help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    parser.add_argument("--worker-feeds", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        import logging
+        logging.basicConfig(level=logging.CRITICAL)
+        print(json.dumps(worker(args.target, args.base_url, args.worker_feeds, not args.no_tracemalloc)))
+        return
+
+    profile = UpstreamProfile(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        entries_per_feed=args.entries_per_feed,
+        summary_bytes=args.summary_bytes,
+        article_bytes=args.article_bytes,
+        llm_latency_ms=args.llm_latency_ms,
+    )
+    feed_counts = [int(x) for x in args.feeds.split(",") if x.strip()]
+    targets = [t.strip() for t in args.targets.split(",") if t.strip() in TARGETS]
+
+    result = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "profile": profile.__dict__,
+            "args": {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items()
+                     if k not in ("worker", "target", "base_url", "worker_feeds")},
+        },
+        "scenarios": [],
+    }
+    with StandInServer(profile) as server:
+        for feeds in feed_counts:
+            for target in targets:
+                scenario = run_scenario(args, server, target, feeds)
+                result["scenarios"].append(scenario)
+                _print_scenario(scenario)
+
+    output = args.output or RESULTS_DIR / f"{result['meta']['commit'] or 'nogit'}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2), encoding="utf-8")
+    print(f"\nResults written to {output}")
+    if args.compare:
+        _compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""Local stand-ins for every upstream the bot talks to, served from one threaded HTTP server.
+
+Routes (all under http://127.0.0.1:<port>):
+    /rss/<n>.xml                 RSS feed n (supports ETag / If-None-Match)
+    /article/<n>/<i>.html        article page with og:image in <head>
+    /coingecko/coins/markets     CoinGecko markets
+    /etherscan/api               Etherscan tokentx
+    /cryptopanic/api/posts/      CryptoPanic posts
+    /telegram/bot<token>/<m>     Telegram Bot API (sendMessage, sendPhoto, ...)
+    /openai/v1/chat/completions  OpenAI-compatible chat completions
+    /ollama/api/chat             Ollama chat
+Latency, error rate and payload sizes are set per server via UpstreamProfile.
+"""
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+
+@dataclass
+class UpstreamProfile:
+    """Behaviour of the stand-in upstreams."""
+
+    latency_ms: float = 20.0          # mean added latency per request
+    jitter_ms: float = 10.0           # uniform +/- jitter
+    error_rate: float = 0.0           # probability of an HTTP 500
+    entries_per_feed: int = 20
+    summary_bytes: int = 400          # size of each RSS description
+    article_bytes: int = 200_000      # article body size after </head>
+    llm_latency_ms: float = 300.0     # chat completion latency (replaces latency_ms)
+    route_latency_ms: dict = field(default_factory=dict)  # per-route override, e.g. {"rss": 500}
+
+
+def _route_of(path: str) -> str:
+    return path.strip("/").split("/", 1)[0] or "root"
+
+
+class Stats:
+    """Request counts and server-side latencies per route."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts: dict[str, int] = {}
+        self.errors: dict[str, int] = {}
+        self.latencies: dict[str, list[float]] = {}
+
+    def record(self, route: str, seconds: float, error: bool) -> None:
+        with self._lock:
+            self.counts[route] = self.counts.get(route, 0) + 1
+            self.latencies.setdefault(route, []).append(seconds)
+            if error:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counts.clear()
+            self.errors.clear()
+            self.latencies.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counts": dict(self.counts),
+                "errors": dict(self.errors),
+                "latencies": {k: list(v) for k, v in self.latencies.items()},
+            }
+
+
+def _rss(feed: int, profile: UpstreamProfile, base: str) -> bytes:
+    now = time.time()
+    pad = ("lorem ipsum " * (profile.summary_bytes // 12 + 1))[: profile.summary_bytes]
+    items = []
+    for i in range(profile.entries_per_feed):
+        pub = formatdate(now - (feed * 7 + i * 60) % 86400, usegmt=True)
+        items.append(
+            f"<item><title>Feed {feed} story {i}: bitcoin moves</title>"
+            f"<link>{base}/article/{feed}/{i}.html</link>"
+            f"<guid>{base}/article/{feed}/{i}.html</guid>"
+            f"<description>&lt;p&gt;Story {i} from feed {feed}. {pad}&lt;/p&gt;</description>"
+            f"<pubDate>{pub}</pubDate></item>"
+        )
+    return (
+        "<?xml version='1.0' encoding='UTF-8'?><rss version='2.0'><channel>"
+        f"<title>Stand-in feed {feed}</title><link>{base}/</link>{''.join(items)}</channel></rss>"
+    ).encode("utf-8")
+
+
+def _article(feed: int, idx: int, profile: UpstreamProfile, base: str) -> bytes:
+    head = (
+        f"<html><head><title>Story {idx}</title>"
+        f'<meta property="og:image" content="{base}/img/{feed}/{idx}.jpg"></head><body>'
+    )
+    body = "<p>" + "x" * profile.article_bytes + "</p></body></html>"
+    return (head + body).encode("utf-8")
+
+
+def _markets(ids: list[str]) -> list[dict]:
+    rows = []
+    for n, coin_id in enumerate(ids):
+        rows.append({
+            "id": coin_id,
+            "symbol": coin_id[:4],
+            "current_price": 1.0 if coin_id in ("tether", "usd-coin") else 1000.0 * (len(ids) - n),
+            "market_cap": 10**12 // (n + 1),
+            "price_change_percentage_24h": (n % 3) - 1.0,
+            "image": f"https://example.invalid/{coin_id}.png",
+        })
+    return rows
+
+
+def _tokentx(params: dict) -> dict:
+    start = int(params.get("startblock", ["0"])[0] or 0)
+    offset = int(params.get("offset", ["50"])[0] or 50)
+    contract = params.get("contractaddress", [""])[0]
+    head = 20_000_000 + int(time.time()) // 12
+    first = head - 5 if not start else max(start, head - 5)
+    rows = []
+    for block in range(first, head + 1):
+        for i in range(3):
+            rows.append({
+                "blockNumber": str(block),
+                "hash": "0x" + hashlib.sha1(f"{contract}{block}{i}".encode()).hexdigest(),
+                "logIndex": str(i),
+                "from": "0x" + "a" * 40,
+                "to": "0x" + "b" * 40,
+                "value": str((i + 1) * 2_000_000 * 10**6),
+            })
+    return {"status": "1", "message": "OK", "result": rows[:offset]}
+
+
+def _chat_reply(messages: list[dict]) -> str:
+    system = messages[0].get("content", "") if messages else ""
+    user = messages[-1].get("content", "") if messages else ""
+    if "JSON array" in system:
+        ids = [int(m) for m in re.findall(r"^Item (\d+)$", user, re.M)]
+        return json.dumps([{"id": i, "caption": f"📰 Item {i} headline\nOne sentence summary."} for i in ids])
+    return "📰 Headline\nOne sentence summary."
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "StandInServer"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # noqa: A002 - silence default stderr logging
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: Optional[dict] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _json(self, obj, status: int = 200) -> None:
+        self._send(status, json.dumps(obj).encode("utf-8"), "application/json")
+
+    def _body(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return {}
+
+    def _handle(self) -> None:
+        started = time.perf_counter()
+        profile = self.server.profile
+        parsed = urlparse(self.path)
+        route = _route_of(parsed.path)
+        body = self._body() if self.command == "POST" else {}
+        delay_ms = profile.route_latency_ms.get(route)
+        if delay_ms is None:
+            delay_ms = profile.llm_latency_ms if route in ("openai", "ollama") else profile.latency_ms
+        time.sleep(max(0.0, delay_ms + random.uniform(-profile.jitter_ms, profile.jitter_ms)) / 1000.0)
+        error = random.random() < profile.error_rate
+        try:
+            if error:
+                self._json({"error": "injected failure"}, status=500)
+            else:
+                self._dispatch(route, parsed, body)
+        finally:
+            self.server.stats.record(route, time.perf_counter() - started, error)
+
+    def _dispatch(self, route: str, parsed, body: dict) -> None:
+        profile = self.server.profile
+        base = self.server.base_url
+        parts = parsed.path.strip("/").split("/")
+        params = parse_qs(parsed.query)
+        if route == "rss":
+            feed = int(parts[1].split(".")[0])
+            payload = _rss(feed, profile, base)
+            etag = '"' + hashlib.md5(f"{feed}:{profile.entries_per_feed}:{profile.summary_bytes}".encode()).hexdigest() + '"'
+            if self.headers.get("If-None-Match") == etag:
+                self._send(304, b"", "application/rss+xml", {"ETag": etag})
+            else:
+                self._send(200, payload, "application/rss+xml", {"ETag": etag})
+        elif route == "article":
+            self._send(200, _article(int(parts[1]), int(parts[2].split(".")[0]), profile, base), "text/html; charset=utf-8")
+        elif route == "img":
+            self._send(200, b"\xff\xd8\xff" + b"\0" * 1024, "image/jpeg")
+        elif route == "coingecko":
+            ids = [i for i in (params.get("ids", [""])[0]).split(",") if i]
+            self._json(_markets(ids))
+        elif route == "etherscan":
+            self._json(_tokentx(params))
+        elif route == "cryptopanic":
+            self._json({"results": [
+                {"id": n, "title": f"Opinion {n}: markets", "description": f"Analysis {n}.", "url": f"{base}/article/9999/{n}.html",
+                 "source": {"title": "Stand-in"}}
+                for n in range(20)
+            ]})
+        elif route == "telegram":
+            method = parts[-1]
+            self.server.next_message_id += 1
+            result = {"message_id": self.server.next_message_id, "chat": {"id": body.get("chat_id")}}
+            if method == "sendPhoto":
+                result["photo"] = [{"file_id": "stand-in-" + hashlib.sha1(str(body.get("photo")).encode()).hexdigest()[:16]}]
+            self._json({"ok": True, "result": result})
+        elif route == "openai":
+            reply = _chat_reply(body.get("messages", []))
+            self._json({
+                "id": "chatcmpl-standin", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model", ""),
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": reply}}],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            })
+        elif route == "ollama":
+            self._json({"message": {"role": "assistant", "content": _chat_reply(body.get("messages", []))}, "done": True})
+        else:
+            self._json({"error": "not found"}, status=404)
+
+    do_GET = _handle
+    do_POST = _handle
+    do_HEAD = _handle
+
+
+class StandInServer(ThreadingHTTPServer):
+    """Threaded stand-in server on 127.0.0.1; use as a context manager."""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, profile: Optional[UpstreamProfile] = None, port: int = 0):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.profile = profile or UpstreamProfile()
+        self.stats = Stats()
+        self.next_message_id = 0
+        self.base_url = f"http://127.0.0.1:{self.server_address[1]}"
+        self._thread: Optional[threading.Thread] = None
+
+    def handle_error(self, request, client_address) -> None:
+        # Clients dropping keep-alive connections is expected; don't print tracebacks
+        if not isinstance(sys.exc_info()[1], (ConnectionError, TimeoutError)):
+            super().handle_error(request, client_address)
+
+    def __enter__(self) -> "StandInServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="stand-in", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def feed_urls(self, count: int) -> list[str]:
+        return [f"{self.base_url}/rss/{n}.xml" for n in range(count)]
@@ -0,0 +1,131 @@
+"""Scalable Bloom filter (Almeida et al., 2007) with a compact on-disk format.
+
+Filters are added as the set grows; filter i holds initial_capacity * GROWTH**i
+items at false-positive rate fp_rate * (1 - TIGHTENING) * TIGHTENING**i, so the
+compound rate stays below fp_rate however many items are added.
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+from pathlib import Path
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+GROWTH = 4
+TIGHTENING = 0.5
+_MAGIC = b"BLOOM1\n"
+
+
+class BloomFilter:
+    """Fixed-capacity Bloom filter over a bytearray, k indexes by double hashing."""
+
+    __slots__ = ("capacity", "fp_rate", "num_bits", "num_hashes", "count", "bits")
+
+    def __init__(self, capacity: int, fp_rate: float, bits: Optional[bytearray] = None, count: int = 0):
+        self.capacity = max(1, capacity)
+        self.fp_rate = fp_rate
+        self.num_bits = max(8, math.ceil(-self.capacity * math.log(fp_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / self.capacity * math.log(2)))
+        self.count = count
+        self.bits = bits if bits is not None else bytearray((self.num_bits + 7) // 8)
+
+    def _indexes(self, key: str) -> list[int]:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        m = self.num_bits
+        return [(h1 + i * h2) % m for i in range(self.num_hashes)]
+
+    def __contains__(self, key: str) -> bool:
+        bits = self.bits
+        return all(bits[i >> 3] & (1 << (i & 7)) for i in self._indexes(key))
+
+    def add(self, key: str) -> bool:
+        """Add key; returns False if it was (probably) present already."""
+        bits = self.bits
+        new = False
+        for i in self._indexes(key):
+            byte, mask = i >> 3, 1 << (i & 7)
+            if not bits[byte] & mask:
+                bits[byte] |= mask
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+    @property
+    def full(self) -> bool:
+        return self.count >= self.capacity
+
+
+class ScalableBloomFilter:
+    """Grows by adding filters; membership is checked against all of them."""
+
+    def __init__(self, initial_capacity: int = 100_000, fp_rate: float = 1e-4):
+        self.initial_capacity = max(1, initial_capacity)
+        self.fp_rate = fp_rate
+        self.filters: list[BloomFilter] = []
+
+    def _new_filter(self) -> BloomFilter:
+        i = len(self.filters)
+        return BloomFilter(
+            self.initial_capacity * GROWTH ** i,
+            self.fp_rate * (1 - TIGHTENING) * TIGHTENING ** i,
+        )
+
+    def __contains__(self, key: str) -> bool:
+        # Newest filter first: recent links are the likeliest to be seen again
+        return any(key in f for f in reversed(self.filters))
+
+    def __len__(self) -> int:
+        return sum(f.count for f in self.filters)
+
+    def add(self, key: str) -> bool:
+        if key in self:
+            return False
+        if not self.filters or self.filters[-1].full:
+            self.filters.append(self._new_filter())
+        return self.filters[-1].add(key)
+
+    def update(self, keys: Iterable[str]) -> None:
+        for key in keys:
+            self.add(key)
+
+    @property
+    def size_bytes(self) -> int:
+        return sum(len(f.bits) for f in self.filters)
+
+    def save(self, path: Path) -> None:
+        """Write atomically: magic line, JSON header line, then each filter's bits."""
+        header = {
+            "initial_capacity": self.initial_capacity,
+            "fp_rate": self.fp_rate,
+            "filters": [{"capacity": f.capacity, "fp_rate": f.fp_rate, "count": f.count} for f in self.filters],
+        }
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "wb") as fh:
+            fh.write(_MAGIC)
+            fh.write(json.dumps(header).encode("utf-8") + b"\n")
+            for f in self.filters:
+                fh.write(f.bits)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "ScalableBloomFilter":
+        with open(path, "rb") as fh:
+            if fh.readline() != _MAGIC:
+                raise ValueError(f"Not a Bloom filter file: {path}")
+            header = json.loads(fh.readline())
+            sbf = cls(header["initial_capacity"], header["fp_rate"])
+            for meta in header["filters"]:
+                f = BloomFilter(meta["capacity"], meta["fp_rate"], count=meta["count"])
+                bits = fh.read(len(f.bits))
+                if len(bits) != len(f.bits):
+                    raise ValueError(f"Truncated Bloom filter file: {path}")
+                f.bits = bytearray(bits)
+                sbf.filters.append(f)
+        return sbf
@@ -1,4 +1,5 @@
 """Load configuration from environment. No secrets in repo."""
+import json
 import os
 from pathlib import Path
 
@@ -11,11 +12,34 @@ load_dotenv(Path(__file__).resolve().parent / ".env")
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "").strip()
 TELEGRAM_CHANNEL_ID = os.getenv("TELEGRAM_CHANNEL_ID", "").strip()
 
+# Telegram send limits: global messages/second across chats, per-chat messages/minute and burst
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_CHAT_RATE_PER_MINUTE = float(os.getenv("TELEGRAM_CHAT_RATE_PER_MINUTE", "20"))
+TELEGRAM_CHAT_BURST = float(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+
 # LLM
 REWRITE_PROVIDER = os.getenv("REWRITE_PROVIDER", "openai").strip().lower()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "").strip()
 GROQ_API_KEY = os.getenv("GROQ_API_KEY", "").strip()
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434").strip().rstrip("/")
+# Concurrent LLM requests and per-provider rate limits (requests per minute, 0 = unlimited)
+REWRITE_CONCURRENCY = int(os.getenv("REWRITE_CONCURRENCY", "4"))
+OPENAI_RPM = float(os.getenv("OPENAI_RPM", "500"))
+GROQ_RPM = float(os.getenv("GROQ_RPM", "30"))
+OLLAMA_RPM = float(os.getenv("OLLAMA_RPM", "0"))
+# Max news items packed into one LLM request by rewrite_batch
+REWRITE_BATCH_SIZE = int(os.getenv("REWRITE_BATCH_SIZE", "5"))
+# Rewrite cache: captions keyed by provider/model/prompt version/normalized text
+ENABLE_REWRITE_CACHE = os.getenv("ENABLE_REWRITE_CACHE", "true").strip().lower() in ("true", "1", "yes")
+REWRITE_CACHE_TTL_HOURS = float(os.getenv("REWRITE_CACHE_TTL_HOURS", "72"))
+REWRITE_CACHE_MAX_ENTRIES = int(os.getenv("REWRITE_CACHE_MAX_ENTRIES", "5000"))
+# Extractive captions (summarizer, no LLM): REWRITE_PROVIDER=extractive uses them for every item; otherwise they
+# replace rewrites that fail or are still pending REWRITE_BUDGET_SECONDS after a stage sent its first LLM request
+# (0 = no budget).
+# Keep RSS_FETCH_DEADLINE + the budget below STAGE_TIMEOUT_SECONDS so a slow LLM cannot get the news stage skipped
+ENABLE_EXTRACTIVE_FALLBACK = os.getenv("ENABLE_EXTRACTIVE_FALLBACK", "true").strip().lower() in ("true", "1", "yes")
+REWRITE_BUDGET_SECONDS = float(os.getenv("REWRITE_BUDGET_SECONDS", "60"))
 
 # RSS: comma-separated or default feeds
 _rss_env = os.getenv("RSS_FEED_URLS", "").strip()
@@ -30,16 +54,89 @@ else:
         "https://newsbtc.com/feed/",
     ]
 
+# RSS fetching: parallel workers (1 = serial), per-feed timeout and overall deadline (seconds)
+RSS_FETCH_WORKERS = int(os.getenv("RSS_FETCH_WORKERS", "8"))
+RSS_FEED_TIMEOUT = float(os.getenv("RSS_FEED_TIMEOUT", "15"))
+RSS_FETCH_DEADLINE = float(os.getenv("RSS_FETCH_DEADLINE", "45"))
+# Send conditional requests (ETag / Last-Modified) and reuse cached entries on 304
+ENABLE_FEED_CACHE = os.getenv("ENABLE_FEED_CACHE", "true").strip().lower() in ("true", "1", "yes")
+# Per-feed watermark (newest published time + GUIDs): older entries are skipped without conversion
+ENABLE_FEED_WATERMARKS = os.getenv("ENABLE_FEED_WATERMARKS", "true").strip().lower() in ("true", "1", "yes")
+
 # Schedule
 POST_INTERVAL_MINUTES = int(os.getenv("POST_INTERVAL_MINUTES", "60"))
 MAX_POSTS_PER_RUN = int(os.getenv("MAX_POSTS_PER_RUN", "3"))
 
+# Target chats as a JSON list, e.g. [{"chat_id": "@a"}, {"chat_id": "@b", "sections": ["news"], "max_posts": 1}].
+# sections: list of CHANNEL_SECTIONS (default all); max_posts: news posts per run (default
+# MAX_POSTS_PER_RUN). Items are fetched and rewritten once for all chats. Unset: TELEGRAM_CHANNEL_ID only.
+CHANNEL_SECTIONS = ("market", "whales", "opinions", "news")
+
+
+def _parse_channels(raw: str) -> list[dict]:
+    """Validate TELEGRAM_CHANNELS; raises ValueError naming the variable and the bad entry."""
+    try:
+        entries = json.loads(raw)
+    except ValueError as e:
+        raise ValueError(f"TELEGRAM_CHANNELS is not valid JSON: {e}") from None
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("TELEGRAM_CHANNELS must be a non-empty JSON list of objects")
+    channels = []
+    for n, ch in enumerate(entries):
+        if not isinstance(ch, dict):
+            raise ValueError(f"TELEGRAM_CHANNELS[{n}] must be an object, got {ch!r}")
+        chat_id = str(ch.get("chat_id") or "").strip()
+        if not chat_id:
+            raise ValueError(f"TELEGRAM_CHANNELS[{n}] has no chat_id")
+        sections = ch.get("sections")
+        if sections is not None:
+            if not isinstance(sections, list) or not all(isinstance(x, str) for x in sections):
+                raise ValueError(f"TELEGRAM_CHANNELS[{n}].sections must be a list of strings, got {sections!r}")
+            unknown = [x for x in sections if x not in CHANNEL_SECTIONS]
+            if unknown:
+                raise ValueError(
+                    f"TELEGRAM_CHANNELS[{n}].sections has unknown {unknown}; known: {', '.join(CHANNEL_SECTIONS)}"
+                )
+        max_posts = ch.get("max_posts", MAX_POSTS_PER_RUN)
+        if isinstance(max_posts, bool) or not isinstance(max_posts, int) or max_posts < 0:
+            raise ValueError(f"TELEGRAM_CHANNELS[{n}].max_posts must be a non-negative integer, got {max_posts!r}")
+        channels.append({"chat_id": chat_id, "sections": sections, "max_posts": max_posts})
+    return channels
+
+
+_channels_env = os.getenv("TELEGRAM_CHANNELS", "").strip()
+TELEGRAM_CHANNELS = (
+    _parse_channels(_channels_env)
+    if _channels_env
+    else [{"chat_id": TELEGRAM_CHANNEL_ID, "sections": None, "max_posts": MAX_POSTS_PER_RUN}]
+)
+
 # Image
 DEFAULT_IMAGE_URL = os.getenv("DEFAULT_IMAGE_URL", "").strip()
 FETCH_OG_IMAGE = os.getenv("FETCH_OG_IMAGE", "true").strip().lower() in ("true", "1", "yes")
+# Images are resolved in parallel with rewriting; a lookup still running this many
+# seconds after it started falls back to DEFAULT_IMAGE_URL
+IMAGE_FETCH_WORKERS = int(os.getenv("IMAGE_FETCH_WORKERS", "8"))
+IMAGE_FETCH_DEADLINE = float(os.getenv("IMAGE_FETCH_DEADLINE", "8"))
+# og:image lookups (including misses) are cached per article URL for this long
+OG_IMAGE_CACHE_TTL_HOURS = float(os.getenv("OG_IMAGE_CACHE_TTL_HOURS", "48"))
+
+# sendPhoto reuses the file_id Telegram returned for an image URL instead of having it fetch the URL again;
+# entries expire so an image replaced at the same URL is picked up
+ENABLE_TELEGRAM_FILE_ID_CACHE = os.getenv("ENABLE_TELEGRAM_FILE_ID_CACHE", "true").strip().lower() in ("true", "1", "yes")
+TELEGRAM_FILE_ID_TTL_HOURS = float(os.getenv("TELEGRAM_FILE_ID_TTL_HOURS", "168"))
+TELEGRAM_FILE_ID_MAX_ENTRIES = int(os.getenv("TELEGRAM_FILE_ID_MAX_ENTRIES", "2000"))
+
+# CoinGecko prices are shared by market snapshot and whale valuation and refreshed at most once per TTL
+PRICE_TTL_SECONDS = float(os.getenv("PRICE_TTL_SECONDS", "120"))
 
 # Etherscan (whale tracking)
 ETHERSCAN_API_KEY = os.getenv("ETHERSCAN_API_KEY", "").strip()
+# Etherscan free tier allows 5 requests/second; tokentx pages are read forward from a saved block cursor
+ETHERSCAN_RPS = float(os.getenv("ETHERSCAN_RPS", "5"))
+WHALE_PAGE_SIZE = int(os.getenv("WHALE_PAGE_SIZE", "1000"))
+# A scan reading WHALE_MAX_PAGES pages resyncs to the latest transfers (Etherscan caps a query at 10,000 rows)
+WHALE_MAX_PAGES = int(os.getenv("WHALE_MAX_PAGES", "10"))
 
 # CryptoPanic (opinions/sentiment)
 CRYPTOPANIC_API_KEY = os.getenv("CRYPTOPANIC_API_KEY", "").strip()
@@ -48,8 +145,67 @@ CRYPTOPANIC_API_KEY = os.getenv("CRYPTOPANIC_API_KEY", "").strip()
 MAX_OPINIONS_PER_RUN = int(os.getenv("MAX_OPINIONS_PER_RUN", "2"))
 ENABLE_MARKET_SNAPSHOT = os.getenv("ENABLE_MARKET_SNAPSHOT", "true").strip().lower() in ("true", "1", "yes")
 ENABLE_WHALE_ALERTS = os.getenv("ENABLE_WHALE_ALERTS", "true").strip().lower() in ("true", "1", "yes")
+# Near-duplicate stories (same story from several feeds) are collapsed before rewriting and
+# checked against stories posted in the last NEAR_DUP_WINDOW_HOURS; distance is in SimHash bits (of 64)
+ENABLE_NEAR_DUP_FILTER = os.getenv("ENABLE_NEAR_DUP_FILTER", "true").strip().lower() in ("true", "1", "yes")
+NEAR_DUP_MAX_DISTANCE = int(os.getenv("NEAR_DUP_MAX_DISTANCE", "6"))
+NEAR_DUP_WINDOW_HOURS = float(os.getenv("NEAR_DUP_WINDOW_HOURS", "72"))
+NEAR_DUP_MAX_STORED = int(os.getenv("NEAR_DUP_MAX_STORED", "5000"))
+# run_job fetch stages run concurrently; a stage not finished after this many seconds is skipped
+STAGE_TIMEOUT_SECONDS = float(os.getenv("STAGE_TIMEOUT_SECONDS", "120"))
+
+# Shared HTTP layer (http_client): a host failing HTTP_BREAKER_FAILURES times in a row is skipped for
+# HTTP_BREAKER_RESET_SECONDS, doubling after each failed probe up to HTTP_BREAKER_MAX_RESET_SECONDS
+HTTP_BREAKER_FAILURES = int(os.getenv("HTTP_BREAKER_FAILURES", "5"))
+HTTP_BREAKER_RESET_SECONDS = float(os.getenv("HTTP_BREAKER_RESET_SECONDS", "60"))
+HTTP_BREAKER_MAX_RESET_SECONDS = float(os.getenv("HTTP_BREAKER_MAX_RESET_SECONDS", "900"))
+# Timeouts adapt to HTTP_TIMEOUT_MULTIPLIER x each host's p99 latency, never below HTTP_MIN_TIMEOUT
+# nor above the calling module's own timeout
+HTTP_TIMEOUT_MULTIPLIER = float(os.getenv("HTTP_TIMEOUT_MULTIPLIER", "4"))
+HTTP_MIN_TIMEOUT = float(os.getenv("HTTP_MIN_TIMEOUT", "2"))
+# Retries of idempotent requests (errors, 5xx, 429) with full-jitter exponential backoff, in seconds
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "8"))
+# The shared requests session keeps a connection pool for each of the HTTP_POOL_HOSTS most recently
+# used hosts, with up to HTTP_POOL_SIZE connections each; the session lives as long as the process
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+HTTP_POOL_HOSTS = int(os.getenv("HTTP_POOL_HOSTS", "64"))
+# Optional on-disk HTTP cache (RFC 7234) for GET requests: fresh responses are served without a request,
+# stale ones are revalidated with ETag / Last-Modified. Entries are kept at most HTTP_CACHE_TTL_HOURS.
+# Only the default (threaded) runtime uses it; under --async, aio_http requests bypass the cache
+ENABLE_HTTP_CACHE = os.getenv("ENABLE_HTTP_CACHE", "false").strip().lower() in ("true", "1", "yes")
+HTTP_CACHE_TTL_HOURS = float(os.getenv("HTTP_CACHE_TTL_HOURS", "24"))
+HTTP_CACHE_MAX_ENTRIES = int(os.getenv("HTTP_CACHE_MAX_ENTRIES", "2000"))
+HTTP_CACHE_MAX_BODY_KB = int(os.getenv("HTTP_CACHE_MAX_BODY_KB", "1024"))
+
+# --async runtime: shared aiohttp connection pool (overall / per host) and concurrent feed downloads
+ASYNC_MAX_CONNECTIONS = int(os.getenv("ASYNC_MAX_CONNECTIONS", "100"))
+ASYNC_CONNECTIONS_PER_HOST = int(os.getenv("ASYNC_CONNECTIONS_PER_HOST", "8"))
+ASYNC_FETCH_CONCURRENCY = int(os.getenv("ASYNC_FETCH_CONCURRENCY", "64"))
+
+# Metrics: Prometheus text endpoint on METRICS_PORT (0 = off); one JSON summary line per run
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1").strip()
+METRICS_SUMMARY_FILE = Path(__file__).resolve().parent / "logs" / "run_metrics.jsonl"
 
-# Persistence path for posted links
-DATA_DIR = Path(__file__).resolve().parent / "data"
-POSTED_LINKS_FILE = DATA_DIR / "posted_links.json"
+# Persistence paths (DATA_DIR can be overridden, e.g. to isolate benchmark runs)
+DATA_DIR = Path(os.getenv("DATA_DIR", "").strip() or Path(__file__).resolve().parent / "data")
+FEED_CACHE_FILE = DATA_DIR / "feed_cache.json"
+REWRITE_CACHE_FILE = DATA_DIR / "rewrite_cache.db"
+OG_IMAGE_CACHE_FILE = DATA_DIR / "og_image_cache.db"
+TELEGRAM_FILE_ID_CACHE_FILE = DATA_DIR / "telegram_file_ids.db"
+HTTP_CACHE_FILE = DATA_DIR / "http_cache.db"
+WHALE_CURSOR_FILE = DATA_DIR / "whale_cursor.json"
+POSTED_LINKS_FILE = DATA_DIR / "posted_links.json"  # legacy JSON store, imported once into the DB
+POSTED_LINKS_DB = DATA_DIR / "posted_links.db"
+NEAR_DUP_DB = DATA_DIR / "near_duplicates.db"
+FEED_WATERMARK_FILE = DATA_DIR / "feed_watermarks.json"
 MAX_POSTED_LINKS_STORED = 500
+# Pending marks are committed in one transaction once this many accumulate (or on flush)
+POSTED_LINKS_BATCH_SIZE = int(os.getenv("POSTED_LINKS_BATCH_SIZE", "1"))
+# Links older than the exact store are remembered by a scalable Bloom filter (~2.4 MB per million links at 1e-4)
+ENABLE_POSTED_BLOOM = os.getenv("ENABLE_POSTED_BLOOM", "true").strip().lower() in ("true", "1", "yes")
+POSTED_BLOOM_FP_RATE = float(os.getenv("POSTED_BLOOM_FP_RATE", "0.0001"))
+POSTED_BLOOM_INITIAL_CAPACITY = int(os.getenv("POSTED_BLOOM_INITIAL_CAPACITY", "100000"))
+POSTED_BLOOM_FILE = DATA_DIR / "posted_links.bloom"
@@ -0,0 +1,109 @@
+"""Small disk-backed key/value cache (SQLite) with TTL and size-based LRU eviction."""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Returned by get() when the key is absent or expired (None is a valid cached value)
+MISSING = object()
+
+
+class DiskCache:
+    """
+    JSON values keyed by string, stored in one SQLite table.
+    Entries older than ttl_seconds are treated as absent (ttl_seconds=None: never expire).
+    When more than max_entries are stored, the least recently used are evicted.
+    """
+
+    def __init__(self, path: Path, ttl_seconds: Optional[float] = None, max_entries: int = 1000, name: str = ""):
+        self.path = path
+        self.name = name or path.stem
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_last_used ON cache (last_used)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Any:
+        """Return the cached value, or MISSING."""
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._conn.execute("SELECT value, created_at FROM cache WHERE key = ?", (key,)).fetchone()
+                if row is None or (self.ttl_seconds is not None and now - row[1] > self.ttl_seconds):
+                    self.misses += 1
+                    metrics.cache_result(self.name, False)
+                    return MISSING
+                with self._conn:
+                    self._conn.execute("UPDATE cache SET last_used = ? WHERE key = ?", (now, key))
+                self.hits += 1
+                metrics.cache_result(self.name, True)
+                return json.loads(row[0])
+            except Exception as e:
+                logger.warning("Cache read failed (%s): %s", self.path.name, e)
+                self.misses += 1
+                metrics.cache_result(self.name, False)
+                return MISSING
+
+    def set(self, key: str, value: Any) -> None:
+        now = time.time()
+        with self._lock:
+            try:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO cache (key, value, created_at, last_used) VALUES (?, ?, ?, ?)",
+                        (key, json.dumps(value), now, now),
+                    )
+                    self._evict_locked(now)
+            except Exception as e:
+                logger.warning("Cache write failed (%s): %s", self.path.name, e)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            try:
+                with self._conn:
+                    self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            except Exception as e:
+                logger.warning("Cache delete failed (%s): %s", self.path.name, e)
+
+    def _evict_locked(self, now: float) -> None:
+        if self.ttl_seconds is not None:
+            self._conn.execute("DELETE FROM cache WHERE created_at < ?", (now - self.ttl_seconds,))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM cache WHERE key IN ("
+                " SELECT key FROM cache ORDER BY last_used ASC LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            (size,) = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "size": size,
+        }
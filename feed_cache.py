@@ -0,0 +1,128 @@
+"""Per-feed conditional GET state (ETag / Last-Modified) and last parsed entries.
+
+Entries are stored in a slim, JSON-safe form and restored as FeedParserDicts,
+so a 304 Not Modified reply can be served without downloading or parsing.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+import feedparser
+
+from config import FEED_CACHE_FILE
+
+logger = logging.getLogger(__name__)
+
+# Entry fields kept for news_fetcher / image_fetcher; everything else is dropped
+_ENTRY_KEYS = ("id", "link", "title", "summary", "description", "media_content", "media_thumbnail", "enclosures")
+_TIME_KEYS = ("published_parsed",)
+
+
+def _slim_entry(entry: Any) -> dict:
+    out: dict = {}
+    for key in _ENTRY_KEYS:
+        value = entry.get(key)
+        if value:
+            out[key] = json.loads(json.dumps(value, default=str))
+    for key in _TIME_KEYS:
+        value = entry.get(key)
+        if value:
+            out[key] = list(value)
+    return out
+
+
+def _restore_entry(data: dict) -> feedparser.FeedParserDict:
+    entry = feedparser.FeedParserDict(data)
+    for key in _TIME_KEYS:
+        if data.get(key):
+            entry[key] = time.struct_time(tuple(data[key]))
+    return entry
+
+
+class FeedCache:
+    """JSON file of {url: {etag, modified, source, entries}} loaded once per process."""
+
+    def __init__(self, path: Path = FEED_CACHE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._feeds: dict[str, dict] = self._load()
+
+    def _load(self) -> dict[str, dict]:
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except Exception as e:
+            logger.warning("Could not load feed cache: %s", e)
+            return {}
+
+    def request_headers(self, url: str) -> dict[str, str]:
+        """Conditional request headers for url, empty if nothing is cached."""
+        cached = self._feeds.get(url)
+        if not cached or not cached.get("entries"):
+            return {}
+        headers = {}
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("modified"):
+            headers["If-Modified-Since"] = cached["modified"]
+        return headers
+
+    def get(self, url: str) -> Optional[tuple[str, list]]:
+        """Return cached (source, entries) for url, or None."""
+        cached = self._feeds.get(url)
+        if not cached:
+            return None
+        return cached.get("source") or url, [_restore_entry(e) for e in cached.get("entries", [])]
+
+    def put(self, url: str, etag: Optional[str], modified: Optional[str], source: str, entries: list) -> None:
+        if not etag and not modified:
+            # Server does not support conditional requests; nothing worth caching
+            with self._lock:
+                if self._feeds.pop(url, None) is not None:
+                    self._dirty = True
+            return
+        record = {
+            "etag": etag,
+            "modified": modified,
+            "source": source,
+            "entries": [_slim_entry(e) for e in entries],
+        }
+        with self._lock:
+            self._feeds[url] = record
+            self._dirty = True
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = self.path.with_suffix(".tmp")
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(self._feeds, f)
+                os.replace(tmp, self.path)
+                self._dirty = False
+            except Exception as e:
+                logger.exception("Could not save feed cache: %s", e)
+
+
+_cache: Optional[FeedCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> FeedCache:
+    """Return the process-wide feed cache, loading it on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = FeedCache()
+    return _cache
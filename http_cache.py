@@ -0,0 +1,229 @@
+"""Optional on-disk cache of GET responses for http_client, following RFC 7234 for a private cache.
+
+- Only complete 200 responses are stored, and never with `Cache-Control: no-store`
+  (on either side) or `Vary: *`. A stored response only answers requests whose
+  headers named in its Vary match.
+- A response is fresh for its `max-age`, else until `Expires`, else for 10% of the
+  time since `Last-Modified` (heuristic, capped at HEURISTIC_MAX_SECONDS). Its age
+  counts the `Age` header plus the time since it was stored. `no-cache` means
+  always revalidate.
+- Fresh responses are served without a request. A stale response with an ETag or
+  Last-Modified is revalidated with a conditional GET, and a 304 refreshes it.
+- A request that carries its own If-None-Match / If-Modified-Since (feed_cache)
+  gets a 304 from a fresh entry whose validators match, and is otherwise sent as is.
+
+Entries are dropped HTTP_CACHE_TTL_HOURS after they were last stored or refreshed.
+Keys are hashes of the request URL, and a stored redirect target has its credential
+query parameters removed, so API keys in query strings never reach the disk.
+Only http_client uses the cache; the --async runtime (aio_http) does not.
+"""
+import base64
+import calendar
+import email.utils
+import hashlib
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Any, Mapping, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from config import (
+    ENABLE_HTTP_CACHE,
+    HTTP_CACHE_FILE,
+    HTTP_CACHE_MAX_BODY_KB,
+    HTTP_CACHE_MAX_ENTRIES,
+    HTTP_CACHE_TTL_HOURS,
+)
+from disk_cache import MISSING, DiskCache
+
+logger = logging.getLogger(__name__)
+
+HEURISTIC_FRACTION = 0.1
+HEURISTIC_MAX_SECONDS = 24 * 3600
+CONDITIONAL_HEADERS = ("If-None-Match", "If-Modified-Since")
+# Query parameters carrying credentials (Etherscan apikey, CryptoPanic auth_token, ...)
+CREDENTIAL_PARAMS = frozenset(("apikey", "api_key", "key", "auth_token", "token", "access_token"))
+# Not stored: per-connection headers, and encodings already undone by requests
+_DROPPED_HEADERS = frozenset(
+    h.lower() for h in (
+        "Connection", "Keep-Alive", "Transfer-Encoding", "Content-Encoding", "Content-Length",
+        "Set-Cookie", "Proxy-Connection", "Trailer", "Upgrade",
+    )
+)
+
+
+def _cache_control(headers: Mapping[str, str]) -> dict[str, Optional[str]]:
+    directives: dict[str, Optional[str]] = {}
+    for part in (headers.get("Cache-Control") or "").split(","):
+        name, _, value = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = value.strip().strip('"') or None
+    return directives
+
+
+def _http_date(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        parsed = email.utils.parsedate_tz(value)
+    except (TypeError, ValueError):
+        return None
+    if parsed is None:
+        return None
+    return float(email.utils.mktime_tz(parsed)) if parsed[9] is not None else float(calendar.timegm(parsed[:9]))
+
+
+def _seconds(value: Optional[str]) -> Optional[int]:
+    try:
+        return max(0, int(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+def freshness_lifetime(headers: Mapping[str, str]) -> float:
+    """Seconds a response stays fresh after it was generated (RFC 7234 section 4.2.1)."""
+    cc = _cache_control(headers)
+    if "no-cache" in cc:
+        return 0.0
+    max_age = _seconds(cc.get("max-age"))
+    if max_age is not None:
+        return float(max_age)
+    date = _http_date(headers.get("Date"))
+    if "Expires" in headers:
+        expires = _http_date(headers.get("Expires"))
+        # An invalid Expires (e.g. "0") means already expired
+        return max(0.0, expires - date) if expires is not None and date is not None else 0.0
+    modified = _http_date(headers.get("Last-Modified"))
+    if modified is not None and date is not None and date > modified:
+        return min(HEURISTIC_MAX_SECONDS, (date - modified) * HEURISTIC_FRACTION)
+    return 0.0
+
+
+def _key(url: str) -> str:
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+def redact(url: str) -> str:
+    """url without CREDENTIAL_PARAMS in its query string."""
+    parts = urlsplit(url)
+    if not parts.query:
+        return url
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k.lower() not in CREDENTIAL_PARAMS]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def _vary(headers: Mapping[str, str]) -> list[str]:
+    return [h.strip().lower() for h in (headers.get("Vary") or "").split(",") if h.strip()]
+
+
+def validators(entry: dict) -> dict[str, str]:
+    """Conditional request headers revalidating entry."""
+    headers = CaseInsensitiveDict(entry["headers"])
+    out = {}
+    if headers.get("ETag"):
+        out["If-None-Match"] = headers["ETag"]
+    if headers.get("Last-Modified"):
+        out["If-Modified-Since"] = headers["Last-Modified"]
+    return out
+
+
+class HTTPCache:
+    """GET responses keyed by a hash of the full URL, in a DiskCache (LRU by count, dropped after ttl_seconds)."""
+
+    def __init__(
+        self,
+        path: Path = HTTP_CACHE_FILE,
+        ttl_seconds: float = HTTP_CACHE_TTL_HOURS * 3600,
+        max_entries: int = HTTP_CACHE_MAX_ENTRIES,
+        max_body_bytes: int = HTTP_CACHE_MAX_BODY_KB * 1024,
+    ):
+        self.max_body_bytes = max_body_bytes
+        self._store = DiskCache(path, ttl_seconds=ttl_seconds, max_entries=max_entries, name="http")
+
+    def lookup(self, url: str, request_headers: Mapping[str, str]) -> Optional[dict]:
+        """Stored entry for url whose Vary headers match request_headers, or None."""
+        entry = self._store.get(_key(url))
+        if entry is MISSING or not isinstance(entry, dict):
+            return None
+        if any(request_headers.get(h) != value for h, value in entry.get("vary", {}).items()):
+            return None
+        return entry
+
+    @staticmethod
+    def is_fresh(entry: dict, now: Optional[float] = None) -> bool:
+        now = time.time() if now is None else now
+        headers = CaseInsensitiveDict(entry["headers"])
+        age = (_seconds(headers.get("Age")) or 0) + max(0.0, now - entry["stored_at"])
+        return age < freshness_lifetime(headers)
+
+    def store(self, url: str, request_headers: Mapping[str, str], r: requests.Response) -> None:
+        """Store r if it may be cached and is worth keeping (fresh for a while, or revalidatable)."""
+        if r.status_code != 200 or "no-store" in _cache_control(r.headers):
+            return
+        vary = _vary(r.headers)
+        if "*" in vary or len(r.content) > self.max_body_bytes:
+            return
+        if freshness_lifetime(r.headers) <= 0 and not ("ETag" in r.headers or "Last-Modified" in r.headers):
+            return
+        self._store.set(_key(url), {
+            "status": r.status_code,
+            # Final URL only when redirected; to_response uses the request URL otherwise
+            "redirect": redact(r.url) if r.url and r.url != url else None,
+            "headers": {k: v for k, v in r.headers.items() if k.lower() not in _DROPPED_HEADERS},
+            "vary": {h: request_headers.get(h) for h in vary},
+            "body": base64.b64encode(r.content).decode("ascii"),
+            "stored_at": time.time(),
+        })
+
+    def refresh(self, url: str, entry: dict, not_modified: requests.Response) -> dict:
+        """Update entry from a 304 reply to its revalidation (RFC 7234 section 4.3.4) and store it."""
+        headers = CaseInsensitiveDict(entry["headers"])
+        for k, v in not_modified.headers.items():
+            if k.lower() not in _DROPPED_HEADERS:
+                headers[k] = v
+        if "Age" not in not_modified.headers:
+            headers.pop("Age", None)
+        entry = {**entry, "headers": dict(headers), "stored_at": time.time()}
+        self._store.set(_key(url), entry)
+        return entry
+
+
+def to_response(entry: dict, url: str, status: Optional[int] = None) -> requests.Response:
+    """A requests.Response for url built from a stored entry (status overrides the stored one, e.g. 304)."""
+    r = requests.Response()
+    r.status_code = status or entry["status"]
+    r.reason = "Not Modified" if r.status_code == 304 else "OK"
+    r.url = entry.get("redirect") or url
+    r.headers = CaseInsensitiveDict(entry["headers"])
+    r.encoding = get_encoding_from_headers(r.headers)
+    r._content = b"" if r.status_code == 304 else base64.b64decode(entry["body"])
+    r._content_consumed = True
+    return r
+
+
+def matches_conditional(entry: dict, request_headers: Mapping[str, Any]) -> bool:
+    """True if the caller's own conditional headers match the entry's validators."""
+    stored = validators(entry)
+    asked = {h: request_headers.get(h) for h in CONDITIONAL_HEADERS if request_headers.get(h)}
+    return bool(asked) and all(stored.get(h) == value for h, value in asked.items())
+
+
+_cache: Optional[HTTPCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[HTTPCache]:
+    """Return the process-wide cache, opening it on first use; None when ENABLE_HTTP_CACHE is off."""
+    global _cache
+    if not ENABLE_HTTP_CACHE:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = HTTPCache()
+    return _cache
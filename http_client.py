@@ -0,0 +1,294 @@
+"""Shared HTTP layer: pooled session, per-host circuit breakers, adaptive timeouts, jittered retries.
+
+Upstream calls go through request() (the async runtime's aio_http shares the same
+per-host state):
+- One process-wide session keeps a keep-alive pool per host (HTTP_POOL_HOSTS
+  hosts, HTTP_POOL_SIZE connections each), so runs and scheduler ticks reuse
+  TCP/TLS connections. Responses are gzip/deflate compressed on the wire, and
+  brotli too when the optional brotli package is installed.
+- With ENABLE_HTTP_CACHE, GETs go through the on-disk RFC 7234 cache in http_cache.
+- A host that fails HTTP_BREAKER_FAILURES times in a row is short-circuited
+  (CircuitOpenError, no network I/O) for HTTP_BREAKER_RESET_SECONDS. Then one
+  probe request is let through (half-open); success closes the breaker, failure
+  opens it again for twice as long (up to HTTP_BREAKER_MAX_RESET_SECONDS).
+- A request's timeout is HTTP_TIMEOUT_MULTIPLIER x the host's observed p99
+  latency, kept between HTTP_MIN_TIMEOUT and the caller's timeout (which is used
+  as is until the host has enough samples, and for half-open probes). A timed-out
+  request counts as a sample at its timeout, so a host that got slower raises its
+  own p99; opening the breaker forgets the samples.
+- Network errors, timeouts, 5xx and 429 replies are retried up to `retries`
+  times with full-jitter exponential backoff; a 429 waits for its Retry-After
+  when that is short enough. Only GET/HEAD retry by default.
+Failures are network errors, timeouts and 5xx replies; any other reply means the host is up.
+"""
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util import make_headers
+
+from config import (
+    HTTP_BACKOFF_BASE,
+    HTTP_BACKOFF_MAX,
+    HTTP_BREAKER_FAILURES,
+    HTTP_BREAKER_MAX_RESET_SECONDS,
+    HTTP_BREAKER_RESET_SECONDS,
+    HTTP_POOL_HOSTS,
+    HTTP_MIN_TIMEOUT,
+    HTTP_POOL_SIZE,
+    HTTP_RETRIES,
+    HTTP_TIMEOUT_MULTIPLIER,
+)
+import http_cache
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 15
+# Latency samples kept per host, and how many are needed before timeouts adapt
+LATENCY_SAMPLES = 200
+MIN_SAMPLES = 20
+IDEMPOTENT_METHODS = ("GET", "HEAD")
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of sending a request to a host whose circuit breaker is open."""
+
+
+class HostState:
+    """Circuit breaker and recent latencies for one host."""
+
+    def __init__(self, host: str):
+        self.host = host
+        self.failures = 0
+        self.open_until = 0.0  # 0: closed
+        self.open_seconds = HTTP_BREAKER_RESET_SECONDS
+        self.probing = False
+        self.latencies: deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """True if a request may be sent now; when the open period is over, lets one probe through."""
+        with self._lock:
+            if not self.open_until:
+                return True
+            if self.probing or time.monotonic() < self.open_until:
+                return False
+            self.probing = True
+            return True
+
+    def record(self, ok: Optional[bool], seconds: Optional[float] = None) -> None:
+        """
+        Record an outcome: True (host answered), False (host failed) or None (no
+        verdict, e.g. a bad URL). seconds is the latency sample: the reply time, or
+        the timeout a timed-out request was given.
+        """
+        with self._lock:
+            if ok is None:
+                self.probing = False
+                return
+            if seconds is not None:
+                self.latencies.append(seconds)
+            if ok:
+                if self.open_until:
+                    logger.info("Circuit closed for %s", self.host)
+                self.failures = 0
+                self.open_until = 0.0
+                self.open_seconds = HTTP_BREAKER_RESET_SECONDS
+                self.probing = False
+                return
+            self.failures += 1
+            if self.probing:
+                self.open_seconds = min(self.open_seconds * 2, HTTP_BREAKER_MAX_RESET_SECONDS)
+            elif self.open_until or self.failures < HTTP_BREAKER_FAILURES:
+                return
+            self.probing = False
+            self.open_until = time.monotonic() + self.open_seconds
+            # Samples from before the outage would shrink the timeouts of the next probes
+            self.latencies.clear()
+        logger.warning("Circuit open for %s after %d failures; next probe in %.0fs", self.host, self.failures, self.open_seconds)
+        metrics.inc("http_circuit_open_total", host=self.host)
+
+    def timeout(self, ceiling: float) -> float:
+        """HTTP_TIMEOUT_MULTIPLIER x observed p99 latency, within [HTTP_MIN_TIMEOUT, ceiling]; ceiling for probes."""
+        with self._lock:
+            if self.probing:
+                return ceiling
+            samples = sorted(self.latencies)
+        if len(samples) < MIN_SAMPLES:
+            return ceiling
+        p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+        return max(min(HTTP_MIN_TIMEOUT, ceiling), min(ceiling, p99 * HTTP_TIMEOUT_MULTIPLIER))
+
+
+_hosts: dict[str, HostState] = {}
+_hosts_lock = threading.Lock()
+
+
+def host_of(url: str) -> str:
+    return urlparse(url).netloc.lower()
+
+
+def host_state(url: str) -> HostState:
+    """Process-wide state for url's host."""
+    host = host_of(url)
+    state = _hosts.get(host)
+    if state is None:
+        with _hosts_lock:
+            state = _hosts.setdefault(host, HostState(host))
+    return state
+
+
+def check(state: HostState) -> None:
+    """Raise CircuitOpenError if state's breaker refuses requests."""
+    if not state.allow():
+        metrics.inc("http_short_circuited_total", host=state.host)
+        raise CircuitOpenError(f"Circuit open for {state.host}")
+
+
+def retry_delay(attempt: int, status: Optional[int] = None, retry_after: Optional[str] = None) -> Optional[float]:
+    """
+    Seconds to wait before retry number attempt + 1: full jitter over an exponential
+    backoff, or a 429's Retry-After. None if Retry-After is longer than HTTP_BACKOFF_MAX.
+    """
+    if status == 429 and retry_after:
+        try:
+            wait = float(retry_after)
+        except ValueError:
+            wait = None
+        if wait is not None:
+            return wait if wait <= HTTP_BACKOFF_MAX else None
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt))
+
+
+def default_retries(method: str) -> int:
+    return HTTP_RETRIES if method.upper() in IDEMPOTENT_METHODS else 0
+
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # urllib3 lists br only when a brotli decoder is importable
+                session.headers["Accept-Encoding"] = make_headers(accept_encoding=True)["accept-encoding"]
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_SIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def request(
+    method: str,
+    url: str,
+    timeout: float = DEFAULT_TIMEOUT,
+    retries: Optional[int] = None,
+    adaptive: bool = True,
+    **kwargs,
+) -> requests.Response:
+    """
+    Send a request through the host's circuit breaker. timeout is the ceiling (with
+    adaptive=False, the timeout used as is); retries defaults to HTTP_RETRIES for
+    GET/HEAD and 0 otherwise. Returns the last response whatever its status; raises
+    CircuitOpenError or the last network error. Non-streamed GETs may be answered
+    from the HTTP cache.
+    """
+    cache = http_cache.get_cache()
+    if cache is not None and method.upper() == "GET" and not kwargs.get("stream"):
+        return _cached_get(cache, url, timeout, retries, adaptive, **kwargs)
+    return _send(method, url, timeout, retries, adaptive, **kwargs)
+
+
+def _cached_get(
+    cache: http_cache.HTTPCache,
+    url: str,
+    timeout: float,
+    retries: Optional[int],
+    adaptive: bool,
+    params=None,
+    headers: Optional[dict] = None,
+    **kwargs,
+) -> requests.Response:
+    url = requests.Request("GET", url, params=params).prepare().url
+    headers = dict(headers or {})
+    request_headers = CaseInsensitiveDict(get_session().headers)
+    request_headers.update(headers)
+    if "no-store" in (request_headers.get("Cache-Control") or ""):
+        return _send("GET", url, timeout, retries, adaptive, headers=headers, **kwargs)
+    entry = cache.lookup(url, request_headers)
+    if entry is not None and cache.is_fresh(entry):
+        metrics.inc("http_cache_total", result="fresh")
+        status = 304 if http_cache.matches_conditional(entry, request_headers) else None
+        return http_cache.to_response(entry, url, status)
+    # A caller sending its own validators (feed_cache) handles the 304 itself
+    revalidate = entry is not None and not any(h in request_headers for h in http_cache.CONDITIONAL_HEADERS)
+    if revalidate:
+        headers.update(http_cache.validators(entry))
+    r = _send("GET", url, timeout, retries, adaptive, headers=headers, **kwargs)
+    if revalidate and r.status_code == 304:
+        metrics.inc("http_cache_total", result="revalidated")
+        return http_cache.to_response(cache.refresh(url, entry, r), url)
+    metrics.inc("http_cache_total", result="miss")
+    cache.store(url, request_headers, r)
+    return r
+
+
+def _send(
+    method: str,
+    url: str,
+    timeout: float,
+    retries: Optional[int],
+    adaptive: bool,
+    **kwargs,
+) -> requests.Response:
+    state = host_state(url)
+    retries = default_retries(method) if retries is None else retries
+    attempt = 0
+    while True:
+        check(state)
+        started = time.monotonic()
+        used = state.timeout(timeout) if adaptive else timeout
+        try:
+            r = get_session().request(method, url, timeout=used, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            state.record(False, used if isinstance(e, requests.Timeout) else None)
+            if attempt >= retries:
+                raise
+            delay = retry_delay(attempt)
+            logger.debug("Retrying %s %s after %s", method, url, e)
+        except Exception:
+            state.record(None)
+            raise
+        else:
+            failed = r.status_code >= 500
+            state.record(not failed, time.monotonic() - started)
+            if not failed and r.status_code != 429:
+                return r
+            delay = retry_delay(attempt, r.status_code, r.headers.get("Retry-After"))
+            if attempt >= retries or delay is None:
+                return r
+            r.close()
+        metrics.inc("http_retries_total", host=state.host)
+        time.sleep(delay)
+        attempt += 1
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
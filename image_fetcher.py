@@ -1,18 +1,36 @@
 """Get image URL for a news item: RSS media first, then og:image from article page."""
 import logging
 import re
-from typing import Any, Optional
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from html.parser import HTMLParser
+from typing import Optional
 from urllib.parse import urljoin, urlparse
 
-import requests
-from bs4 import BeautifulSoup
-
-from config import DEFAULT_IMAGE_URL, FETCH_OG_IMAGE
+from config import (
+    DEFAULT_IMAGE_URL,
+    FETCH_OG_IMAGE,
+    IMAGE_FETCH_DEADLINE,
+    IMAGE_FETCH_WORKERS,
+    OG_IMAGE_CACHE_FILE,
+    OG_IMAGE_CACHE_TTL_HOURS,
+)
+import http_client
+import metrics
+from disk_cache import MISSING, DiskCache
+from news_item import NewsItem
 
 logger = logging.getLogger(__name__)
 
 TIMEOUT = 10
 USER_AGENT = "CryptoNewsBot/1.0 (Telegram)"
+# Article pages are streamed until </head> or this many bytes
+HEAD_MAX_BYTES = 256 * 1024
+CHUNK_SIZE = 16 * 1024
+_HEAD_END = re.compile(rb"</head\s*>", re.I)
+_META_KEYS = ("og:image", "twitter:image")
 
 
 def _is_https_url(url: Optional[str]) -> bool:
@@ -22,101 +40,247 @@ def _is_https_url(url: Optional[str]) -> bool:
     return parsed.scheme == "https" and bool(parsed.netloc)
 
 
-def _image_from_rss_entry(entry: Any) -> Optional[str]:
-    """Extract image URL from feedparser entry: media_content, media_thumbnail, enclosures."""
-    # media_content (e.g. Media RSS)
-    media = getattr(entry, "media_content", None) or entry.get("media_content") if hasattr(entry, "get") else None
-    if media and isinstance(media, list):
-        for m in media:
-            if isinstance(m, dict):
-                href = m.get("url") or m.get("href")
-                mtype = (m.get("type") or "").lower()
-                if href and ("image" in mtype or mtype.startswith("image/")):
-                    if _is_https_url(href):
-                        return href.strip()
-            elif getattr(m, "get", None):
-                href = m.get("url") or m.get("href")
-                if href and _is_https_url(href):
-                    return href.strip()
-
-    # media_thumbnail
-    thumb = getattr(entry, "media_thumbnail", None) or (entry.get("media_thumbnail") if hasattr(entry, "get") else None)
-    if thumb and isinstance(thumb, list) and len(thumb) > 0:
-        t = thumb[0]
-        href = t.get("url") if isinstance(t, dict) else getattr(t, "url", None)
-        if _is_https_url(href):
-            return href.strip()
-
-    # enclosures (image/*)
-    enclosures = getattr(entry, "enclosures", None) or []
-    for enc in enclosures:
-        href = enc.get("href") if isinstance(enc, dict) else getattr(enc, "href", None)
-        enc_type = (enc.get("type") or getattr(enc, "type", "") or "").lower()
-        if href and ("image" in enc_type or enc_type.startswith("image/")):
-            if _is_https_url(href):
-                return href.strip()
-
-    # Some feeds put image in summary/content as first <img>
-    summary = getattr(entry, "summary", None) or entry.get("summary", "") or ""
-    if isinstance(summary, str):
-        match = re.search(r'<img[^>]+src=["\']([^"\']+)["\']', summary, re.I)
-        if match:
-            url = match.group(1).strip()
-            if _is_https_url(url):
+def _image_from_candidates(candidates: tuple[str, ...]) -> Optional[str]:
+    """First usable (https) image URL among the item's feed image candidates."""
+    for url in candidates:
+        if _is_https_url(url):
+            return url.strip()
+    return None
+
+
+class _HeadMetaParser(HTMLParser):
+    """Collect og:image / twitter:image meta tags; stops caring after </head>."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.images: dict[str, str] = {}
+        self.head_closed = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "body":
+            self.head_closed = True
+        if tag != "meta" or self.head_closed:
+            return
+        a = dict(attrs)
+        key = (a.get("property") or a.get("name") or "").strip().lower()
+        content = (a.get("content") or "").strip()
+        if key in _META_KEYS and content and key not in self.images:
+            self.images[key] = content
+
+    def handle_endtag(self, tag):
+        if tag == "head":
+            self.head_closed = True
+
+
+def _read_head(article_url: str) -> Optional[tuple[str, str]]:
+    """
+    Stream the article and return (final url, decoded HTML up to </head>).
+    Stops at </head> or after HEAD_MAX_BYTES.
+    """
+    # No retries: the lookup has its own deadline and falls back to the default image
+    with http_client.get(
+        article_url,
+        headers={"User-Agent": USER_AGENT},
+        timeout=TIMEOUT,
+        retries=0,
+        allow_redirects=True,
+        stream=True,
+    ) as r:
+        r.raise_for_status()
+        buf = bytearray()
+        for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+            buf.extend(chunk)
+            if _HEAD_END.search(buf, max(0, len(buf) - len(chunk) - 8)) or len(buf) >= HEAD_MAX_BYTES:
+                break
+        encoding = r.encoding or "utf-8"
+        return r.url or article_url, bytes(buf[:HEAD_MAX_BYTES]).decode(encoding, errors="replace")
+
+
+def _resolve(base_url: str, url: str) -> Optional[str]:
+    url = url.strip()
+    if _is_https_url(url):
+        return url
+    url = urljoin(base_url, url)
+    return url if _is_https_url(url) else None
+
+
+def _og_image_from_html(base_url: str, html: str) -> Optional[str]:
+    """Pick og:image (then twitter:image) from page head; BeautifulSoup only if the light parser finds nothing."""
+    parser = _HeadMetaParser()
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception as e:
+        logger.debug("Head parser failed for %s: %s", base_url, e)
+    for key in _META_KEYS:
+        if parser.images.get(key):
+            url = _resolve(base_url, parser.images[key])
+            if url:
+                return url
+
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    for key in _META_KEYS:
+        tag = soup.find("meta", property=key) or soup.find("meta", attrs={"name": key})
+        if tag and tag.get("content"):
+            url = _resolve(base_url, tag["content"])
+            if url:
                 return url
-            # try absolute
-            link = getattr(entry, "link", None) or entry.get("link", "")
-            if link:
-                abs_url = urljoin(link, url)
-                if _is_https_url(abs_url):
-                    return abs_url
     return None
 
 
+_og_cache: Optional[DiskCache] = None
+_og_cache_lock = threading.Lock()
+
+
+def _get_og_cache() -> DiskCache:
+    global _og_cache
+    if _og_cache is None:
+        with _og_cache_lock:
+            if _og_cache is None:
+                _og_cache = DiskCache(
+                    OG_IMAGE_CACHE_FILE, ttl_seconds=OG_IMAGE_CACHE_TTL_HOURS * 3600, max_entries=5000, name="og_image"
+                )
+    return _og_cache
+
+
 def _og_image_from_url(article_url: str) -> Optional[str]:
-    """Fetch article page and extract og:image meta."""
+    """Read the article head and extract og:image meta. Hits and misses are cached per URL."""
     if not _is_https_url(article_url):
         return None
+    cache = _get_og_cache()
+    cached = cache.get(article_url)
+    if cached is not MISSING:
+        return cached
+    url = None
     try:
-        r = requests.get(
-            article_url,
-            headers={"User-Agent": USER_AGENT},
-            timeout=TIMEOUT,
-            allow_redirects=True,
-        )
-        r.raise_for_status()
-        soup = BeautifulSoup(r.text[:500000], "html.parser")
-        tag = soup.find("meta", property="og:image") or soup.find("meta", attrs={"name": "og:image"})
-        if tag and tag.get("content"):
-            url = tag["content"].strip()
-            if _is_https_url(url):
-                return url
-            url = urljoin(article_url, url)
-            if _is_https_url(url):
-                return url
+        final_url, html = _read_head(article_url)
+        url = _og_image_from_html(final_url, html)
     except Exception as e:
         logger.debug("og:image fetch failed for %s: %s", article_url, e)
-    return None
+        # Network errors are not cached so the next run can retry
+        return None
+    cache.set(article_url, url)
+    return url
+
 
+async def _og_image_from_url_async(http, article_url: str) -> Optional[str]:
+    if not _is_https_url(article_url):
+        return None
+    cache = _get_og_cache()
+    cached = cache.get(article_url)
+    if cached is not MISSING:
+        return cached
+    try:
+        async with http.limit("images", IMAGE_FETCH_WORKERS):
+            final_url, html = await http.read_head(
+                article_url,
+                headers={"User-Agent": USER_AGENT},
+                timeout=TIMEOUT,
+                max_bytes=HEAD_MAX_BYTES,
+                stop=_HEAD_END,
+            )
+        url = _og_image_from_html(final_url, html)
+    except Exception as e:
+        logger.debug("og:image fetch failed for %s: %s", article_url, e)
+        return None
+    cache.set(article_url, url)
+    return url
 
-def get_image_url(item: dict) -> Optional[str]:
+
+def get_image_url(item: NewsItem) -> Optional[str]:
     """
     Return an image URL for the news item, or None.
-    item must have "link" and optionally "entry" (raw feedparser entry).
-    Uses: RSS media -> og:image (if FETCH_OG_IMAGE) -> DEFAULT_IMAGE_URL.
+    Uses: RSS media (item.image_candidates) -> og:image (if FETCH_OG_IMAGE) -> DEFAULT_IMAGE_URL.
     """
-    entry = item.get("entry")
-    if entry:
-        url = _image_from_rss_entry(entry)
+    with metrics.timed("image_lookup_seconds") as labels:
+        url = _image_from_candidates(item.image_candidates)
         if url:
+            labels["source"] = "rss"
             return url
 
-    link = (item.get("link") or "").strip()
-    if link and FETCH_OG_IMAGE:
-        url = _og_image_from_url(link)
+        link = item.link.strip()
+        if link and FETCH_OG_IMAGE:
+            url = _og_image_from_url(link)
+            if url:
+                labels["source"] = "og"
+                return url
+
+        url = default_image_url()
+        labels["source"] = "default" if url else "none"
+        return url
+
+
+async def get_image_url_async(item: NewsItem, http, deadline: float = IMAGE_FETCH_DEADLINE) -> Optional[str]:
+    """
+    get_image_url() for the async runtime (http: aio_http.AsyncHTTP); article
+    reads share the "images" limit. On timeout or error return the default image.
+    """
+    import asyncio
+
+    with metrics.timed("image_lookup_seconds") as labels:
+        url = _image_from_candidates(item.image_candidates)
         if url:
+            labels["source"] = "rss"
             return url
 
+        link = item.link.strip()
+        if link and FETCH_OG_IMAGE:
+            try:
+                url = await asyncio.wait_for(_og_image_from_url_async(http, link), timeout=deadline)
+            except asyncio.TimeoutError:
+                logger.info("Image lookup missed deadline, using default: %s", link)
+            except Exception as e:
+                logger.warning("Image lookup failed for %s: %s", link, e)
+            if url:
+                labels["source"] = "og"
+                return url
+
+        url = default_image_url()
+        labels["source"] = "default" if url else "none"
+        return url
+
+
+def default_image_url() -> Optional[str]:
+    """DEFAULT_IMAGE_URL if it is a usable https URL, else None."""
     if DEFAULT_IMAGE_URL and _is_https_url(DEFAULT_IMAGE_URL):
         return DEFAULT_IMAGE_URL
     return None
+
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=max(1, IMAGE_FETCH_WORKERS), thread_name_prefix="image")
+    return _pool
+
+
+class ImageLookup:
+    """A get_image_url call running in the background, with its own deadline."""
+
+    def __init__(self, item: NewsItem, deadline: float = IMAGE_FETCH_DEADLINE):
+        self.link = item.link
+        self.expires_at = time.monotonic() + deadline
+        self._future: Future = _get_pool().submit(get_image_url, item)
+
+    def result(self) -> Optional[str]:
+        """Wait until the lookup's deadline at most; on timeout or error return the default image."""
+        try:
+            return self._future.result(timeout=max(0.0, self.expires_at - time.monotonic()))
+        except FutureTimeout:
+            logger.info("Image lookup missed deadline, using default: %s", self.link)
+        except Exception as e:
+            logger.warning("Image lookup failed for %s: %s", self.link, e)
+        return default_image_url()
+
+
+def prefetch_images(items: list[NewsItem]) -> list[ImageLookup]:
+    """Start image lookups for all items in parallel; call .result() on each when needed."""
+    return [ImageLookup(item) for item in items]
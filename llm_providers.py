@@ -0,0 +1,200 @@
+"""LLM provider layer: long-lived pooled clients, per-provider rate limits, concurrent execution."""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Any, Callable, Optional
+
+from config import (
+    GROQ_API_KEY,
+    GROQ_RPM,
+    OLLAMA_BASE_URL,
+    OLLAMA_RPM,
+    OPENAI_API_KEY,
+    OPENAI_RPM,
+    REWRITE_CONCURRENCY,
+)
+import http_client
+import metrics
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+OPENAI_MODEL = "gpt-4o-mini"
+GROQ_MODEL = "llama-3.1-8b-instant"
+OLLAMA_MODEL = "llama3.2"
+MODELS = {"openai": OPENAI_MODEL, "groq": GROQ_MODEL, "ollama": OLLAMA_MODEL}
+# SDK package per provider; imported once, when the provider's client is first created
+SDK_MODULES = {"openai": "openai", "groq": "groq"}
+
+OLLAMA_TIMEOUT = 120
+# Ceiling of the adaptive per-attempt timeout for OpenAI / Groq (the SDK default is 600s)
+SDK_TIMEOUT = 60
+
+_clients: dict[str, Any] = {}
+_clients_lock = threading.Lock()
+
+# Requests per minute -> tokens per second; a burst of up to REWRITE_CONCURRENCY calls is allowed
+_limiters = {
+    "openai": TokenBucket(OPENAI_RPM / 60.0, capacity=max(1, REWRITE_CONCURRENCY)),
+    "groq": TokenBucket(GROQ_RPM / 60.0, capacity=max(1, REWRITE_CONCURRENCY)),
+    "ollama": TokenBucket(OLLAMA_RPM / 60.0, capacity=max(1, REWRITE_CONCURRENCY)),
+}
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _new_client(provider: str) -> Any:
+    if provider == "openai":
+        from openai import OpenAI
+        return OpenAI(api_key=OPENAI_API_KEY)
+    if provider == "groq":
+        from groq import Groq
+        return Groq(api_key=GROQ_API_KEY)
+    raise ValueError(f"Unknown provider: {provider}")
+
+
+def get_client(provider: str) -> Any:
+    """Return the process-wide SDK client for provider, creating it once (ollama uses http_client)."""
+    client = _clients.get(provider)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(provider)
+            if client is None:
+                client = _new_client(provider)
+                _clients[provider] = client
+    return client
+
+
+def _call_sdk(provider: str, label: str, messages: list[dict], max_tokens: int) -> Optional[str]:
+    """
+    SDK chat completion behind the API host's circuit breaker, with the host's
+    adaptive timeout (up to SDK_TIMEOUT) per attempt; the SDK does its own retries.
+    """
+    client = get_client(provider)
+    # The SDK's base_url, which may come from its environment (e.g. OPENAI_BASE_URL)
+    state = http_client.host_state(str(client.base_url))
+    try:
+        http_client.check(state)
+    except http_client.CircuitOpenError as e:
+        logger.warning("%s rewrite skipped: %s", label, e)
+        return None
+    used = state.timeout(SDK_TIMEOUT)
+    started = time.monotonic()
+    try:
+        resp = client.chat.completions.create(
+            model=MODELS[provider],
+            messages=messages,
+            max_tokens=max_tokens,
+            timeout=used,
+        )
+    except Exception as e:
+        # An API error below 500 (bad request, auth, rate limit) still means the host is up;
+        # a timeout counts as a sample at its timeout, like http_client's
+        status = getattr(e, "status_code", None)
+        timed_out = type(e).__name__ == "APITimeoutError"
+        state.record(status is not None and status < 500, used if timed_out else None)
+        logger.exception("%s rewrite failed: %s", label, e)
+        return None
+    state.record(True, time.monotonic() - started)
+    return (resp.choices[0].message.content or "").strip() or None
+
+
+def _call_openai(messages: list[dict], max_tokens: int = 400) -> Optional[str]:
+    return _call_sdk("openai", "OpenAI", messages, max_tokens)
+
+
+def _call_groq(messages: list[dict], max_tokens: int = 400) -> Optional[str]:
+    return _call_sdk("groq", "Groq", messages, max_tokens)
+
+
+def _call_ollama(messages: list[dict], max_tokens: int = 400) -> Optional[str]:
+    try:
+        url = f"{OLLAMA_BASE_URL}/api/chat"
+        payload = {
+            "model": OLLAMA_MODEL,
+            "messages": messages,
+            "stream": False,
+            "options": {"num_predict": max_tokens},
+        }
+        # Generation time depends on the prompt, not the host: no adaptive timeout
+        r = http_client.post(url, json=payload, timeout=OLLAMA_TIMEOUT, adaptive=False)
+        r.raise_for_status()
+        data = r.json()
+        return (data.get("message", {}).get("content") or "").strip() or None
+    except http_client.CircuitOpenError as e:
+        logger.warning("Ollama rewrite skipped: %s", e)
+        return None
+    except Exception as e:
+        logger.exception("Ollama rewrite failed: %s", e)
+        return None
+
+
+def chat(provider: str, messages: list[dict], max_tokens: int = 400) -> Optional[str]:
+    """Send one chat completion to provider, respecting its rate limit. Returns the reply text or None."""
+    if provider == "openai":
+        if not OPENAI_API_KEY:
+            logger.error("OPENAI_API_KEY not set")
+            return None
+        call = _call_openai
+    elif provider == "groq":
+        if not GROQ_API_KEY:
+            logger.error("GROQ_API_KEY not set")
+            return None
+        call = _call_groq
+    elif provider == "ollama":
+        call = _call_ollama
+    else:
+        logger.error("Unknown REWRITE_PROVIDER: %s", provider)
+        return None
+    _limiters[provider].acquire()
+    with metrics.timed("llm_request_seconds", provider=provider):
+        text = call(messages, max_tokens)
+    if text is None:
+        metrics.inc("llm_errors_total", provider=provider)
+    return text
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max(1, REWRITE_CONCURRENCY), thread_name_prefix="llm")
+    return _executor
+
+
+def run_concurrently(fn: Callable[..., Any], calls: list[tuple], deadline: Optional[float] = None) -> list[Any]:
+    """
+    Run fn(*args) for each args tuple on the shared bounded executor and return
+    results in input order. A call that raises yields None. With a deadline
+    (time.monotonic()), calls not finished by then yield None too; those not
+    started yet are cancelled, running ones finish in the background.
+    """
+    if deadline is None and (len(calls) <= 1 or REWRITE_CONCURRENCY <= 1):
+        results = []
+        for args in calls:
+            try:
+                results.append(fn(*args))
+            except Exception as e:
+                logger.exception("LLM task failed: %s", e)
+                results.append(None)
+        return results
+    futures = [_get_executor().submit(fn, *args) for args in calls]
+    results = []
+    late = 0
+    for fut in futures:
+        try:
+            results.append(fut.result(timeout=None if deadline is None else max(0.0, deadline - time.monotonic())))
+        except FutureTimeout:
+            fut.cancel()
+            late += 1
+            results.append(None)
+        except Exception as e:
+            logger.exception("LLM task failed: %s", e)
+            results.append(None)
+    if late:
+        logger.warning("%d/%d LLM calls missed the deadline", late, len(calls))
+    return results
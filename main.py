@@ -1,13 +1,16 @@
-"""Entrypoint: load config, run scheduler or single job (--run-once)."""
-import argparse
-import logging
-import sys
-from pathlib import Path
+"""Entrypoint: load config, run scheduler or single job (--run-once); --async for the asyncio runtime."""
+import time
 
-from apscheduler.schedulers.blocking import BlockingScheduler
+_STARTED = time.perf_counter()
 
-from config import POST_INTERVAL_MINUTES
-from scheduler import run_job
+import argparse  # noqa: E402 - imports after the start mark so the startup report includes them
+import importlib  # noqa: E402
+import logging  # noqa: E402
+import sys  # noqa: E402
+from pathlib import Path  # noqa: E402
+
+import metrics  # noqa: E402
+from config import METRICS_HOST, METRICS_PORT, POST_INTERVAL_MINUTES, REWRITE_PROVIDER  # noqa: E402
 
 LOG_DIR = Path(__file__).resolve().parent / "logs"
 LOG_FILE = LOG_DIR / "bot.log"
@@ -28,6 +31,39 @@ def setup_logging() -> None:
     )
 
 
+def _timed_import(name: str) -> tuple[float, list[str]]:
+    """Import name; return seconds taken and the top-level packages it newly loaded."""
+    before = {m.split(".")[0] for m in sys.modules}
+    started = time.perf_counter()
+    importlib.import_module(name)
+    elapsed = time.perf_counter() - started
+    loaded = sorted({m.split(".")[0] for m in sys.modules} - before - {name})
+    return elapsed, loaded
+
+
+def startup_report() -> None:
+    """
+    Print import times for what a --run-once run loads: the entrypoint, the scheduler,
+    each enabled stage's modules and the rewrite provider's SDK. A module's time includes
+    any dependency it is the first to import. Run in a fresh process for cold numbers.
+    """
+    rows = [("main (entrypoint)", time.perf_counter() - _STARTED, [])]
+    rows.append(("scheduler", *_timed_import("scheduler")))
+    import scheduler
+    from llm_providers import SDK_MODULES
+
+    for name in scheduler.stage_modules():
+        rows.append((name, *_timed_import(name)))
+    sdk = SDK_MODULES.get(REWRITE_PROVIDER)
+    if sdk:
+        rows.append((f"{sdk} (SDK)", *_timed_import(sdk)))
+
+    print(f"{'module':<28} {'ms':>8}  newly loaded")
+    for name, seconds, loaded in rows:
+        print(f"{name:<28} {seconds * 1000:>8.1f}  {', '.join(loaded)}")
+    print(f"{'total':<28} {(time.perf_counter() - _STARTED) * 1000:>8.1f}  ({len(sys.modules)} modules)")
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(description="Crypto news Telegram bot")
     parser.add_argument(
@@ -35,16 +71,50 @@ def main() -> None:
         action="store_true",
         help="Run one fetch/rewrite/post cycle then exit (for testing)",
     )
+    parser.add_argument(
+        "--startup-report",
+        action="store_true",
+        help="Print per-module import times for a --run-once cold start, then exit",
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="Run on an asyncio event loop with shared aiohttp connection pools instead of threads",
+    )
     args = parser.parse_args()
 
+    if args.startup_report:
+        startup_report()
+        return
+
     setup_logging()
     logger = logging.getLogger(__name__)
+    if METRICS_PORT:
+        metrics.start_http_server(METRICS_PORT, METRICS_HOST)
+
+    if args.use_async:
+        import asyncio
+
+        from scheduler import run_async
+
+        if args.run_once:
+            logger.info("Running single job (--run-once, --async)")
+            asyncio.run(run_async())
+        else:
+            logger.info("Async scheduler started: every %s minutes", POST_INTERVAL_MINUTES)
+            asyncio.run(run_async(POST_INTERVAL_MINUTES))
+        return
+
+    from scheduler import run_job
 
     if args.run_once:
         logger.info("Running single job (--run-once)")
         run_job()
         return
 
+    from apscheduler.schedulers.blocking import BlockingScheduler
+
     scheduler = BlockingScheduler()
     scheduler.add_job(run_job, "interval", minutes=POST_INTERVAL_MINUTES, id="crypto_news")
     logger.info("Scheduler started: every %s minutes", POST_INTERVAL_MINUTES)
@@ -1,14 +1,14 @@
-"""Fetch top crypto prices and 24h changes from CoinGecko (free, no API key)."""
+"""Format top crypto prices and 24h changes from CoinGecko (via the shared price oracle)."""
 import logging
 from typing import Optional
 
-import requests
+import metrics
+from price_oracle import get_markets, get_markets_async, register_coins
 
 logger = logging.getLogger(__name__)
 
-COINGECKO_URL = "https://api.coingecko.com/api/v3/coins/markets"
 COINS = ["bitcoin", "ethereum", "solana", "bnb"]
-TIMEOUT = 15
+register_coins(COINS)
 
 
 def get_market_snapshot() -> tuple[Optional[str], Optional[str]]:
@@ -16,26 +16,20 @@ def get_market_snapshot() -> tuple[Optional[str], Optional[str]]:
     Fetch top 3-4 coins and return formatted string with emojis + chart image URL.
     Returns (text, image_url) tuple.
     """
-    try:
-        r = requests.get(
-            COINGECKO_URL,
-            params={
-                "vs_currency": "usd",
-                "ids": ",".join(COINS),
-                "order": "market_cap_desc",
-                "per_page": 4,
-                "page": 1,
-                "sparkline": False,
-                "price_change_percentage": "24h",
-            },
-            timeout=TIMEOUT,
-        )
-        r.raise_for_status()
-        data = r.json()
-    except Exception as e:
-        logger.exception("CoinGecko fetch failed: %s", e)
-        return None, None
+    with metrics.timed("market_snapshot_seconds"):
+        data = get_markets(COINS)
+    return format_snapshot(data)
+
+
+async def get_market_snapshot_async(http) -> tuple[Optional[str], Optional[str]]:
+    """get_market_snapshot() for the async runtime (http: aio_http.AsyncHTTP)."""
+    with metrics.timed("market_snapshot_seconds"):
+        data = await get_markets_async(COINS, http)
+    return format_snapshot(data)
+
 
+def format_snapshot(data: list[dict]) -> tuple[Optional[str], Optional[str]]:
+    """Format market rows as (text, image_url); (None, None) without data."""
     if not data:
         return None, None
 
@@ -0,0 +1,228 @@
+"""In-process metrics: latency histograms and counters, Prometheus text export, per-run JSON summary.
+
+Metrics are cumulative for the process (served on METRICS_PORT, if set) and also
+collected per run_job tick (begin_run / end_run), which appends one JSON line to
+METRICS_SUMMARY_FILE.
+"""
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# Raw samples kept per histogram series for the per-run percentiles
+MAX_RUN_SAMPLES = 10_000
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def _labels(kwargs: dict) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in kwargs.items()))
+
+
+def _fmt_labels(labels: Labels, extra: Optional[tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    inner = ",".join(f'{k}="{v}"'.replace("\n", " ") for k, v in pairs)
+    return "{" + inner + "}"
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Counters and histograms keyed by (name, labels)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: dict[tuple[str, Labels], float] = {}
+        self.histograms: dict[tuple[str, Labels], _Histogram] = {}
+        self.samples: dict[tuple[str, Labels], list[float]] = {}
+
+    def inc(self, name: str, amount: float, labels: Labels) -> None:
+        with self._lock:
+            self.counters[(name, labels)] = self.counters.get((name, labels), 0.0) + amount
+
+    def observe(self, name: str, value: float, labels: Labels, keep_samples: bool = False) -> None:
+        with self._lock:
+            hist = self.histograms.get((name, labels))
+            if hist is None:
+                hist = self.histograms[(name, labels)] = _Histogram()
+            hist.observe(value)
+            if keep_samples:
+                samples = self.samples.setdefault((name, labels), [])
+                if len(samples) < MAX_RUN_SAMPLES:
+                    samples.append(value)
+
+    def render(self) -> str:
+        """Prometheus text exposition format."""
+        lines: list[str] = []
+        with self._lock:
+            seen: set[str] = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} counter")
+                    seen.add(name)
+                lines.append(f"{name}{_fmt_labels(labels)} {value:g}")
+            for (name, labels), hist in sorted(self.histograms.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} histogram")
+                    seen.add(name)
+                for bound, count in zip(BUCKETS, hist.counts):
+                    lines.append(f"{name}_bucket{_fmt_labels(labels, ('le', f'{bound:g}'))} {count}")
+                lines.append(f"{name}_bucket{_fmt_labels(labels, ('le', '+Inf'))} {hist.count}")
+                lines.append(f"{name}_sum{_fmt_labels(labels)} {hist.sum:.6f}")
+                lines.append(f"{name}_count{_fmt_labels(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> dict:
+        """JSON-friendly view: counters, histogram percentiles and cache hit rates."""
+        with self._lock:
+            counters = {
+                f"{name}{_fmt_labels(labels)}": value for (name, labels), value in sorted(self.counters.items())
+            }
+            histograms = {}
+            for (name, labels), hist in sorted(self.histograms.items()):
+                samples = sorted(self.samples.get((name, labels), []))
+                entry = {"count": hist.count, "sum": round(hist.sum, 6)}
+                if samples:
+                    entry.update({
+                        "p50": samples[int(0.50 * (len(samples) - 1))],
+                        "p95": samples[int(0.95 * (len(samples) - 1))],
+                        "max": samples[-1],
+                    })
+                histograms[f"{name}{_fmt_labels(labels)}"] = entry
+            hit_rates = {}
+            for (name, labels), value in self.counters.items():
+                if name != "cache_requests_total":
+                    continue
+                d = dict(labels)
+                stats = hit_rates.setdefault(d.get("cache", ""), {"hits": 0.0, "misses": 0.0})
+                stats["hits" if d.get("result") == "hit" else "misses"] += value
+            for stats in hit_rates.values():
+                total = stats["hits"] + stats["misses"]
+                stats["hit_rate"] = stats["hits"] / total if total else 0.0
+        return {"counters": counters, "histograms": histograms, "cache_hit_rates": hit_rates}
+
+
+_process = Registry()
+_run: Optional[Registry] = None
+_run_started: Optional[float] = None
+
+
+def inc(name: str, amount: float = 1.0, **labels) -> None:
+    """Increment counter `name` (use a *_total name)."""
+    key = _labels(labels)
+    _process.inc(name, amount, key)
+    run = _run
+    if run is not None:
+        run.inc(name, amount, key)
+
+
+def observe(name: str, value: float, **labels) -> None:
+    """Record `value` (seconds) in histogram `name`."""
+    key = _labels(labels)
+    _process.observe(name, value, key)
+    run = _run
+    if run is not None:
+        run.observe(name, value, key, keep_samples=True)
+
+
+@contextmanager
+def timed(name: str, **labels) -> Iterator[dict]:
+    """
+    Time the block into histogram `name`; an exception also increments `<name>_errors_total`.
+    The yielded dict may be updated to add labels decided inside the block (e.g. result="hit").
+    """
+    extra: dict = {}
+    started = time.perf_counter()
+    try:
+        yield extra
+    except Exception:
+        inc(f"{name}_errors_total", **labels)
+        raise
+    finally:
+        observe(name, time.perf_counter() - started, **{**labels, **extra})
+
+
+def cache_result(cache: str, hit: bool) -> None:
+    inc("cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+
+def render() -> str:
+    return _process.render()
+
+
+def begin_run() -> None:
+    """Start collecting a per-run summary (alongside the process-wide metrics)."""
+    global _run, _run_started
+    _run = Registry()
+    _run_started = time.time()
+
+
+def end_run(path: Optional[Path] = None) -> Optional[dict]:
+    """Finish the current run; append its summary as one JSON line to path (if given) and return it."""
+    global _run, _run_started
+    run, started = _run, _run_started
+    _run, _run_started = None, None
+    if run is None or started is None:
+        return None
+    summary = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started)),
+        "duration_seconds": round(time.time() - started, 3),
+        **run.summary(),
+    }
+    if path is not None:
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(summary, ensure_ascii=False) + "\n")
+        except Exception as e:
+            logger.warning("Could not write run metrics: %s", e)
+    return summary
+
+
+def start_http_server(port: int, host: str = "127.0.0.1") -> Any:
+    """Serve Prometheus text metrics on http://host:port/metrics from a daemon thread."""
+    # Imported here: http.server is only needed when the endpoint is enabled
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):  # noqa: A002 - keep scrapes out of the bot log
+            pass
+
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("Metrics endpoint on http://%s:%s/metrics", host, port)
+    return server
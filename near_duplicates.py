@@ -0,0 +1,301 @@
+"""Near-duplicate story detection with 64-bit SimHash fingerprints.
+
+A story's fingerprint is built from word shingles of its normalized title and
+summary; two stories whose fingerprints differ in at most NEAR_DUP_MAX_DISTANCE
+bits are treated as the same story. Fingerprints are split into
+NEAR_DUP_MAX_DISTANCE + 1 bands, and any two fingerprints within that distance
+share at least one band exactly, so a lookup only compares against stories in
+matching band buckets instead of the whole history.
+
+Posted stories are kept in SQLite (bounded by count and age) and loaded into
+memory once per process, like the posted links store.
+"""
+import atexit
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from config import (
+    NEAR_DUP_DB,
+    NEAR_DUP_MAX_DISTANCE,
+    NEAR_DUP_MAX_STORED,
+    NEAR_DUP_WINDOW_HOURS,
+)
+import metrics
+from news_item import NewsItem
+
+logger = logging.getLogger(__name__)
+
+BITS = 64
+# Word shingles; single words keep copies with light edits (reordered clauses, added words) close
+SHINGLE_SIZE = 1
+# Title words count more than summary words: titles are what the wire copies share
+TITLE_WEIGHT = 3
+SUMMARY_WORDS = 60
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_WORD_RE = re.compile(r"[a-z0-9$]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in into is it its of on or says that the this to "
+    "was were will with after over amid new news".split()
+)
+
+
+def _words(text: str) -> list[str]:
+    text = _TAG_RE.sub(" ", (text or "").lower())
+    return [w for w in _WORD_RE.findall(text) if w not in _STOPWORDS]
+
+
+def _shingles(words: list[str]) -> list[str]:
+    if len(words) < SHINGLE_SIZE:
+        return words
+    return [" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)]
+
+
+def _hash64(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def simhash(title: str, summary: str = "") -> int:
+    """64-bit SimHash over weighted title and summary shingles (0 if there is no text)."""
+    weights: dict[str, int] = {}
+    for s in _shingles(_words(title)):
+        weights[s] = weights.get(s, 0) + TITLE_WEIGHT
+    for s in _shingles(_words(summary)[:SUMMARY_WORDS]):
+        weights[s] = weights.get(s, 0) + 1
+    if not weights:
+        return 0
+    totals = [0] * BITS
+    for feature, weight in weights.items():
+        h = _hash64(feature)
+        for bit in range(BITS):
+            totals[bit] += weight if h >> bit & 1 else -weight
+    return sum(1 << bit for bit in range(BITS) if totals[bit] > 0)
+
+
+def distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def _band_layout(max_distance: int) -> list[tuple[int, int]]:
+    """(shift, mask) for each of max_distance + 1 bands covering the 64 bits."""
+    bands = max(1, min(max_distance + 1, BITS))
+    layout, start = [], 0
+    for i in range(bands):
+        width = BITS // bands + (1 if i < BITS % bands else 0)
+        layout.append((start, (1 << width) - 1))
+        start += width
+    return layout
+
+
+class _BandIndex:
+    """fingerprint -> payload, with band buckets for sublinear near-match lookups."""
+
+    def __init__(self, max_distance: int):
+        self.max_distance = max_distance
+        self._layout = _band_layout(max_distance)
+        self._buckets: dict[tuple[int, int], set[int]] = {}
+        self.items: dict[int, str] = {}
+
+    def _keys(self, fp: int) -> list[tuple[int, int]]:
+        return [(i, fp >> shift & mask) for i, (shift, mask) in enumerate(self._layout)]
+
+    def add(self, fp: int, payload: str) -> None:
+        if fp in self.items:
+            return
+        self.items[fp] = payload
+        for key in self._keys(fp):
+            self._buckets.setdefault(key, set()).add(fp)
+
+    def remove(self, fp: int) -> None:
+        if self.items.pop(fp, None) is None:
+            return
+        for key in self._keys(fp):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(fp)
+                if not bucket:
+                    del self._buckets[key]
+
+    def find(self, fp: int) -> Optional[int]:
+        """Closest stored fingerprint within max_distance, or None."""
+        best, best_d = None, self.max_distance + 1
+        for key in self._keys(fp):
+            for other in self._buckets.get(key, ()):
+                d = distance(fp, other)
+                if d < best_d:
+                    best, best_d = other, d
+        return best
+
+
+def _to_signed(fp: int) -> int:
+    # SQLite INTEGER is signed 64-bit
+    return fp - (1 << BITS) if fp >= 1 << (BITS - 1) else fp
+
+
+def _to_unsigned(value: int) -> int:
+    return value + (1 << BITS) if value < 0 else value
+
+
+class NearDuplicateIndex:
+    """Fingerprints of recently posted stories, persisted in SQLite and bounded by count and age."""
+
+    def __init__(
+        self,
+        db_path: Path = NEAR_DUP_DB,
+        max_distance: int = NEAR_DUP_MAX_DISTANCE,
+        max_stored: int = NEAR_DUP_MAX_STORED,
+        window_hours: float = NEAR_DUP_WINDOW_HOURS,
+    ):
+        self.db_path = db_path
+        self.max_distance = max_distance
+        self.max_stored = max_stored
+        self.window_seconds = window_hours * 3600
+        self._lock = threading.Lock()
+        self._index = _BandIndex(max_distance)
+        self._posted_at: dict[int, float] = {}
+        self._pending: list[tuple[int, str, float]] = []
+        self._conn = self._open()
+        self._load()
+
+    def _open(self) -> sqlite3.Connection:
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS stories ("
+            " fingerprint INTEGER PRIMARY KEY,"
+            " link TEXT NOT NULL,"
+            " posted_at REAL NOT NULL)"
+        )
+        conn.commit()
+        return conn
+
+    def _load(self) -> None:
+        cutoff = time.time() - self.window_seconds
+        rows = self._conn.execute(
+            "SELECT fingerprint, link, posted_at FROM stories WHERE posted_at >= ?"
+            " ORDER BY posted_at DESC LIMIT ?",
+            (cutoff, self.max_stored),
+        ).fetchall()
+        for value, link, posted_at in rows:
+            fp = _to_unsigned(value)
+            self._index.add(fp, link)
+            self._posted_at[fp] = posted_at
+
+    def find(self, fp: int) -> Optional[str]:
+        """Link of a recently posted story near fp, or None."""
+        if not fp:
+            return None
+        cutoff = time.time() - self.window_seconds
+        with self._lock:
+            match = self._index.find(fp)
+            if match is None or self._posted_at.get(match, 0.0) < cutoff:
+                return None
+            return self._index.items[match]
+
+    def add(self, fp: int, link: str) -> None:
+        if not fp:
+            return
+        now = time.time()
+        with self._lock:
+            self._index.remove(fp)
+            self._index.add(fp, link)
+            self._posted_at[fp] = now
+            self._pending.append((_to_signed(fp), link, now))
+            if len(self._posted_at) > self.max_stored:
+                for old in sorted(self._posted_at, key=self._posted_at.get)[: len(self._posted_at) - self.max_stored]:
+                    self._index.remove(old)
+                    del self._posted_at[old]
+
+    def flush(self) -> None:
+        """Commit pending fingerprints and trim the table to the window and size bound."""
+        with self._lock:
+            if not self._pending:
+                return
+            try:
+                with self._conn:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO stories (fingerprint, link, posted_at) VALUES (?, ?, ?)",
+                        self._pending,
+                    )
+                    self._conn.execute("DELETE FROM stories WHERE posted_at < ?", (time.time() - self.window_seconds,))
+                    self._conn.execute(
+                        "DELETE FROM stories WHERE fingerprint NOT IN ("
+                        " SELECT fingerprint FROM stories ORDER BY posted_at DESC LIMIT ?)",
+                        (self.max_stored,),
+                    )
+                self._pending.clear()
+            except Exception as e:
+                logger.exception("Could not save story fingerprints: %s", e)
+
+
+_index: Optional[NearDuplicateIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> NearDuplicateIndex:
+    """Return the process-wide index, opening it on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = NearDuplicateIndex()
+                atexit.register(_index.flush)
+    return _index
+
+
+def fingerprint(item: NewsItem) -> int:
+    return simhash(item.title, item.summary)
+
+
+def drop_near_duplicates(items: list[NewsItem]) -> tuple[list[NewsItem], list[int]]:
+    """
+    Collapse near-duplicate items (within this list and against recently posted
+    stories) to one representative per story: the one with the longest summary,
+    earlier items winning ties. Returns the kept items in input order with their fingerprints.
+    """
+    index = get_index()
+    fps = [fingerprint(item) for item in items]
+    run = _BandIndex(index.max_distance)
+    # Cluster representative (position in items) by fingerprint of the cluster's first member
+    best: dict[int, int] = {}
+    for pos, (item, fp) in enumerate(zip(items, fps)):
+        if not fp:
+            continue
+        posted = index.find(fp)
+        if posted:
+            logger.info("Skip (near-duplicate of posted %s): %s", posted, item.link)
+            metrics.inc("near_duplicates_total", scope="history")
+            fps[pos] = -1
+            continue
+        head = run.find(fp)
+        if head is None:
+            run.add(fp, "")
+            best[fp] = pos
+            continue
+        metrics.inc("near_duplicates_total", scope="run")
+        current = best[head]
+        if len(item.summary) > len(items[current].summary):
+            logger.info("Skip (near-duplicate): %s", items[current].link)
+            fps[current] = -1
+            best[head] = pos
+        else:
+            logger.info("Skip (near-duplicate): %s", item.link)
+            fps[pos] = -1
+    kept = [(item, fp) for item, fp in zip(items, fps) if fp != -1]
+    return [item for item, _ in kept], [fp for _, fp in kept]
+
+
+def remember_posted(fp: int, link: str) -> None:
+    get_index().add(fp, link)
+
+
+def flush() -> None:
+    get_index().flush()
@@ -1,77 +1,386 @@
-"""Fetch and parse RSS feeds; return list of news items (title, link, summary, source)."""
+"""Fetch and parse RSS feeds; return list of news items (title, link, summary, source).
+
+Each feed has a persisted watermark: the newest `published` time seen and the
+GUIDs at that time. Entries at or below it are skipped before any conversion or
+dedupe lookup, and a feed whose newest entry is the watermark is skipped whole.
+fetch_all fills a caller's `watermarks` dict with the new ones; commit_watermarks()
+saves them once the run has handled the items.
+"""
+import heapq
+import json
 import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
-from typing import Any
+from typing import Any, Callable, Iterable, Optional
 
 import feedparser
+import requests
 
-from config import RSS_FEED_URLS
+from config import (
+    ASYNC_FETCH_CONCURRENCY,
+    ENABLE_FEED_CACHE,
+    ENABLE_FEED_WATERMARKS,
+    FEED_WATERMARK_FILE,
+    RSS_FEED_TIMEOUT,
+    RSS_FEED_URLS,
+    RSS_FETCH_DEADLINE,
+    RSS_FETCH_WORKERS,
+)
+from feed_cache import get_cache
+import http_client
+import metrics
+from news_item import EPOCH, NewsItem, from_entry
 
 logger = logging.getLogger(__name__)
 
-# Default date for entries without published_parsed
-EPOCH = datetime(1970, 1, 1)
+USER_AGENT = "CryptoNewsBot/1.0"
+_NO_DATE = (0,) * 6
+
+# Pending watermarks, as filled in by fetch_all and saved by commit_watermarks():
+# {feed url: {"published": [y, m, d, H, M, S], "guids": [...], "candidates": [(published, link)]}}
 
 
 def _parse_date(entry: Any) -> datetime:
-    """Return parsed publication date or EPOCH if missing."""
-    if hasattr(entry, "published_parsed") and entry.published_parsed:
+    """Return parsed publication date (UTC) or EPOCH if missing."""
+    parsed = entry.get("published_parsed")
+    if parsed:
         try:
-            from time import mktime
-            return datetime.utcfromtimestamp(mktime(entry.published_parsed))
-        except (TypeError, OSError):
+            return datetime(*parsed[:6])
+        except (TypeError, ValueError):
             pass
     return EPOCH
 
 
-def _entry_to_item(entry: Any, source: str) -> dict:
-    """Convert feedparser entry to our item dict."""
-    link = (entry.get("link") or "").strip()
-    title = (entry.get("title") or "").strip() or "No title"
-    summary = ""
-    if entry.get("summary"):
-        summary = entry.get("summary", "").strip()
-    elif entry.get("description"):
-        summary = entry.get("description", "").strip()
-    # Strip HTML tags for plain text (simple approach)
-    if summary:
-        import re
-        summary = re.sub(r"<[^>]+>", " ", summary)
-        summary = " ".join(summary.split())[:500]
-    return {
-        "title": title,
-        "link": link,
-        "summary": summary,
-        "source": source,
-        "published": _parse_date(entry),
-        "entry": entry,  # keep raw entry for image_fetcher (media_content, etc.)
-    }
-
-
-def fetch_all(feed_urls: list[str] | None = None) -> list[dict]:
+def _published_key(entry: Any) -> Optional[tuple]:
+    parsed = entry.get("published_parsed")
+    return tuple(parsed[:6]) if parsed else None
+
+
+def _guid(entry: Any) -> str:
+    return (entry.get("id") or entry.get("link") or "").strip()
+
+
+def _load_watermarks() -> dict:
+    if not FEED_WATERMARK_FILE.exists():
+        return {}
+    try:
+        with open(FEED_WATERMARK_FILE, encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except Exception as e:
+        logger.warning("Could not load feed watermarks: %s", e)
+        return {}
+
+
+def _save_watermarks(marks: dict) -> None:
+    try:
+        FEED_WATERMARK_FILE.parent.mkdir(parents=True, exist_ok=True)
+        tmp = FEED_WATERMARK_FILE.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(marks, f)
+        os.replace(tmp, FEED_WATERMARK_FILE)
+    except Exception as e:
+        logger.exception("Could not save feed watermarks: %s", e)
+
+
+def _unchanged(entries: list, mark: dict) -> bool:
+    """True if the feed's newest entry (feeds are sorted, so first or last) is the watermark itself."""
+    first, last = _published_key(entries[0]), _published_key(entries[-1])
+    if first is None or last is None:
+        return False
+    newest = entries[0] if first >= last else entries[-1]
+    return list(max(first, last)) == mark.get("published") and _guid(newest) in mark.get("guids", ())
+
+
+def _entry_to_item(entry: Any, source: str) -> NewsItem:
+    """Convert feedparser entry to a NewsItem (the entry itself is not kept)."""
+    return from_entry(entry, source, _parse_date(entry))
+
+
+def _download(url: str, timeout: float, headers: Optional[dict] = None) -> requests.Response:
+    r = http_client.get(url, headers={"User-Agent": USER_AGENT, **(headers or {})}, timeout=timeout)
+    r.raise_for_status()
+    return r
+
+
+def _fetch_feed(url: str, timeout: float) -> Optional[tuple[str, list]]:
+    """
+    Download one feed and parse it from bytes. Returns (source, entries) or None.
+    With the feed cache enabled, a 304 reply reuses the cached entries without parsing.
+    """
+    cache = get_cache() if ENABLE_FEED_CACHE else None
+    with metrics.timed("feed_fetch_seconds") as labels:
+        labels["result"] = "error"
+        result = _fetch_and_parse(url, timeout, cache)
+        if result is not None:
+            labels["result"] = result[2]
+    if result is None:
+        metrics.inc("feed_errors_total")
+        return None
+    return result[0], result[1]
+
+
+def _fetch_and_parse(url: str, timeout: float, cache) -> Optional[tuple[str, list, str]]:
+    """Returns (source, entries, "not_modified" | "ok") or None on failure."""
+    try:
+        conditional = cache.request_headers(url) if cache else None
+        r = _download(url, timeout, conditional)
+        if conditional:
+            metrics.cache_result("feed", r.status_code == 304)
+        if r.status_code == 304 and cache:
+            cached = cache.get(url)
+            if cached is not None:
+                logger.debug("Feed not modified: %s", url)
+                return cached[0], cached[1], "not_modified"
+            r = _download(url, timeout)
+        return _parse_feed(url, r.content, r.url, r.headers, cache)
+    except Exception as e:
+        logger.exception("Failed to fetch feed %s: %s", url, e)
+        return None
+
+
+def _parse_feed(url: str, content: bytes, final_url: str, headers, cache) -> Optional[tuple[str, list, str]]:
+    """Parse a downloaded feed from bytes and cache it. Returns (source, entries, "ok") or None."""
+    feed = feedparser.parse(
+        content,
+        response_headers={
+            "content-location": final_url or url,
+            "content-type": headers.get("Content-Type", ""),
+        },
+    )
+    if feed.bozo and not getattr(feed, "entries", None):
+        logger.warning("Feed parse error or empty: %s", url)
+        return None
+    source = feed.feed.get("title", url) or url
+    if cache:
+        cache.put(url, headers.get("ETag"), headers.get("Last-Modified"), source, feed.entries)
+    return source, feed.entries, "ok"
+
+
+async def _download_async(http, url: str, timeout: float, headers: Optional[dict] = None):
+    r = await http.get(url, headers={"User-Agent": USER_AGENT, **(headers or {})}, timeout=timeout)
+    if r.status >= 400:
+        raise RuntimeError(f"HTTP {r.status}")
+    return r
+
+
+async def _fetch_feed_async(http, url: str, timeout: float) -> Optional[tuple[str, list]]:
+    """_fetch_feed() on the event loop: download under the shared "feeds" limit, parse in a worker thread."""
+    cache = get_cache() if ENABLE_FEED_CACHE else None
+    async with http.limit("feeds", ASYNC_FETCH_CONCURRENCY):
+        with metrics.timed("feed_fetch_seconds") as labels:
+            labels["result"] = "error"
+            result = await _fetch_and_parse_async(http, url, timeout, cache)
+            if result is not None:
+                labels["result"] = result[2]
+    if result is None:
+        metrics.inc("feed_errors_total")
+        return None
+    return result[0], result[1]
+
+
+async def _fetch_and_parse_async(http, url: str, timeout: float, cache) -> Optional[tuple[str, list, str]]:
+    import asyncio
+
+    try:
+        conditional = cache.request_headers(url) if cache else None
+        r = await _download_async(http, url, timeout, conditional)
+        if conditional:
+            metrics.cache_result("feed", r.status == 304)
+        if r.status == 304 and cache:
+            cached = cache.get(url)
+            if cached is not None:
+                logger.debug("Feed not modified: %s", url)
+                return cached[0], cached[1], "not_modified"
+            r = await _download_async(http, url, timeout)
+        return await asyncio.to_thread(_parse_feed, url, r.content, r.url, r.headers, cache)
+    except Exception as e:
+        logger.exception("Failed to fetch feed %s: %s", url, e)
+        return None
+
+
+def _fetch_parallel(urls: list[str], workers: int, timeout: float, deadline: float) -> list[Optional[tuple[str, list]]]:
+    """Fetch feeds on a thread pool; feeds still running at the deadline are dropped."""
+    results: list[Optional[tuple[str, list]]] = [None] * len(urls)
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rss")
+    try:
+        futures = {pool.submit(_fetch_feed, url, timeout): i for i, url in enumerate(urls)}
+        done, not_done = wait(futures, timeout=deadline)
+        for fut in done:
+            results[futures[fut]] = fut.result()
+        for fut in not_done:
+            fut.cancel()
+            logger.warning("Feed missed fetch deadline (%.0fs): %s", deadline, urls[futures[fut]])
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    return results
+
+
+def _fetch_serial(urls: list[str], timeout: float, deadline: float) -> list[Optional[tuple[str, list]]]:
+    results: list[Optional[tuple[str, list]]] = []
+    stop_at = time.monotonic() + deadline
+    for url in urls:
+        if time.monotonic() >= stop_at:
+            logger.warning("Feed missed fetch deadline (%.0fs): %s", deadline, url)
+            results.append(None)
+            continue
+        results.append(_fetch_feed(url, timeout))
+    return results
+
+
+def fetch_all(
+    feed_urls: list[str] | None = None,
+    workers: int | None = None,
+    timeout: float | None = None,
+    deadline: float | None = None,
+    limit: int | None = None,
+    skip_link: Callable[[str], bool] | None = None,
+    watermarks: dict[str, dict] | None = None,
+) -> list[NewsItem]:
     """
     Fetch all given RSS feeds, merge and dedupe by link, sort newest first.
-    Returns list of items with keys: title, link, summary, source, published, entry.
+    With `limit`, only the newest `limit` entries are converted to items (heap
+    selection); entries whose link `skip_link` accepts are left out before that.
+    Feeds are downloaded on up to `workers` threads (1 = serial); each download has
+    a per-feed `timeout` and the whole fetch an overall `deadline`, in seconds.
+    Results are merged in feed order, so output matches the serial path.
+    The feeds' new watermarks go into `watermarks`, for commit_watermarks().
     """
+    with metrics.timed("fetch_all_seconds"):
+        return _fetch_all(feed_urls, workers, timeout, deadline, limit, skip_link, watermarks)
+
+
+def _fetch_all(
+    feed_urls: list[str] | None,
+    workers: int | None,
+    timeout: float | None,
+    deadline: float | None,
+    limit: int | None,
+    skip_link: Callable[[str], bool] | None,
+    watermarks: dict[str, dict] | None,
+) -> list[NewsItem]:
     urls = feed_urls or RSS_FEED_URLS
-    all_items: list[dict] = []
-    seen_links: set[str] = set()
+    workers = RSS_FETCH_WORKERS if workers is None else workers
+    timeout = RSS_FEED_TIMEOUT if timeout is None else timeout
+    deadline = RSS_FETCH_DEADLINE if deadline is None else deadline
 
-    for url in urls:
-        try:
-            feed = feedparser.parse(url, request_headers={"User-Agent": "CryptoNewsBot/1.0"})
-            if feed.bozo and not getattr(feed, "entries", None):
-                logger.warning("Feed parse error or empty: %s", url)
-                continue
-            source = feed.feed.get("title", url) or url
-            for entry in feed.entries:
-                link = (entry.get("link") or "").strip()
-                if not link or link in seen_links:
+    if workers > 1 and len(urls) > 1:
+        feeds = _fetch_parallel(urls, min(workers, len(urls)), timeout, deadline)
+    else:
+        feeds = _fetch_serial(urls, timeout, deadline)
+    if ENABLE_FEED_CACHE:
+        get_cache().save()
+    return _select(urls, feeds, limit, skip_link, watermarks)
+
+
+async def fetch_all_async(
+    http,
+    feed_urls: list[str] | None = None,
+    timeout: float | None = None,
+    deadline: float | None = None,
+    limit: int | None = None,
+    skip_link: Callable[[str], bool] | None = None,
+    watermarks: dict[str, dict] | None = None,
+) -> list[NewsItem]:
+    """
+    fetch_all() for the async runtime (http: aio_http.AsyncHTTP). All feeds are
+    downloaded on the event loop, at most ASYNC_FETCH_CONCURRENCY at a time;
+    feeds still pending at the deadline are dropped.
+    """
+    import asyncio
+
+    urls = feed_urls or RSS_FEED_URLS
+    timeout = RSS_FEED_TIMEOUT if timeout is None else timeout
+    deadline = RSS_FETCH_DEADLINE if deadline is None else deadline
+    with metrics.timed("fetch_all_seconds"):
+        tasks = [asyncio.ensure_future(_fetch_feed_async(http, url, timeout)) for url in urls]
+        feeds: list[Optional[tuple[str, list]]] = [None] * len(urls)
+        if tasks:
+            await asyncio.wait(tasks, timeout=deadline)
+        for i, task in enumerate(tasks):
+            if task.done():
+                feeds[i] = task.result()
+            else:
+                task.cancel()
+                logger.warning("Feed missed fetch deadline (%.0fs): %s", deadline, urls[i])
+        if ENABLE_FEED_CACHE:
+            get_cache().save()
+        return _select(urls, feeds, limit, skip_link, watermarks)
+
+
+def _select(
+    urls: list[str],
+    feeds: list[Optional[tuple[str, list]]],
+    limit: int | None,
+    skip_link: Callable[[str], bool] | None,
+    watermarks: dict[str, dict] | None,
+) -> list[NewsItem]:
+    """Merge fetched feeds into items (see fetch_all); their pending watermarks go into `watermarks`."""
+    marks = _load_watermarks() if ENABLE_FEED_WATERMARKS else {}
+    pending: dict[str, dict] = {}
+    # (published, -position, entry, source, feed url): ranks newest first, earlier feeds winning ties
+    candidates: list[tuple] = []
+    seen_links: set[str] = set()
+    for url, result in zip(urls, feeds):
+        if result is None:
+            continue
+        source, entries = result
+        mark = marks.get(url)
+        if mark and entries and _unchanged(entries, mark):
+            metrics.inc("feed_unchanged_total")
+            continue
+        floor = tuple(mark["published"]) if mark else None
+        floor_guids = set(mark.get("guids", ())) if mark else set()
+        newest, newest_guids = None, []
+        for entry in entries:
+            published = _published_key(entry)
+            if published is not None:
+                if newest is None or published > newest:
+                    newest, newest_guids = published, [_guid(entry)]
+                elif published == newest:
+                    newest_guids.append(_guid(entry))
+                if floor is not None and (published < floor or (published == floor and _guid(entry) in floor_guids)):
                     continue
-                seen_links.add(link)
-                all_items.append(_entry_to_item(entry, source))
-        except Exception as e:
-            logger.exception("Failed to fetch feed %s: %s", url, e)
+            link = (entry.get("link") or "").strip()
+            if not link or link in seen_links:
+                continue
+            seen_links.add(link)
+            if skip_link is not None and skip_link(link):
+                continue
+            candidates.append((published or _NO_DATE, -len(candidates), entry, source, url))
+        if newest is not None and ENABLE_FEED_WATERMARKS:
+            pending[url] = {"published": list(newest), "guids": newest_guids, "candidates": []}
+
+    if limit is not None:
+        top = heapq.nlargest(limit, candidates, key=lambda c: c[:2])
+    else:
+        top = sorted(candidates, key=lambda c: c[:2], reverse=True)
+    for published, _, entry, _, url in top:
+        if url in pending and published != _NO_DATE:
+            pending[url]["candidates"].append((published, (entry.get("link") or "").strip()))
+    if watermarks is not None:
+        watermarks.update(pending)
+    return [_entry_to_item(entry, source) for _, _, entry, source, _ in top]
 
-    all_items.sort(key=lambda x: x["published"], reverse=True)
-    return all_items
+
+def commit_watermarks(pending: dict[str, dict], retry_links: Iterable[str] = ()) -> None:
+    """
+    Save the pending watermarks a fetch_all filled in. A returned item whose link
+    is in retry_links (e.g. not posted this run) holds its feed's watermark at that
+    item, so it is offered again next run; older entries of that feed are still skipped.
+    """
+    if not ENABLE_FEED_WATERMARKS:
+        return
+    if not pending:
+        return
+    retry = set(retry_links)
+    marks = _load_watermarks()
+    for url, mark in pending.items():
+        held = [published for published, link in mark["candidates"] if link in retry]
+        if held:
+            marks[url] = {"published": list(min(held)), "guids": []}
+        else:
+            marks[url] = {"published": mark["published"], "guids": mark["guids"]}
+    _save_watermarks(marks)
@@ -0,0 +1,79 @@
+"""Compact news item: plain text fields plus image candidates, without the raw feed entry."""
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from html import unescape
+from typing import Any
+from urllib.parse import urljoin
+
+# Default date for entries without published_parsed
+EPOCH = datetime(1970, 1, 1)
+SUMMARY_MAX_LEN = 500
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_IMG_SRC_RE = re.compile(r'<img[^>]+src=["\']([^"\']+)["\']', re.I)
+
+
+@dataclass(slots=True)
+class NewsItem:
+    title: str
+    link: str
+    summary: str = ""
+    source: str = ""
+    published: datetime = EPOCH
+    # Image URLs from the feed entry, best first (unvalidated; image_fetcher picks the first usable one)
+    image_candidates: tuple[str, ...] = ()
+
+
+def clean_text(text: str, max_len: int = 0) -> str:
+    """Strip HTML tags, decode entities and collapse whitespace; truncate to max_len if set."""
+    if not text:
+        return ""
+    text = " ".join(unescape(_TAG_RE.sub(" ", text)).split())
+    return text[:max_len] if max_len else text
+
+
+def _field(obj: Any, key: str) -> Any:
+    return obj.get(key) if isinstance(obj, dict) else getattr(obj, key, None)
+
+
+def image_candidates(entry: Any) -> tuple[str, ...]:
+    """
+    Image URLs from a feedparser entry in order of preference: media_content,
+    media_thumbnail, image enclosures, then the first <img> in the summary.
+    """
+    found: list[str] = []
+    for m in entry.get("media_content") or []:
+        href = _field(m, "url") or _field(m, "href")
+        if href and "image" in (_field(m, "type") or "").lower():
+            found.append(href.strip())
+
+    thumbs = entry.get("media_thumbnail") or []
+    if thumbs:
+        href = _field(thumbs[0], "url")
+        if href:
+            found.append(href.strip())
+
+    for enc in entry.get("enclosures") or []:
+        href = _field(enc, "href")
+        if href and "image" in (_field(enc, "type") or "").lower():
+            found.append(href.strip())
+
+    summary = entry.get("summary") or ""
+    if isinstance(summary, str):
+        match = _IMG_SRC_RE.search(summary)
+        if match:
+            found.append(urljoin(entry.get("link") or "", match.group(1).strip()))
+    return tuple(dict.fromkeys(found))
+
+
+def from_entry(entry: Any, source: str, published: datetime = EPOCH) -> NewsItem:
+    """Build a NewsItem from a feedparser entry; the entry itself is not kept."""
+    return NewsItem(
+        title=clean_text(entry.get("title") or "") or "No title",
+        link=(entry.get("link") or "").strip(),
+        summary=clean_text(entry.get("summary") or entry.get("description") or "", SUMMARY_MAX_LEN),
+        source=source,
+        published=published,
+        image_candidates=image_candidates(entry),
+    )
@@ -1,11 +1,12 @@
 """Fetch opinion/analysis news from CryptoPanic API."""
 import logging
-
-import requests
+from typing import Optional
 
 from config import CRYPTOPANIC_API_KEY
-from posted_links import is_posted, mark_posted
-from rewriter import rewrite
+import http_client
+from news_item import SUMMARY_MAX_LEN, NewsItem, clean_text
+from posted_links import filter_unposted, mark_posted
+from rewriter import rewrite_batch
 from telegram_poster import post
 
 logger = logging.getLogger(__name__)
@@ -16,30 +17,46 @@ TIMEOUT = 15
 # Note: Free tier doesn't support filter parameter
 
 
-def fetch_opinions() -> list[dict]:
+def fetch_opinions() -> list[NewsItem]:
     """
     Fetch news from CryptoPanic with filter=important (opinions/analysis).
-    Returns list of {title, link, summary, source, entry}.
+    Returns NewsItems (title, link, summary, source).
     """
     if not CRYPTOPANIC_API_KEY:
         logger.warning("CRYPTOPANIC_API_KEY not set, skipping opinions")
         return []
 
     try:
-        r = requests.get(
-            CRYPTOPANIC_URL,
-            params={
-                "auth_token": CRYPTOPANIC_API_KEY,
-                "public": "true",
-            },
-            timeout=TIMEOUT,
-        )
+        r = http_client.get(CRYPTOPANIC_URL, params=_params(), timeout=TIMEOUT)
         r.raise_for_status()
         data = r.json()
     except Exception as e:
         logger.exception("CryptoPanic fetch failed: %s", e)
         return []
+    return _parse_opinions(data)
+
+
+async def fetch_opinions_async(http) -> list[NewsItem]:
+    """fetch_opinions() for the async runtime (http: aio_http.AsyncHTTP)."""
+    if not CRYPTOPANIC_API_KEY:
+        logger.warning("CRYPTOPANIC_API_KEY not set, skipping opinions")
+        return []
+    try:
+        data = await http.get_json(CRYPTOPANIC_URL, params=_params(), timeout=TIMEOUT)
+    except Exception as e:
+        logger.exception("CryptoPanic fetch failed: %s", e)
+        return []
+    return _parse_opinions(data)
+
+
+def _params() -> dict:
+    return {
+        "auth_token": CRYPTOPANIC_API_KEY,
+        "public": "true",
+    }
 
+
+def _parse_opinions(data: dict) -> list[NewsItem]:
     results = data.get("results", [])
     items = []
     for p in results[:20]:
@@ -56,34 +73,55 @@ def fetch_opinions() -> list[dict]:
         source = p.get("source", {})
         source_name = source.get("title", "CryptoPanic") if isinstance(source, dict) else "CryptoPanic"
         
-        items.append({
-            "title": title,
-            "link": url,
-            "summary": description[:500] if description else title,
-            "source": source_name,
-            "entry": None,
-        })
+        items.append(NewsItem(
+            title=clean_text(title),
+            link=url,
+            summary=clean_text(description, SUMMARY_MAX_LEN) or title,
+            source=source_name,
+        ))
     return items
 
 
+def prepare_opinions(max_posts: int = 2) -> list[dict]:
+    """
+    Fetch opinions not yet posted and rewrite them, without posting.
+    Returns list of posts {caption, image_url, link, kind}; failed rewrites are left out.
+    """
+    to_process = _unposted(fetch_opinions(), max_posts)
+    return _posts(to_process, rewrite_batch(to_process))
+
+
+async def prepare_opinions_async(http, max_posts: int = 2) -> list[dict]:
+    """prepare_opinions() for the async runtime; the rewrite runs in a worker thread."""
+    import asyncio
+
+    to_process = _unposted(await fetch_opinions_async(http), max_posts)
+    return _posts(to_process, await asyncio.to_thread(rewrite_batch, to_process))
+
+
+def _unposted(items: list[NewsItem], max_posts: int) -> list[NewsItem]:
+    unposted = set(filter_unposted(i.link for i in items))
+    return [i for i in items if i.link in unposted][:max_posts]
+
+
+def _posts(to_process: list[NewsItem], captions: list[Optional[str]]) -> list[dict]:
+    posts = []
+    for item, caption in zip(to_process, captions):
+        if not caption:
+            continue
+        posts.append({"caption": caption, "image_url": None, "link": item.link, "kind": "opinion"})
+    return posts
+
+
 def post_opinions(max_posts: int = 2) -> int:
     """
     Fetch opinions, rewrite, and post. Returns number of posts made.
     """
-    items = fetch_opinions()
-    new_items = [i for i in items if not is_posted(i.get("link", ""))]
-    to_process = new_items[:max_posts]
     posted = 0
-    for item in to_process:
-        link = item.get("link", "")
-        title = item.get("title", "")
-        summary = item.get("summary", "")
-        source = item.get("source", "")
+    for p in prepare_opinions(max_posts):
+        link = p["link"]
         try:
-            caption = rewrite(title, summary, source)
-            if not caption:
-                continue
-            if post(caption, None):
+            if post(p["caption"], None):
                 mark_posted(link)
                 posted += 1
                 logger.info("Posted opinion: %s", link)
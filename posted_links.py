@@ -1,51 +1,259 @@
-"""Persist posted article links in JSON to avoid reposting."""
+"""Persist posted article links to avoid reposting.
+
+Links live in a SQLite database (WAL mode) and are loaded once per process
+into an in-memory set, so lookups never touch the disk. New links are
+buffered and committed in batches; each commit is a single transaction, so
+a crash loses at most the uncommitted batch and never corrupts the store.
+The legacy JSON file is imported on first use.
+
+The exact set only keeps the newest MAX_POSTED_LINKS_STORED links. Behind it,
+a scalable Bloom filter remembers every posted link (canonicalized: no scheme,
+tracking parameters, fragment or trailing slash) in a few bytes each, so old
+links that resurface are still recognized; a false positive (at most
+POSTED_BLOOM_FP_RATE) only skips a new story.
+"""
+import atexit
 import json
 import logging
+import sqlite3
+import threading
+import time
 from pathlib import Path
+from typing import Iterable, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit
 
-from config import MAX_POSTED_LINKS_STORED, POSTED_LINKS_FILE
+from bloom import ScalableBloomFilter
+from config import (
+    ENABLE_POSTED_BLOOM,
+    MAX_POSTED_LINKS_STORED,
+    POSTED_BLOOM_FILE,
+    POSTED_BLOOM_FP_RATE,
+    POSTED_BLOOM_INITIAL_CAPACITY,
+    POSTED_LINKS_BATCH_SIZE,
+    POSTED_LINKS_DB,
+    POSTED_LINKS_FILE,
+)
+import metrics
 
 logger = logging.getLogger(__name__)
 
 
-def _ensure_data_dir() -> None:
-    POSTED_LINKS_FILE.parent.mkdir(parents=True, exist_ok=True)
+_TRACKING_PARAMS = frozenset({
+    "fbclid", "gclid", "dclid", "msclkid", "igshid", "mc_cid", "mc_eid",
+    "ref", "ref_src", "ref_url", "cmpid", "ncid", "guccounter", "_ga",
+})
+
+
+def canonical_url(url: str) -> str:
+    """
+    URL reduced to what identifies the page: lowercased host without "www.", path
+    without trailing slash, and query without tracking parameters (utm_*, fbclid, ...),
+    sorted. Scheme and fragment are dropped.
+    """
+    url = (url or "").strip()
+    if not url:
+        return ""
+    parts = urlsplit(url if "//" in url else "//" + url)
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    path = parts.path.rstrip("/")
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith("utm_") and k.lower() not in _TRACKING_PARAMS
+    )
+    return host + path + ("?" + urlencode(query) if query else "")
 
 
-def _load() -> list[str]:
-    _ensure_data_dir()
-    if not POSTED_LINKS_FILE.exists():
+def _load_legacy_json(path: Path) -> list[str]:
+    if not path.exists():
         return []
     try:
-        with open(POSTED_LINKS_FILE, encoding="utf-8") as f:
+        with open(path, encoding="utf-8") as f:
             data = json.load(f)
         return data.get("posted_links", []) if isinstance(data, dict) else (data if isinstance(data, list) else [])
     except Exception as e:
-        logger.warning("Could not load posted links: %s", e)
+        logger.warning("Could not load legacy posted links: %s", e)
         return []
 
 
-def _save(links: list[str]) -> None:
-    _ensure_data_dir()
-    try:
-        with open(POSTED_LINKS_FILE, "w", encoding="utf-8") as f:
-            json.dump({"posted_links": links}, f, indent=0)
-    except Exception as e:
-        logger.exception("Could not save posted links: %s", e)
+class PostedLinksStore:
+    """In-memory index of posted links backed by SQLite with batched commits."""
+
+    def __init__(
+        self,
+        db_path: Path = POSTED_LINKS_DB,
+        legacy_json: Optional[Path] = POSTED_LINKS_FILE,
+        max_stored: int = MAX_POSTED_LINKS_STORED,
+        batch_size: int = POSTED_LINKS_BATCH_SIZE,
+        bloom_path: Optional[Path] = POSTED_BLOOM_FILE if ENABLE_POSTED_BLOOM else None,
+    ):
+        self.db_path = db_path
+        self.max_stored = max_stored
+        self.batch_size = max(1, batch_size)
+        self.bloom_path = bloom_path
+        self._lock = threading.Lock()
+        self._pending: list[tuple[str, float]] = []
+        self._links: set[str] = set()
+        self._conn = self._open()
+        self._load(legacy_json)
+        self._bloom: Optional[ScalableBloomFilter] = None
+        self._bloom_dirty = False
+        if bloom_path is not None:
+            self._load_bloom()
+
+    def _open(self) -> sqlite3.Connection:
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS posted_links ("
+            " link TEXT PRIMARY KEY,"
+            " posted_at REAL NOT NULL)"
+        )
+        conn.commit()
+        return conn
+
+    def _load(self, legacy_json: Optional[Path]) -> None:
+        rows = self._conn.execute("SELECT link FROM posted_links").fetchall()
+        if not rows and legacy_json is not None:
+            legacy = [l.strip() for l in _load_legacy_json(legacy_json) if l and l.strip()]
+            if legacy:
+                # Preserve legacy order via increasing timestamps so trimming keeps the newest
+                base = time.time() - len(legacy)
+                with self._conn:
+                    self._conn.executemany(
+                        "INSERT OR IGNORE INTO posted_links (link, posted_at) VALUES (?, ?)",
+                        [(link, base + i) for i, link in enumerate(legacy)],
+                    )
+                logger.info("Imported %d posted links from %s", len(legacy), legacy_json)
+                rows = [(l,) for l in legacy]
+        self._links = {r[0] for r in rows}
+
+    def _load_bloom(self) -> None:
+        if self.bloom_path.exists():
+            try:
+                self._bloom = ScalableBloomFilter.load(self.bloom_path)
+            except Exception as e:
+                logger.warning("Could not load posted links filter, rebuilding: %s", e)
+        if self._bloom is None:
+            # First use (or unreadable file)
+            self._bloom = ScalableBloomFilter(POSTED_BLOOM_INITIAL_CAPACITY, POSTED_BLOOM_FP_RATE)
+            self._bloom_dirty = True
+        # Seed from the exact store: links committed after the file was last saved (the process
+        # was killed before flush()) would otherwise be forgotten once trimmed from the database
+        before = len(self._bloom)
+        self._bloom.update(canonical_url(link) for link in self._links)
+        if len(self._bloom) != before:
+            self._bloom_dirty = True
+
+    def _seen(self, link: str) -> bool:
+        if link in self._links:
+            return True
+        if self._bloom is not None and canonical_url(link) in self._bloom:
+            metrics.inc("posted_links_bloom_hits_total")
+            return True
+        return False
+
+    def is_posted(self, link: str) -> bool:
+        link = (link or "").strip()
+        return bool(link) and self._seen(link)
+
+    def filter_unposted(self, links: Iterable[str]) -> list[str]:
+        """Return the links not yet posted, in input order, without duplicates."""
+        out: list[str] = []
+        seen: set[str] = set()
+        for link in links:
+            link = (link or "").strip()
+            if not link or link in seen or self._seen(link):
+                continue
+            seen.add(link)
+            out.append(link)
+        return out
+
+    def mark_posted(self, link: str) -> None:
+        self.mark_posted_many([link])
+
+    def mark_posted_many(self, links: Iterable[str]) -> None:
+        now = time.time()
+        with self._lock:
+            for link in links:
+                link = (link or "").strip()
+                if not link or link in self._links:
+                    continue
+                self._links.add(link)
+                self._pending.append((link, now))
+                if self._bloom is not None:
+                    self._bloom.add(canonical_url(link))
+                    self._bloom_dirty = True
+            if len(self._pending) >= self.batch_size:
+                self._flush_locked()
+
+    def flush(self) -> None:
+        """Commit all pending links in one transaction and save the Bloom filter if it changed."""
+        with self._lock:
+            self._flush_locked()
+            if self._bloom is not None and self._bloom_dirty:
+                try:
+                    self._bloom.save(self.bloom_path)
+                    self._bloom_dirty = False
+                except Exception as e:
+                    logger.exception("Could not save posted links filter: %s", e)
+
+    def _flush_locked(self) -> None:
+        if not self._pending:
+            return
+        try:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO posted_links (link, posted_at) VALUES (?, ?)",
+                    self._pending,
+                )
+                self._conn.execute(
+                    "DELETE FROM posted_links WHERE link NOT IN ("
+                    " SELECT link FROM posted_links ORDER BY posted_at DESC LIMIT ?)",
+                    (self.max_stored,),
+                )
+            self._pending.clear()
+        except Exception as e:
+            logger.exception("Could not save posted links: %s", e)
+            return
+        if len(self._links) > self.max_stored:
+            rows = self._conn.execute("SELECT link FROM posted_links").fetchall()
+            self._links = {r[0] for r in rows}
+
+    def close(self) -> None:
+        self.flush()
+        self._conn.close()
+
+
+_store: Optional[PostedLinksStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> PostedLinksStore:
+    """Return the process-wide store, opening it on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = PostedLinksStore()
+                atexit.register(_store.flush)
+    return _store
 
 
 def is_posted(link: str) -> bool:
-    return (link or "").strip() in set(_load())
+    return get_store().is_posted(link)
+
+
+def filter_unposted(links: Iterable[str]) -> list[str]:
+    return get_store().filter_unposted(links)
 
 
 def mark_posted(link: str) -> None:
-    link = (link or "").strip()
-    if not link:
-        return
-    links = _load()
-    if link in links:
-        return
-    links.append(link)
-    if len(links) > MAX_POSTED_LINKS_STORED:
-        links = links[-MAX_POSTED_LINKS_STORED:]
-    _save(links)
+    get_store().mark_posted(link)
+
+
+def flush() -> None:
+    get_store().flush()
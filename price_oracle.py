@@ -0,0 +1,181 @@
+"""Shared CoinGecko price service: one batched /coins/markets call per TTL window.
+
+Modules register the coin ids they need at import time (the scheduler imports
+them before its stages start); the first caller in a TTL window fetches all
+registered ids in one request and concurrent callers
+wait for that request instead of issuing their own. The async runtime uses
+get_markets_async / get_price_async, which share the same cache.
+"""
+import logging
+import threading
+import time
+from typing import Any, Iterable, Optional
+
+from config import PRICE_TTL_SECONDS
+import http_client
+
+logger = logging.getLogger(__name__)
+
+COINGECKO_URL = "https://api.coingecko.com/api/v3/coins/markets"
+TIMEOUT = 15
+PER_PAGE = 250
+
+
+class PriceOracle:
+    """TTL cache of CoinGecko market rows keyed by coin id, with request coalescing."""
+
+    def __init__(self, ttl_seconds: float = PRICE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.requests_made = 0
+        self._ids: list[str] = []
+        self._rows: dict[str, dict] = {}
+        self._fetched_ids: set[str] = set()
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._inflight: Optional[threading.Event] = None
+        self._async_lock: Any = None  # asyncio.Lock, created by the first async caller
+
+    def register(self, ids: Iterable[str]) -> None:
+        """Add coin ids to every future batched request."""
+        with self._lock:
+            for coin_id in ids:
+                if coin_id not in self._ids:
+                    self._ids.append(coin_id)
+
+    def _fresh(self, ids: Optional[list[str]] = None) -> bool:
+        if time.monotonic() - self._fetched_at >= self.ttl_seconds:
+            return False
+        return ids is None or all(i in self._fetched_ids for i in ids)
+
+    def get_markets(self, ids: Iterable[str]) -> list[dict]:
+        """Market rows for ids (those CoinGecko returned), ordered by market cap, largest first."""
+        ids = list(ids)
+        self.register(ids)
+        while True:
+            with self._lock:
+                if self._fresh(ids):
+                    return self._select(ids)
+                if self._inflight is None:
+                    self._inflight = threading.Event()
+                    event, leader = self._inflight, True
+                    batch = list(self._ids)
+                else:
+                    event, leader = self._inflight, False
+            if leader:
+                rows = self._fetch(batch)
+                with self._lock:
+                    if rows is not None:
+                        self._store(batch, rows)
+                    self._inflight = None
+                    event.set()
+                    return self._select(ids)
+            event.wait(TIMEOUT + 1)
+            with self._lock:
+                # Shared fetch failed or timed out: do not retry within this call
+                if not self._fresh() or self._fresh(ids):
+                    return self._select(ids)
+            # The shared fetch succeeded but predates our ids; loop to fetch again with them registered
+
+    async def get_markets_async(self, ids: Iterable[str], http: Any) -> list[dict]:
+        """get_markets() for the async runtime; concurrent callers wait for one shared request."""
+        ids = list(ids)
+        self.register(ids)
+        with self._lock:
+            if self._fresh(ids):
+                return self._select(ids)
+        if self._async_lock is None:
+            import asyncio
+
+            self._async_lock = asyncio.Lock()
+        async with self._async_lock:
+            with self._lock:
+                if self._fresh(ids):
+                    return self._select(ids)
+                batch = list(self._ids)
+            self.requests_made += 1
+            try:
+                rows = self._accept(await http.get_json(COINGECKO_URL, params=self._params(batch), timeout=TIMEOUT))
+            except Exception as e:
+                logger.exception("CoinGecko fetch failed: %s", e)
+                rows = None
+            with self._lock:
+                if rows is not None:
+                    self._store(batch, rows)
+                return self._select(ids)
+
+    def _store(self, batch: list[str], rows: list[dict]) -> None:
+        self._rows = {r["id"]: r for r in rows if r.get("id")}
+        self._fetched_ids = set(batch)
+        self._fetched_at = time.monotonic()
+
+    def _select(self, ids: list[str]) -> list[dict]:
+        """Rows for ids from the last successful fetch; nothing if that fetch is older than the TTL."""
+        if not self._fresh():
+            return []
+        rows = [self._rows[i] for i in ids if i in self._rows]
+        rows.sort(key=lambda r: r.get("market_cap") or 0, reverse=True)
+        return rows
+
+    @staticmethod
+    def _params(ids: list[str]) -> dict:
+        return {
+            "vs_currency": "usd",
+            "ids": ",".join(ids),
+            "order": "market_cap_desc",
+            "per_page": PER_PAGE,
+            "page": 1,
+            "sparkline": "false",
+            "price_change_percentage": "24h",
+        }
+
+    @staticmethod
+    def _accept(data: Any) -> Optional[list[dict]]:
+        return data if isinstance(data, list) else None
+
+    def _fetch(self, ids: list[str]) -> Optional[list[dict]]:
+        self.requests_made += 1
+        try:
+            r = http_client.get(COINGECKO_URL, params=self._params(ids), timeout=TIMEOUT)
+            r.raise_for_status()
+            return self._accept(r.json())
+        except Exception as e:
+            logger.exception("CoinGecko fetch failed: %s", e)
+            return None
+
+    def get_price(self, coin_id: str) -> Optional[float]:
+        """Current USD price for coin_id, or None if unavailable."""
+        return _price(self.get_markets([coin_id]))
+
+    async def get_price_async(self, coin_id: str, http: Any) -> Optional[float]:
+        return _price(await self.get_markets_async([coin_id], http))
+
+
+def _price(rows: list[dict]) -> Optional[float]:
+    for row in rows:
+        price = row.get("current_price")
+        if price is not None:
+            return float(price)
+    return None
+
+
+_oracle = PriceOracle()
+
+
+def register_coins(ids: Iterable[str]) -> None:
+    _oracle.register(ids)
+
+
+def get_markets(ids: Iterable[str]) -> list[dict]:
+    return _oracle.get_markets(ids)
+
+
+def get_price(coin_id: str) -> Optional[float]:
+    return _oracle.get_price(coin_id)
+
+
+async def get_markets_async(ids: Iterable[str], http: Any) -> list[dict]:
+    return await _oracle.get_markets_async(ids, http)
+
+
+async def get_price_async(coin_id: str, http: Any) -> Optional[float]:
+    return await _oracle.get_price_async(coin_id, http)
@@ -0,0 +1,76 @@
+"""Thread-safe token-bucket rate limiter."""
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    Allows `rate` acquisitions per second on average with bursts up to `capacity`.
+    rate <= 0 disables limiting. pause() blocks all acquisitions for a while
+    (e.g. after a server-side "retry after" reply).
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _reserve(self, tokens: float) -> float:
+        """Take tokens if available; otherwise return seconds to wait before retrying."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._refill(now)
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens: float = 1.0, timeout: Optional[float] = None) -> bool:
+        """Block until tokens are available. Returns False if timeout expires first."""
+        if self.rate <= 0:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._reserve(tokens)
+            if wait <= 0:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: float = 1.0) -> None:
+        """acquire() for the async runtime: waits with asyncio.sleep instead of blocking the thread."""
+        import asyncio
+
+        if self.rate <= 0:
+            return
+        while True:
+            wait = self._reserve(tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        if self.rate <= 0:
+            return True
+        return self._reserve(tokens) <= 0
+
+    def pause(self, seconds: float) -> None:
+        """Refuse all acquisitions for the next `seconds`; one token is available when the pause ends."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = min(1.0, self.capacity)
+            self._updated = self._paused_until
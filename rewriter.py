@@ -1,18 +1,42 @@
-"""Rewrite crypto news title + summary via LLM. Supports OpenAI, Groq, Ollama."""
+"""Rewrite crypto news title + summary via LLM. Supports OpenAI, Groq, Ollama (see llm_providers).
+
+REWRITE_PROVIDER=extractive skips the LLM and builds captions locally (summarizer).
+With an LLM provider, items whose rewrite fails or is still pending
+REWRITE_BUDGET_SECONDS after a rewrite_batch / rewrite_many call started its LLM
+requests get an extractive caption instead of being dropped.
+"""
+import hashlib
+import json
 import logging
+import threading
+import time
 from typing import Optional
 
 from config import (
-    GROQ_API_KEY,
-    OPENAI_API_KEY,
-    OLLAMA_BASE_URL,
+    ENABLE_EXTRACTIVE_FALLBACK,
+    ENABLE_REWRITE_CACHE,
+    REWRITE_BATCH_SIZE,
+    REWRITE_BUDGET_SECONDS,
+    REWRITE_CACHE_FILE,
+    REWRITE_CACHE_MAX_ENTRIES,
+    REWRITE_CACHE_TTL_HOURS,
     REWRITE_PROVIDER,
 )
+from disk_cache import MISSING, DiskCache
+from llm_providers import MODELS, chat, run_concurrently
+import metrics
+from news_item import NewsItem
+from summarizer import extractive_caption
 
 logger = logging.getLogger(__name__)
 
 CAPTION_MAX_LEN = 1024
 
+# Bump whenever SYSTEM_PROMPT or USER_PROMPT_TEMPLATE changes so cached captions are not reused
+PROMPT_VERSION = "1"
+# REWRITE_PROVIDER value selecting the no-LLM summarizer
+EXTRACTIVE = "extractive"
+
 SYSTEM_PROMPT = """You rewrite crypto/finance news for a Telegram channel. Output only the rewritten content, no preamble.
 - Keep factual and neutral. No speculation or opinions.
 - Use a short headline (one line) then exactly ONE concise sentence summary.
@@ -27,83 +51,251 @@ Title: {title}
 Summary: {summary}"""
 
 
-def _call_openai(title: str, summary: str, source: str) -> Optional[str]:
-    try:
-        from openai import OpenAI
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": USER_PROMPT_TEMPLATE.format(title=title, summary=summary or "No summary", source=source or "Unknown")},
-            ],
-            max_tokens=400,
-        )
-        text = (resp.choices[0].message.content or "").strip()
-        return text[:CAPTION_MAX_LEN] if text else None
-    except Exception as e:
-        logger.exception("OpenAI rewrite failed: %s", e)
-        return None
+BATCH_SYSTEM_PROMPT = SYSTEM_PROMPT + """
 
+You will receive several numbered news items. Rewrite each one independently following the rules above.
+Reply with ONLY a JSON array, one object per item: [{"id": <item number>, "caption": "<rewritten text>"}]"""
 
-def _call_groq(title: str, summary: str, source: str) -> Optional[str]:
-    try:
-        from groq import Groq
-        client = Groq(api_key=GROQ_API_KEY)
-        resp = client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": USER_PROMPT_TEMPLATE.format(title=title, summary=summary or "No summary", source=source or "Unknown")},
-            ],
-            max_tokens=400,
-        )
-        text = (resp.choices[0].message.content or "").strip()
-        return text[:CAPTION_MAX_LEN] if text else None
-    except Exception as e:
-        logger.exception("Groq rewrite failed: %s", e)
-        return None
+BATCH_ITEM_TEMPLATE = """Item {id}
+Title: {title}
+Summary: {summary}"""
 
 
-def _call_ollama(title: str, summary: str, source: str) -> Optional[str]:
-    try:
-        import requests
-        url = f"{OLLAMA_BASE_URL}/api/chat"
-        payload = {
-            "model": "llama3.2",
-            "messages": [
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": USER_PROMPT_TEMPLATE.format(title=title, summary=summary or "No summary", source=source or "Unknown")},
-            ],
-            "stream": False,
-        }
-        r = requests.post(url, json=payload, timeout=120)
-        r.raise_for_status()
-        data = r.json()
-        text = (data.get("message", {}).get("content") or "").strip()
-        return text[:CAPTION_MAX_LEN] if text else None
-    except Exception as e:
-        logger.exception("Ollama rewrite failed: %s", e)
+def _messages(title: str, summary: str, source: str) -> list[dict]:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": USER_PROMPT_TEMPLATE.format(title=title, summary=summary or "No summary", source=source or "Unknown")},
+    ]
+
+
+_cache: Optional[DiskCache] = None
+_cache_lock = threading.Lock()
+
+
+def _get_cache() -> Optional[DiskCache]:
+    global _cache
+    if not ENABLE_REWRITE_CACHE:
         return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = DiskCache(
+                    REWRITE_CACHE_FILE,
+                    ttl_seconds=REWRITE_CACHE_TTL_HOURS * 3600,
+                    max_entries=REWRITE_CACHE_MAX_ENTRIES,
+                    name="rewrite",
+                )
+    return _cache
+
+
+def _normalize(text: str) -> str:
+    return " ".join((text or "").split()).casefold()
+
+
+def cache_key(provider: str, title: str, summary: str) -> str:
+    """Content address for a rewrite: provider, model, prompt version and normalized text."""
+    raw = "\x1f".join([
+        provider,
+        MODELS.get(provider, ""),
+        PROMPT_VERSION,
+        _normalize(title),
+        _normalize(summary),
+    ])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def cache_stats() -> dict:
+    """Rewrite cache hit/miss counters and size (empty if the cache is disabled)."""
+    cache = _get_cache()
+    return cache.stats() if cache else {}
+
+
+def _budget_deadline() -> Optional[float]:
+    """End (time.monotonic()) of the LLM budget for requests starting now; None without a budget."""
+    return time.monotonic() + REWRITE_BUDGET_SECONDS if REWRITE_BUDGET_SECONDS > 0 else None
+
+
+def _over(deadline: Optional[float]) -> bool:
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def _with_fallback(
+    items: list[NewsItem], captions: list[Optional[str]], deadline: Optional[float]
+) -> list[Optional[str]]:
+    """Fill captions the LLM did not produce with extractive ones (if ENABLE_EXTRACTIVE_FALLBACK)."""
+    missing = [idx for idx, caption in enumerate(captions) if caption is None]
+    if not missing or not ENABLE_EXTRACTIVE_FALLBACK:
+        return captions
+    reason = "budget" if _over(deadline) else "failed"
+    logger.warning("Using extractive captions for %d/%d items (LLM %s)", len(missing), len(items), reason)
+    metrics.inc("rewrite_fallback_total", len(missing), reason=reason)
+    captions = list(captions)
+    for idx in missing:
+        item = items[idx]
+        captions[idx] = extractive_caption(item.title, item.summary, item.source)
+    return captions
+
+
+def _rewrite_uncached(provider: str, title: str, summary: str, source: str) -> Optional[str]:
+    text = chat(provider, _messages(title, summary, source))
+    return text[:CAPTION_MAX_LEN] if text else None
 
 
 def rewrite(title: str, summary: str, source: str = "") -> Optional[str]:
     """
-    Rewrite headline + summary for Telegram caption. Returns None on failure.
-    Provider is chosen from config (openai, groq, ollama).
+    Rewrite headline + summary for Telegram caption. Returns None on failure, or an
+    extractive caption if ENABLE_EXTRACTIVE_FALLBACK. Provider is chosen from config
+    (openai, groq, ollama, extractive).
+    Successful captions are cached on disk, so retries do not call the LLM again.
+    """
+    provider = REWRITE_PROVIDER
+    if provider == EXTRACTIVE:
+        return extractive_caption(title, summary, source)
+    cache = _get_cache()
+    key = cache_key(provider, title, summary)
+    if cache:
+        cached = cache.get(key)
+        if cached is not MISSING:
+            return cached
+    caption = _rewrite_uncached(provider, title, summary, source)
+    if caption and cache:
+        cache.set(key, caption)
+    if caption is None and ENABLE_EXTRACTIVE_FALLBACK:
+        metrics.inc("rewrite_fallback_total", reason="failed")
+        caption = extractive_caption(title, summary, source)
+    return caption
+
+
+def _parse_batch_reply(text: Optional[str], count: int) -> dict[int, str]:
+    """Parse a batch reply into {item index: caption}; malformed entries are left out."""
+    if not text:
+        return {}
+    start, end = text.find("["), text.rfind("]")
+    if start < 0 or end <= start:
+        return {}
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return {}
+    captions: dict[int, str] = {}
+    if not isinstance(data, list):
+        return captions
+    for obj in data:
+        if not isinstance(obj, dict):
+            continue
+        try:
+            idx = int(obj.get("id")) - 1
+        except (TypeError, ValueError):
+            continue
+        caption = obj.get("caption")
+        if 0 <= idx < count and isinstance(caption, str) and caption.strip():
+            captions[idx] = caption.strip()[:CAPTION_MAX_LEN]
+    return captions
+
+
+def _rewrite_packed(provider: str, items: list[NewsItem]) -> Optional[dict[int, str]]:
+    """One chat completion for several items. Returns captions by position in items, None if the call failed."""
+    body = "\n\n".join(
+        BATCH_ITEM_TEMPLATE.format(id=n, title=i.title, summary=i.summary or "No summary")
+        for n, i in enumerate(items, start=1)
+    )
+    messages = [
+        {"role": "system", "content": BATCH_SYSTEM_PROMPT},
+        {"role": "user", "content": body},
+    ]
+    text = chat(provider, messages, max_tokens=400 * len(items))
+    return None if text is None else _parse_batch_reply(text, len(items))
+
+
+def rewrite_batch(items: list[NewsItem]) -> list[Optional[str]]:
+    """
+    Rewrite several NewsItems, packing up to
+    REWRITE_BATCH_SIZE of them into each LLM request. Returns captions aligned
+    with items. Cached items are not sent; items missing from a batch reply that
+    did arrive are retried as concurrent single requests, the items of a failed
+    batch call are not. LLM calls stop REWRITE_BUDGET_SECONDS after the first one
+    started; uncaptioned items get extractive captions (None if
+    ENABLE_EXTRACTIVE_FALLBACK is off).
+    """
+    provider = REWRITE_PROVIDER
+    if provider == EXTRACTIVE:
+        return [extractive_caption(i.title, i.summary, i.source) for i in items]
+    cache = _get_cache()
+    captions: list[Optional[str]] = [None] * len(items)
+    pending: list[int] = []
+    for idx, item in enumerate(items):
+        cached = cache.get(cache_key(provider, item.title, item.summary)) if cache else MISSING
+        if cached is not MISSING:
+            captions[idx] = cached
+        else:
+            pending.append(idx)
+
+    deadline = _budget_deadline() if pending else None
+    size = max(1, REWRITE_BATCH_SIZE)
+    chunks = [pending[start:start + size] for start in range(0, len(pending), size)]
+    chunks = [chunk for chunk in chunks if len(chunk) > 1]
+    replies = run_concurrently(
+        _rewrite_packed, [(provider, [items[idx] for idx in chunk]) for chunk in chunks], deadline=deadline
+    )
+    # Items of chunks whose call failed (provider down, missing key): not retried one by one
+    failed: set[int] = set()
+    for chunk, parsed in zip(chunks, replies):
+        if parsed is None:
+            logger.warning("Batch rewrite of %d items failed", len(chunk))
+            failed.update(chunk)
+            continue
+        for pos, caption in parsed.items():
+            idx = chunk[pos]
+            captions[idx] = caption
+            if cache:
+                cache.set(cache_key(provider, items[idx].title, items[idx].summary), caption)
+        if len(parsed) < len(chunk):
+            logger.warning("Batch rewrite returned %d/%d captions, falling back to single calls", len(parsed), len(chunk))
+
+    missing = [] if _over(deadline) else [idx for idx in pending if captions[idx] is None and idx not in failed]
+    singles = run_concurrently(
+        _rewrite_and_cache, [_rewrite_args(provider, items[idx]) for idx in missing], deadline=deadline
+    )
+    for idx, caption in zip(missing, singles):
+        captions[idx] = caption
+    return _with_fallback(items, captions, deadline)
+
+
+def _rewrite_args(provider: str, item: NewsItem) -> tuple:
+    return provider, item.title, item.summary, item.source
+
+
+def _rewrite_and_cache(provider: str, title: str, summary: str, source: str) -> Optional[str]:
+    caption = _rewrite_uncached(provider, title, summary, source)
+    cache = _get_cache()
+    if caption and cache:
+        cache.set(cache_key(provider, title, summary), caption)
+    return caption
+
+
+def rewrite_many(items: list[NewsItem]) -> list[Optional[str]]:
+    """
+    Rewrite NewsItems with one request each, run
+    concurrently on the provider executor (REWRITE_CONCURRENCY, per-provider rate
+    limits). Returns captions aligned with items. Cached items are not sent;
+    uncaptioned items get extractive captions, with the same budget as rewrite_batch.
     """
     provider = REWRITE_PROVIDER
-    if provider == "openai":
-        if not OPENAI_API_KEY:
-            logger.error("OPENAI_API_KEY not set")
-            return None
-        return _call_openai(title, summary, source)
-    if provider == "groq":
-        if not GROQ_API_KEY:
-            logger.error("GROQ_API_KEY not set")
-            return None
-        return _call_groq(title, summary, source)
-    if provider == "ollama":
-        return _call_ollama(title, summary, source)
-    logger.error("Unknown REWRITE_PROVIDER: %s", provider)
-    return None
+    if provider == EXTRACTIVE:
+        return [extractive_caption(i.title, i.summary, i.source) for i in items]
+    cache = _get_cache()
+    captions: list[Optional[str]] = [None] * len(items)
+    pending: list[int] = []
+    for idx, item in enumerate(items):
+        cached = cache.get(cache_key(provider, item.title, item.summary)) if cache else MISSING
+        if cached is not MISSING:
+            captions[idx] = cached
+        else:
+            pending.append(idx)
+    deadline = _budget_deadline() if pending else None
+    results = run_concurrently(
+        _rewrite_and_cache, [_rewrite_args(provider, items[idx]) for idx in pending], deadline=deadline
+    )
+    for idx, caption in zip(pending, results):
+        captions[idx] = caption
+    return _with_fallback(items, captions, deadline)
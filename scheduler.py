@@ -1,62 +1,431 @@
-"""One job: market snapshot, whale alerts, opinions, news -> post."""
+"""One job: market snapshot, whale alerts, opinions, news -> post.
+
+The fetch/rewrite stages run concurrently, each with a timeout; their posts
+are then published in one ordered step so the channel order stays fixed.
+Stage modules are imported on first use, so a disabled stage never loads its
+module (or the libraries behind it) and startup stays cheap.
+
+run_async() is the --async runtime: the same stages as coroutines on one event
+loop, sharing one aiohttp connection pool (aio_http.AsyncHTTP).
+"""
+import importlib
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Awaitable, Callable, Optional
 
 from config import (
     ENABLE_MARKET_SNAPSHOT,
+    ENABLE_NEAR_DUP_FILTER,
     ENABLE_WHALE_ALERTS,
     MAX_OPINIONS_PER_RUN,
-    MAX_POSTS_PER_RUN,
+    METRICS_SUMMARY_FILE,
+    STAGE_TIMEOUT_SECONDS,
+    TELEGRAM_CHANNELS,
 )
-from image_fetcher import get_image_url
-from market_data import get_market_snapshot
-from news_fetcher import fetch_all
-from opinions_fetcher import post_opinions
-from posted_links import is_posted, mark_posted
-from rewriter import rewrite
-from telegram_poster import post
-from whale_tracker import get_whale_alerts
+import metrics
+from posted_links import flush, is_posted, mark_posted
 
 logger = logging.getLogger(__name__)
 
+NEWS_CANDIDATE_FACTOR = 5
 
-def run_job() -> None:
-    # 1. Market snapshot (prices)
-    if ENABLE_MARKET_SNAPSHOT:
-        snapshot, chart_url = get_market_snapshot()
-        if snapshot:
-            post(snapshot, chart_url)
-            logger.info("Posted market snapshot")
-
-    # 2. Whale alerts
-    if ENABLE_WHALE_ALERTS:
-        whale_text = get_whale_alerts()
-        if whale_text:
-            post(whale_text, None)
-            logger.info("Posted whale alerts")
-
-    # 3. Opinions (CryptoPanic)
-    post_opinions(max_posts=MAX_OPINIONS_PER_RUN)
-
-    # 4. News (RSS)
-    items = fetch_all()
-    new_items = [i for i in items if not is_posted(i.get("link", ""))]
-    to_process = new_items[:MAX_POSTS_PER_RUN]
-
-    for item in to_process:
-        link = item.get("link", "")
-        title = item.get("title", "")
-        summary = item.get("summary", "")
-        source = item.get("source", "")
+# A post is a dict: caption, image_url, link (None for posts that are not deduplicated), kind,
+# for news a story fingerprint (0 if none) recorded once posted, and the stage name as "section"
+# once published (it selects the target chats)
+
+
+class NewsPosts(list):
+    """
+    The news stage's posts, plus what _finish_run persists for them: the links the
+    stage kept (those left unposted are retried next run) and the feeds' pending
+    watermarks. Kept per run, so a timed-out stage still running cannot touch a later run.
+    """
+
+    def __init__(self, posts: list[dict], offered: list[str], watermarks: dict[str, dict]):
+        super().__init__(posts)
+        self.offered = offered
+        self.watermarks = watermarks
+
+
+def _market_stage() -> list[dict]:
+    from market_data import get_market_snapshot
+
+    snapshot, chart_url = get_market_snapshot()
+    if not snapshot:
+        return []
+    return [{"caption": snapshot, "image_url": chart_url, "link": None, "kind": "market snapshot"}]
+
+
+def _whale_stage() -> list[dict]:
+    from whale_tracker import get_whale_alerts
+
+    whale_text = get_whale_alerts()
+    if not whale_text:
+        return []
+    return [{"caption": whale_text, "image_url": None, "link": None, "kind": "whale alerts"}]
+
+
+def _opinions_stage() -> list[dict]:
+    from opinions_fetcher import prepare_opinions
+
+    return prepare_opinions(max_posts=MAX_OPINIONS_PER_RUN)
+
+
+def _news_stage() -> NewsPosts:
+    from image_fetcher import prefetch_images
+    from news_fetcher import fetch_all
+    from rewriter import rewrite_batch
+
+    # Only the newest unposted entries become items; extra candidates cover near-duplicate drops
+    watermarks: dict[str, dict] = {}
+    new_items = fetch_all(limit=_news_quota() * NEWS_CANDIDATE_FACTOR, skip_link=is_posted, watermarks=watermarks)
+    if ENABLE_NEAR_DUP_FILTER:
+        from near_duplicates import drop_near_duplicates
+
+        new_items, fingerprints = drop_near_duplicates(new_items)
+    else:
+        fingerprints = [0] * len(new_items)
+    to_process = new_items[:_news_quota()]
+
+    # Image lookups run while the LLM rewrites, so each item waits for max(rewrite, image)
+    images = prefetch_images(to_process)
+    captions = rewrite_batch(to_process)
+
+    posts = []
+    for item, caption, image, fp in zip(to_process, captions, images, fingerprints):
+        link = item.link
+        if not caption:
+            logger.warning("Skip (rewrite failed): %s", link)
+            continue
+        posts.append({"caption": caption, "image_url": image.result(), "link": link, "kind": "news", "fingerprint": fp})
+    return NewsPosts(posts, [item.link for item in new_items], watermarks)
+
+
+async def _market_stage_async(http) -> list[dict]:
+    from market_data import get_market_snapshot_async
+
+    snapshot, chart_url = await get_market_snapshot_async(http)
+    if not snapshot:
+        return []
+    return [{"caption": snapshot, "image_url": chart_url, "link": None, "kind": "market snapshot"}]
+
+
+async def _whale_stage_async(http) -> list[dict]:
+    from whale_tracker import get_whale_alerts_async
+
+    whale_text = await get_whale_alerts_async(http)
+    if not whale_text:
+        return []
+    return [{"caption": whale_text, "image_url": None, "link": None, "kind": "whale alerts"}]
+
+
+async def _opinions_stage_async(http) -> list[dict]:
+    from opinions_fetcher import prepare_opinions_async
+
+    return await prepare_opinions_async(http, max_posts=MAX_OPINIONS_PER_RUN)
+
+
+async def _news_stage_async(http) -> NewsPosts:
+    import asyncio
+
+    from image_fetcher import get_image_url_async
+    from news_fetcher import fetch_all_async
+    from rewriter import rewrite_batch
+
+    watermarks: dict[str, dict] = {}
+    new_items = await fetch_all_async(
+        http, limit=_news_quota() * NEWS_CANDIDATE_FACTOR, skip_link=is_posted, watermarks=watermarks
+    )
+    if ENABLE_NEAR_DUP_FILTER:
+        from near_duplicates import drop_near_duplicates
+
+        new_items, fingerprints = drop_near_duplicates(new_items)
+    else:
+        fingerprints = [0] * len(new_items)
+    to_process = new_items[:_news_quota()]
+
+    # The LLM clients are synchronous; the rewrite runs in a worker thread while image lookups run on the loop
+    images = asyncio.gather(*(get_image_url_async(item, http) for item in to_process))
+    captions = await asyncio.to_thread(rewrite_batch, to_process)
+    image_urls = await images
+
+    posts = []
+    for item, caption, image_url, fp in zip(to_process, captions, image_urls, fingerprints):
+        if not caption:
+            logger.warning("Skip (rewrite failed): %s", item.link)
+            continue
+        posts.append({"caption": caption, "image_url": image_url, "link": item.link, "kind": "news", "fingerprint": fp})
+    return NewsPosts(posts, [item.link for item in new_items], watermarks)
+
+
+# Stage registry in channel order: (name, enabled, stage function name, modules the stage imports).
+# The --async runtime uses the coroutine named after the stage function plus "_async". Names are the
+# sections TELEGRAM_CHANNELS entries can select (config.CHANNEL_SECTIONS).
+STAGES: list[tuple[str, bool, str, tuple[str, ...]]] = [
+    ("market", ENABLE_MARKET_SNAPSHOT, "_market_stage", ("market_data",)),
+    ("whales", ENABLE_WHALE_ALERTS, "_whale_stage", ("whale_tracker",)),
+    ("opinions", True, "_opinions_stage", ("opinions_fetcher",)),
+    ("news", True, "_news_stage", ("news_fetcher", "near_duplicates", "image_fetcher", "rewriter")),
+]
+# Loaded by _publish whatever stages are enabled
+PUBLISH_MODULES = ("telegram_poster",)
+# Stage modules that register CoinGecko ids with price_oracle when imported
+PRICED_MODULES = ("market_data", "whale_tracker")
+
+
+def _takes(channel: dict, section: str) -> bool:
+    return channel["sections"] is None or section in channel["sections"]
+
+
+def _runs(name: str, enabled: bool) -> bool:
+    """A stage runs if it is enabled and at least one target chat takes its section."""
+    return enabled and any(_takes(ch, name) for ch in TELEGRAM_CHANNELS)
+
+
+def _news_quota() -> int:
+    """News items to prepare per run: the most any chat takes (each is rewritten once for all chats)."""
+    return max((ch["max_posts"] for ch in TELEGRAM_CHANNELS if _takes(ch, "news")), default=0)
+
+
+def _stages() -> list[tuple[str, Callable[[], list[dict]]]]:
+    """Enabled stages in channel order."""
+    return [(name, globals()[fn]) for name, enabled, fn, _ in STAGES if _runs(name, enabled)]
+
+
+def _async_stages() -> list[tuple[str, Callable[..., Awaitable[list[dict]]]]]:
+    return [(name, globals()[fn + "_async"]) for name, enabled, fn, _ in STAGES if _runs(name, enabled)]
+
+
+def stage_modules() -> list[str]:
+    """Modules a run will import, in order: enabled stages' modules, then the publisher's."""
+    modules = [m for name, enabled, _, mods in STAGES if _runs(name, enabled) for m in mods]
+    return list(dict.fromkeys(modules + list(PUBLISH_MODULES)))
+
+
+def _register_coins() -> None:
+    """
+    Import the enabled stages' price_oracle users before any stage starts, so all
+    their coin ids are in the first batched /coins/markets request of the run.
+    """
+    for module in stage_modules():
+        if module in PRICED_MODULES:
+            importlib.import_module(module)
+
+
+def _timed_stage(name: str, fn: Callable[[], list[dict]]) -> list[dict]:
+    with metrics.timed("stage_seconds", stage=name):
+        return fn()
+
+
+def _run_stages(stages: list[tuple[str, Callable[[], list[dict]]]], timeout: float) -> list[list[dict]]:
+    """Run stages concurrently; a stage that fails or misses its timeout contributes no posts."""
+    pool = ThreadPoolExecutor(max_workers=max(1, len(stages)), thread_name_prefix="stage")
+    try:
+        started = time.monotonic()
+        futures = [(name, pool.submit(_timed_stage, name, fn)) for name, fn in stages]
+        results = []
+        for name, fut in futures:
+            try:
+                reply = fut.result(timeout=max(0.0, started + timeout - time.monotonic()))
+                results.append([] if reply is None else reply)
+            except FutureTimeout:
+                logger.warning("Stage %s timed out after %.0fs, skipping", name, timeout)
+                results.append([])
+            except Exception as e:
+                logger.exception("Stage %s failed: %s", name, e)
+                results.append([])
+        return results
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def _timed_stage_async(name: str, fn: Callable[..., Awaitable[list[dict]]], http) -> list[dict]:
+    with metrics.timed("stage_seconds", stage=name):
+        return await fn(http)
+
+
+async def _run_stages_async(
+    http, stages: list[tuple[str, Callable[..., Awaitable[list[dict]]]]], timeout: float
+) -> list[list[dict]]:
+    """_run_stages() on the event loop: stages run as concurrent tasks, each cancelled at the timeout."""
+    import asyncio
+
+    replies = await asyncio.gather(
+        *(asyncio.wait_for(_timed_stage_async(name, fn, http), timeout) for name, fn in stages),
+        return_exceptions=True,
+    )
+    results = []
+    for (name, _), reply in zip(stages, replies):
+        if isinstance(reply, asyncio.TimeoutError):
+            logger.warning("Stage %s timed out after %.0fs, skipping", name, timeout)
+            results.append([])
+        elif isinstance(reply, BaseException):
+            logger.error("Stage %s failed: %s", name, reply, exc_info=reply)
+            results.append([])
+        else:
+            results.append([] if reply is None else reply)
+    return results
+
+
+def _targets(p: dict, news_counts: dict[str, int]) -> list[str]:
+    """Chats that take the post's section; news only until a chat's max_posts is reached."""
+    section = p.get("section", "")
+    chats = []
+    for ch in TELEGRAM_CHANNELS:
+        if not _takes(ch, section):
+            continue
+        if section == "news":
+            if news_counts.get(ch["chat_id"], 0) >= ch["max_posts"]:
+                continue
+            news_counts[ch["chat_id"]] = news_counts.get(ch["chat_id"], 0) + 1
+        chats.append(ch["chat_id"])
+    return chats
+
+
+def _publish(posts: list[dict]) -> None:
+    """
+    Post in order to every chat that takes the post's section; linked posts already
+    posted (e.g. by an earlier stage) are skipped. Each post's first chat is sent
+    before the next post is queued; the other chats follow on parallel send lanes.
+    A link counts as posted once any chat accepted it.
+    """
+    from telegram_poster import submit_fan_out
+
+    queued: set[str] = set()
+    news_counts: dict[str, int] = {}
+    sent = []
+    for p in posts:
+        link = p.get("link")
         try:
-            caption = rewrite(title, summary, source)
-            if not caption:
-                logger.warning("Skip (rewrite failed): %s", link)
+            if link and (link in queued or is_posted(link)):
+                continue
+            chats = _targets(p, news_counts)
+            if not chats:
                 continue
-            image_url = get_image_url(item)
-            if post(caption, image_url):
-                mark_posted(link)
-                logger.info("Posted: %s", link)
-            else:
-                logger.warning("Post failed: %s", link)
+            if link:
+                queued.add(link)
+            sent.append((p, chats, submit_fan_out(p["caption"], p.get("image_url"), chats)))
         except Exception as e:
-            logger.exception("Error processing %s: %s", link, e)
+            logger.exception("Error posting %s %s: %s", p["kind"], link or "", e)
+    for p, chats, futures in sent:
+        try:
+            _record(p, chats, [f.result() for f in futures])
+        except Exception as e:
+            logger.exception("Error posting %s %s: %s", p["kind"], p.get("link") or "", e)
+
+
+async def _publish_async(http, posts: list[dict]) -> None:
+    from telegram_poster import post_fan_out_async
+
+    news_counts: dict[str, int] = {}
+    for p in posts:
+        link = p.get("link")
+        try:
+            if link and is_posted(link):
+                continue
+            chats = _targets(p, news_counts)
+            if chats:
+                _record(p, chats, await post_fan_out_async(http, p["caption"], p.get("image_url"), chats))
+        except Exception as e:
+            logger.exception("Error posting %s %s: %s", p["kind"], link or "", e)
+
+
+def _record(p: dict, chats: list[str], results: list[bool]) -> None:
+    """Mark a sent post's link (and story fingerprint) as posted."""
+    link = p.get("link")
+    ok = any(results)
+    if ok and not all(results):
+        failed = [chat for chat, sent in zip(chats, results) if not sent]
+        logger.warning("Post failed in %s (%s): %s", ", ".join(failed), p["kind"], link or "")
+    if not ok:
+        logger.warning("Post failed (%s): %s", p["kind"], link or "")
+    elif link:
+        mark_posted(link)
+        if p.get("fingerprint"):
+            from near_duplicates import remember_posted
+
+            remember_posted(p["fingerprint"], link)
+        logger.info("Posted %s: %s", p["kind"], link)
+    else:
+        logger.info("Posted %s", p["kind"])
+
+
+def _sectioned(stages: list[tuple[str, Callable]], results: list[list[dict]]) -> list[dict]:
+    """Flatten stage results in channel order, tagging each post with its stage name as "section"."""
+    return [{**p, "section": name} for (name, _), posts in zip(stages, results) for p in posts]
+
+
+def run_job() -> None:
+    metrics.begin_run()
+    try:
+        stages = _stages()
+        _register_coins()
+        results = _run_stages(stages, STAGE_TIMEOUT_SECONDS)
+        with metrics.timed("stage_seconds", stage="publish"):
+            _publish(_sectioned(stages, results))
+        _finish_run(results)
+    finally:
+        metrics.end_run(METRICS_SUMMARY_FILE)
+
+
+async def run_job_async(http) -> None:
+    """run_job() on the event loop; http is the run's aio_http.AsyncHTTP."""
+    metrics.begin_run()
+    try:
+        stages = _async_stages()
+        _register_coins()
+        results = await _run_stages_async(http, stages, STAGE_TIMEOUT_SECONDS)
+        with metrics.timed("stage_seconds", stage="publish"):
+            await _publish_async(http, _sectioned(stages, results))
+        _finish_run(results)
+    finally:
+        metrics.end_run(METRICS_SUMMARY_FILE)
+
+
+def _finish_run(results: list[list[dict]]) -> None:
+    """
+    Persist what the run posted: links, story fingerprints, and the feed watermarks
+    from this run's news stage result (none when the stage failed or timed out).
+    """
+    flush()
+    for posts in results:
+        if isinstance(posts, NewsPosts):
+            from news_fetcher import commit_watermarks
+
+            commit_watermarks(posts.watermarks, (link for link in posts.offered if not is_posted(link)))
+    if ENABLE_NEAR_DUP_FILTER:
+        from near_duplicates import flush as flush_fingerprints
+
+        flush_fingerprints()
+
+
+async def run_async(interval_minutes: Optional[float] = None) -> None:
+    """
+    The --async runtime: one job, or (with interval_minutes) a job every interval,
+    the first one interval after start like the blocking scheduler. All runs share
+    one connection pool. Runs never overlap; slots missed by a long run are skipped.
+    """
+    import asyncio
+
+    from aio_http import AsyncHTTP
+
+    http = AsyncHTTP()
+    try:
+        if interval_minutes is None:
+            await run_job_async(http)
+            return
+        interval = interval_minutes * 60
+        next_run = time.monotonic() + interval
+        while True:
+            await asyncio.sleep(max(0.0, next_run - time.monotonic()))
+            try:
+                await run_job_async(http)
+            except Exception as e:
+                logger.exception("Job failed: %s", e)
+            # Missed slots are skipped, not run back to back
+            while next_run <= time.monotonic():
+                next_run += interval
+    finally:
+        await http.close()
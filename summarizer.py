@@ -0,0 +1,133 @@
+"""Extractive captions without an LLM: cleaned headline, lead sentence, one emoji.
+
+Follows the rules of rewriter.SYSTEM_PROMPT deterministically: a one-line headline,
+then exactly one sentence taken from the summary, no source attribution, one emoji
+from the prompt's set, and a caption under CAPTION_MAX_LEN characters.
+"""
+import re
+
+from news_item import clean_text
+
+CAPTION_MAX_LEN = 500
+HEADLINE_MAX_LEN = 120
+# Lead sentences shorter than this are skipped (datelines, "Photo: ...", etc.)
+MIN_SENTENCE_WORDS = 5
+# A sentence sharing this fraction of its words with the headline only repeats it
+MAX_HEADLINE_OVERLAP = 0.8
+
+_PREFIX_RE = re.compile(
+    r"^\s*(?:breaking(?:\s+news)?|just\s+in|update[d]?|exclusive|watch|live)\s*[:\-–—|]\s*", re.I
+)
+_SUFFIX_SEP_RE = re.compile(r"\s+[-–—|]\s+(?P<suffix>[^-–—|]{1,40})$")
+_TRAILING_RE = re.compile(r"[\s.…]+$")
+# Feed boilerplate: everything from the marker on is dropped
+_BOILERPLATE_RE = re.compile(
+    r"(?:\bThe post\b.+\bappeared first on\b|\bRead more\b|\bContinue reading\b|\[(?:…|\.\.\.)\]|\bSource:).*$",
+    re.I | re.S,
+)
+_SENTENCE_END_RE = re.compile(r"[.!?][\"'”’)]?\s+(?=[\"“‘'(]?[A-Z0-9$])")
+_ABBREVIATIONS = frozenset(
+    "u.s u.k u.n e.u inc corp ltd co mr mrs ms dr st vs etc e.g i.e jan feb mar apr jun jul aug sep sept oct nov dec"
+    .split()
+)
+# Abbreviations only before a number ("No. 1"); otherwise a sentence end ("said no.")
+_NUMBER_ABBREVIATIONS = frozenset(("no",))
+_WORD_RE = re.compile(r"[a-z0-9$%]+")
+
+# First match wins; the prompt allows 📰 💰 🚀 📈 📉
+_EMOJI_RULES = [
+    ("🚀", re.compile(r"\b(?:record high|all[- ]time high|ath|soar\w*|skyrocket\w*|moon\w*)\b", re.I)),
+    ("📉", re.compile(
+        r"\b(?:fall\w*|fell|drop\w*|plung\w*|slump\w*|declin\w*|tumbl\w*|crash\w*|sell-?off|slid\w*|sink\w*|sank"
+        r"|los(?:e|es|ing|t))\b",
+        re.I,
+    )),
+    ("📈", re.compile(r"\b(?:ris(?:e|es|ing)|rose|gain\w*|jump\w*|surg\w*|rall\w*|climb\w*|rebound\w*|spik\w*)\b", re.I)),
+    ("💰", re.compile(r"\b(?:rais(?:e|es|ed|ing)|funding|invest\w*|acqui\w*|inflows?|billion|million|fund)\b", re.I)),
+]
+DEFAULT_EMOJI = "📰"
+
+
+def _truncate(text: str, max_len: int) -> str:
+    """Cut text to max_len characters at a word boundary, ending with an ellipsis."""
+    if len(text) <= max_len:
+        return text
+    cut = text[: max_len - 1].rsplit(" ", 1)[0].rstrip(" ,;:-–—")
+    return cut + "…"
+
+
+def clean_headline(title: str, source: str = "") -> str:
+    """Title without "BREAKING:"-style prefixes, a trailing " - Source" or ellipsis, on one line."""
+    title = clean_text(title)
+    title = _PREFIX_RE.sub("", title)
+    match = _SUFFIX_SEP_RE.search(title)
+    if match and source:
+        suffix = match.group("suffix").strip().casefold()
+        name = source.strip().casefold()
+        if suffix and (suffix in name or name in suffix):
+            title = title[: match.start()]
+    title = _TRAILING_RE.sub("", title)
+    return _truncate(title, HEADLINE_MAX_LEN)
+
+
+def _words(text: str) -> list[str]:
+    return _WORD_RE.findall(text.lower())
+
+
+def split_sentences(text: str) -> list[str]:
+    """Split on sentence-ending punctuation, except after common abbreviations (see _NUMBER_ABBREVIATIONS)."""
+    sentences, start = [], 0
+    for match in _SENTENCE_END_RE.finditer(text):
+        end = match.start() + 1
+        last_word = text[start:end].rsplit(None, 1)[-1].rstrip(".").lower() if text[start:end].strip() else ""
+        if last_word in _ABBREVIATIONS or (len(last_word) == 1 and last_word.isalpha()):
+            continue
+        if last_word in _NUMBER_ABBREVIATIONS and text[match.end():match.end() + 1].isdigit():
+            continue
+        sentences.append(text[start:match.end()].strip())
+        start = match.end()
+    tail = text[start:].strip()
+    if tail:
+        sentences.append(tail)
+    return sentences
+
+
+def lead_sentence(summary: str, headline: str = "") -> str:
+    """First summary sentence long enough and not just the headline again ("" if none)."""
+    text = _BOILERPLATE_RE.sub("", clean_text(summary)).strip()
+    headline_words = set(_words(headline))
+    for sentence in split_sentences(text):
+        words = _words(sentence)
+        if len(words) < MIN_SENTENCE_WORDS:
+            continue
+        if headline_words and sum(w in headline_words for w in words) / len(words) >= MAX_HEADLINE_OVERLAP:
+            continue
+        sentence = _TRAILING_RE.sub("", sentence) if sentence.endswith(("…", "...")) else sentence
+        return sentence if sentence[-1] in ".!?\"'”’)" else sentence + "."
+    return ""
+
+
+def pick_emoji(text: str) -> str:
+    for emoji, pattern in _EMOJI_RULES:
+        if pattern.search(text):
+            return emoji
+    return DEFAULT_EMOJI
+
+
+def extractive_caption(title: str, summary: str, source: str = "") -> str:
+    """
+    Headline plus lead sentence, prefixed with one emoji, under CAPTION_MAX_LEN
+    characters; "" without a headline, so the item is skipped like a failed rewrite.
+    """
+    headline = clean_headline(title, source) or clean_text(title)
+    if not headline:
+        return ""
+    sentence = lead_sentence(summary, headline)
+    # The headline decides the emoji; the sentence only when the headline has no cue
+    emoji = pick_emoji(headline)
+    if emoji == DEFAULT_EMOJI:
+        emoji = pick_emoji(sentence)
+    first = f"{emoji} {headline}"
+    if not sentence:
+        return first
+    return f"{first}\n\n{_truncate(sentence, CAPTION_MAX_LEN - 1 - len(first) - 2)}"
@@ -1,65 +1,311 @@
-"""Post rewritten news to Telegram channel: sendPhoto with caption above, or sendMessage."""
+"""Post rewritten news to Telegram channel: sendPhoto with caption above, or sendMessage.
+
+Requests go through a send queue: one ordered lane per chat, a pooled HTTP
+session, token buckets for Telegram's per-chat and global limits, and
+retries scheduled from 429 `retry_after` replies instead of fixed sleeps.
+Photo URLs already sent are sent again by the file_id Telegram returned for
+them, so Telegram does not download the same image again.
+"""
 import logging
-import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Optional
 
-import requests
-
-from config import TELEGRAM_BOT_TOKEN, TELEGRAM_CHANNEL_ID
+from config import (
+    ENABLE_TELEGRAM_FILE_ID_CACHE,
+    TELEGRAM_BOT_TOKEN,
+    TELEGRAM_CHANNEL_ID,
+    TELEGRAM_CHAT_BURST,
+    TELEGRAM_CHAT_RATE_PER_MINUTE,
+    TELEGRAM_FILE_ID_CACHE_FILE,
+    TELEGRAM_FILE_ID_MAX_ENTRIES,
+    TELEGRAM_FILE_ID_TTL_HOURS,
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_MAX_RETRIES,
+)
+from disk_cache import DiskCache
+import http_client
+import metrics
+from rate_limit import TokenBucket
 
 logger = logging.getLogger(__name__)
 
 BASE_URL = "https://api.telegram.org/bot"
-POST_DELAY_SECONDS = 1.5
 CAPTION_MAX_LEN = 1024
+TIMEOUT = 30
 
 
 def _api(method: str, **kwargs) -> dict:
     url = f"{BASE_URL}{TELEGRAM_BOT_TOKEN}/{method}"
-    try:
-        r = requests.post(url, json=kwargs, timeout=30)
-        data = r.json() if r.text else {}
-        if not data.get("ok"):
+    with metrics.timed("telegram_request_seconds", method=method):
+        try:
+            # sendPhoto may wait while Telegram fetches the image: a timeout learned from fast calls would cut
+            # it short, and a reply lost that way can still be published (then posted again next run)
+            r = http_client.post(url, json=kwargs, timeout=TIMEOUT, adaptive=False)
+            data = r.json() if r.text else {}
+        except Exception as e:
+            logger.exception("Telegram request failed: %s", e)
+            data = {"ok": False, "description": str(e)}
+    return _checked(method, data)
+
+
+async def _api_async(http, method: str, **kwargs) -> dict:
+    url = f"{BASE_URL}{TELEGRAM_BOT_TOKEN}/{method}"
+    with metrics.timed("telegram_request_seconds", method=method):
+        try:
+            _, data = await http.post_json(url, kwargs, timeout=TIMEOUT, adaptive=False)
+            data = data or {}
+        except Exception as e:
+            logger.exception("Telegram request failed: %s", e)
+            data = {"ok": False, "description": str(e)}
+    return _checked(method, data)
+
+
+def _checked(method: str, data: dict) -> dict:
+    if not data.get("ok"):
+        metrics.inc("telegram_errors_total", method=method, code=data.get("error_code", "network"))
+        if "error_code" in data:
             logger.warning("Telegram API %s: %s", method, data)
-        return data
-    except Exception as e:
-        logger.exception("Telegram request failed: %s", e)
-        return {"ok": False, "description": str(e)}
+    return data
 
 
-def post(caption: str, image_url: Optional[str] = None) -> bool:
+class SendQueue:
     """
-    Post one item to the channel. Caption above image when image is used.
-    - If image_url is set: sendPhoto with caption and show_caption_above_media=True.
-    - Else: sendMessage with caption only.
-    caption is truncated to 1024 chars.
-    Returns True if successful.
+    Rate-limited Telegram sender. Requests for the same chat run in submission
+    order on that chat's lane; different chats are sent in parallel. A 429 reply
+    pauses the chat's bucket for `retry_after` seconds and the request is retried.
     """
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHANNEL_ID:
+
+    def __init__(
+        self,
+        global_rate: float = TELEGRAM_GLOBAL_RATE,
+        chat_rate_per_minute: float = TELEGRAM_CHAT_RATE_PER_MINUTE,
+        chat_burst: float = TELEGRAM_CHAT_BURST,
+        max_retries: int = TELEGRAM_MAX_RETRIES,
+    ):
+        self.chat_rate = chat_rate_per_minute / 60.0
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, capacity=max(1.0, global_rate))
+        self._chats: dict[str, tuple[TokenBucket, ThreadPoolExecutor]] = {}
+        self._lock = threading.Lock()
+
+    def _lane(self, chat_id: str) -> tuple[TokenBucket, ThreadPoolExecutor]:
+        with self._lock:
+            lane = self._chats.get(chat_id)
+            if lane is None:
+                lane = (
+                    TokenBucket(self.chat_rate, capacity=self.chat_burst),
+                    ThreadPoolExecutor(max_workers=1, thread_name_prefix="tg-send"),
+                )
+                self._chats[chat_id] = lane
+            return lane
+
+    def submit(self, method: str, **params) -> "Future[dict]":
+        """Queue an API call for params["chat_id"]. The future resolves to Telegram's reply."""
+        bucket, lane = self._lane(str(params.get("chat_id", "")))
+        if method == "sendPhoto":
+            return lane.submit(self._send_photo, bucket, params)
+        return lane.submit(self._send, bucket, method, params)
+
+    def _send_photo(self, bucket: TokenBucket, params: dict) -> dict:
+        """sendPhoto by cached file_id when the URL was sent before; falls back to the URL if Telegram rejects it."""
+        url = params["photo"]
+        file_id = _cached_file_id(url)
+        if file_id:
+            resp = self._send(bucket, "sendPhoto", {**params, "photo": file_id})
+            if not _file_id_rejected(resp):
+                return resp
+            _forget_file_id(url)
+        resp = self._send(bucket, "sendPhoto", params)
+        _remember_file_id(url, resp)
+        return resp
+
+    def _send(self, bucket: TokenBucket, method: str, params: dict) -> dict:
+        resp: dict = {}
+        for attempt in range(self.max_retries + 1):
+            bucket.acquire()
+            self._global.acquire()
+            resp = _api(method, **params)
+            if resp.get("ok") or resp.get("error_code") != 429:
+                return resp
+            retry_after = float((resp.get("parameters") or {}).get("retry_after") or 1)
+            if attempt < self.max_retries:
+                logger.info("Telegram rate limited on %s, retrying in %.0fs", method, retry_after)
+                bucket.pause(retry_after)
+        return resp
+
+    async def send_async(self, http, method: str, **params) -> dict:
+        """submit() for the async runtime: same buckets, 429 handling and file_id reuse, awaited on the caller's task."""
+        bucket, _ = self._lane(str(params.get("chat_id", "")))
+        if method != "sendPhoto":
+            return await self._send_async(http, bucket, method, params)
+        url = params["photo"]
+        file_id = _cached_file_id(url)
+        if file_id:
+            resp = await self._send_async(http, bucket, "sendPhoto", {**params, "photo": file_id})
+            if not _file_id_rejected(resp):
+                return resp
+            _forget_file_id(url)
+        resp = await self._send_async(http, bucket, "sendPhoto", params)
+        _remember_file_id(url, resp)
+        return resp
+
+    async def _send_async(self, http, bucket: TokenBucket, method: str, params: dict) -> dict:
+        resp: dict = {}
+        for attempt in range(self.max_retries + 1):
+            await bucket.acquire_async()
+            await self._global.acquire_async()
+            resp = await _api_async(http, method, **params)
+            if resp.get("ok") or resp.get("error_code") != 429:
+                return resp
+            retry_after = float((resp.get("parameters") or {}).get("retry_after") or 1)
+            if attempt < self.max_retries:
+                logger.info("Telegram rate limited on %s, retrying in %.0fs", method, retry_after)
+                bucket.pause(retry_after)
+        return resp
+
+
+_queue = SendQueue()
+
+_file_ids: Optional[DiskCache] = None
+_file_ids_lock = threading.Lock()
+
+
+def _get_file_ids() -> Optional[DiskCache]:
+    global _file_ids
+    if not ENABLE_TELEGRAM_FILE_ID_CACHE:
+        return None
+    if _file_ids is None:
+        with _file_ids_lock:
+            if _file_ids is None:
+                _file_ids = DiskCache(
+                    TELEGRAM_FILE_ID_CACHE_FILE,
+                    ttl_seconds=TELEGRAM_FILE_ID_TTL_HOURS * 3600,
+                    max_entries=TELEGRAM_FILE_ID_MAX_ENTRIES,
+                    name="telegram_file_id",
+                )
+    return _file_ids
+
+
+def _cached_file_id(url: str) -> Optional[str]:
+    cache = _get_file_ids()
+    if cache is None:
+        return None
+    file_id = cache.get(url)
+    return file_id if isinstance(file_id, str) and file_id else None
+
+
+def _remember_file_id(url: str, resp: dict) -> None:
+    """Cache the file_id of the largest photo size in a successful sendPhoto reply."""
+    cache = _get_file_ids()
+    if cache is None or not resp.get("ok"):
+        return
+    sizes = (resp.get("result") or {}).get("photo") or []
+    file_id = sizes[-1].get("file_id") if sizes and isinstance(sizes[-1], dict) else None
+    if file_id:
+        cache.set(url, file_id)
+
+
+def _forget_file_id(url: str) -> None:
+    logger.info("Telegram rejected cached file_id, sending the URL again: %s", url)
+    metrics.inc("telegram_file_id_rejected_total")
+    cache = _get_file_ids()
+    if cache is not None:
+        cache.delete(url)
+
+
+def _file_id_rejected(resp: dict) -> bool:
+    # e.g. "Bad Request: wrong file identifier/HTTP URL specified", "FILE_REFERENCE_EXPIRED"
+    return resp.get("error_code") == 400 and "file" in str(resp.get("description", "")).lower()
+
+
+def submit_post(caption: str, image_url: Optional[str] = None, chat_id: Optional[str] = None) -> "Future[bool]":
+    """
+    Queue one post (see post()) and return a future resolving to True on success.
+    chat_id defaults to TELEGRAM_CHANNEL_ID.
+    """
+    done: "Future[bool]" = Future()
+    request = _request(caption, image_url, chat_id)
+    if request is None:
+        done.set_result(False)
+        return done
+    sent = _queue.submit(request[0], **request[1])
+
+    def _resolve(f: Future) -> None:
+        try:
+            done.set_result(bool(f.result().get("ok")))
+        except Exception as e:
+            logger.exception("Telegram send failed: %s", e)
+            done.set_result(False)
+
+    sent.add_done_callback(_resolve)
+    return done
+
+
+def submit_fan_out(caption: str, image_url: Optional[str], chat_ids: list[str]) -> list["Future[bool]"]:
+    """
+    Post one item to several chats. The first chat's send is waited for, so an
+    image is fetched by Telegram once and its file_id cached; the other chats
+    are then queued on their own lanes, in parallel, and reuse that file_id.
+    Returns one future per chat, in chat_ids order. Waiting for the first send
+    also keeps each chat's posts in submission order across calls.
+    """
+    if not chat_ids:
+        return []
+    first = submit_post(caption, image_url, chat_ids[0])
+    first.result()
+    return [first] + [submit_post(caption, image_url, chat_id) for chat_id in chat_ids[1:]]
+
+
+async def post_fan_out_async(http, caption: str, image_url: Optional[str], chat_ids: list[str]) -> list[bool]:
+    """submit_fan_out() for the async runtime; returns one result per chat."""
+    import asyncio
+
+    if not chat_ids:
+        return []
+    first = await post_async(http, caption, image_url, chat_ids[0])
+    rest = await asyncio.gather(*(post_async(http, caption, image_url, chat_id) for chat_id in chat_ids[1:]))
+    return [first, *rest]
+
+
+def _request(caption: str, image_url: Optional[str], chat_id: Optional[str]) -> Optional[tuple[str, dict]]:
+    """(method, params) for one post, or None if it cannot be sent."""
+    chat_id = chat_id or TELEGRAM_CHANNEL_ID
+    if not TELEGRAM_BOT_TOKEN or not chat_id:
         logger.error("TELEGRAM_BOT_TOKEN or TELEGRAM_CHANNEL_ID not set")
-        return False
+        return None
 
     text = (caption or "").strip()[:CAPTION_MAX_LEN]
     if not text:
         logger.warning("Empty caption, skipping post")
-        return False
+        return None
 
     if image_url and image_url.startswith("http"):
-        resp = _api(
-            "sendPhoto",
-            chat_id=TELEGRAM_CHANNEL_ID,
-            photo=image_url,
-            caption=text,
-            show_caption_above_media=True,
-        )
-    else:
-        resp = _api(
-            "sendMessage",
-            chat_id=TELEGRAM_CHANNEL_ID,
-            text=text,
-        )
-
-    if resp.get("ok"):
-        time.sleep(POST_DELAY_SECONDS)
-        return True
-    return False
+        return "sendPhoto", {
+            "chat_id": chat_id,
+            "photo": image_url,
+            "caption": text,
+            "show_caption_above_media": True,
+        }
+    return "sendMessage", {"chat_id": chat_id, "text": text}
+
+
+async def post_async(http, caption: str, image_url: Optional[str] = None, chat_id: Optional[str] = None) -> bool:
+    """post() for the async runtime (http: aio_http.AsyncHTTP)."""
+    request = _request(caption, image_url, chat_id)
+    if request is None:
+        return False
+    resp = await _queue.send_async(http, request[0], **request[1])
+    return bool(resp.get("ok"))
+
+
+def post(caption: str, image_url: Optional[str] = None) -> bool:
+    """
+    Post one item to the channel. Caption above image when image is used.
+    - If image_url is set: sendPhoto with caption and show_caption_above_media=True.
+    - Else: sendMessage with caption only.
+    caption is truncated to 1024 chars.
+    Returns True if successful.
+    """
+    return submit_post(caption, image_url).result()
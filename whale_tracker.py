@@ -1,15 +1,24 @@
 """Fetch large ETH/ERC20 transfers from Etherscan (whale tracking)."""
+import json
 import logging
-from typing import Optional
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Generator, Optional
 
-import requests
-
-from config import ETHERSCAN_API_KEY
+from config import ETHERSCAN_API_KEY, ETHERSCAN_RPS, WHALE_CURSOR_FILE, WHALE_MAX_PAGES, WHALE_PAGE_SIZE
+import http_client
+import metrics
+from price_oracle import get_price, get_price_async, register_coins
+from rate_limit import TokenBucket
 
 logger = logging.getLogger(__name__)
 
 ETHERSCAN_URL = "https://api.etherscan.io/api"
 TIMEOUT = 15
+# The newest transfers: the starting point without a cursor, and the resync point after a capped scan
+LATEST_PAGE = {"page": 1, "offset": 50, "sort": "desc"}
+
+_limiter = TokenBucket(ETHERSCAN_RPS, capacity=max(1.0, ETHERSCAN_RPS))
 
 # Token contracts (Ethereum mainnet)
 USDT = "0xdac17f958d2ee523a2206206994597c13d831ec7"  # 6 decimals
@@ -18,10 +27,30 @@ WETH = "0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2"  # 18 decimals
 
 # Min USD value to consider "whale" (approximate)
 MIN_USD = 1_000_000
-# Approximate USD per token (for filtering)
+# CoinGecko ids used to value each token; the constants are fallbacks if prices are unavailable
+USDT_COIN_ID = "tether"
+USDC_COIN_ID = "usd-coin"
+WETH_COIN_ID = "ethereum"
 USDT_USD = 1.0
 USDC_USD = 1.0
 WETH_USD = 3500.0
+register_coins([USDT_COIN_ID, USDC_COIN_ID, WETH_COIN_ID])
+
+
+def _usd_price(coin_id: str, fallback: float) -> float:
+    price = get_price(coin_id)
+    if price is None:
+        logger.warning("No live price for %s, using %.2f", coin_id, fallback)
+        return fallback
+    return price
+
+
+async def _usd_price_async(http, coin_id: str, fallback: float) -> float:
+    price = await get_price_async(coin_id, http)
+    if price is None:
+        logger.warning("No live price for %s, using %.2f", coin_id, fallback)
+        return fallback
+    return price
 
 
 def _format_value(raw: str, decimals: int, usd_per_unit: float) -> tuple[float, float]:
@@ -34,35 +63,161 @@ def _format_value(raw: str, decimals: int, usd_per_unit: float) -> tuple[float,
         return 0.0, 0.0
 
 
-def _fetch_token_transfers(contract: str, decimals: int, symbol: str, usd_per: float) -> list[dict]:
-    """Fetch recent transfers for a token contract and filter by min USD."""
-    if not ETHERSCAN_API_KEY:
+def _load_cursors() -> dict:
+    if not WHALE_CURSOR_FILE.exists():
+        return {}
+    try:
+        with open(WHALE_CURSOR_FILE, encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except Exception as e:
+        logger.warning("Could not load whale cursors: %s", e)
+        return {}
+
+
+def _save_cursors(cursors: dict) -> None:
+    try:
+        WHALE_CURSOR_FILE.parent.mkdir(parents=True, exist_ok=True)
+        tmp = WHALE_CURSOR_FILE.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(cursors, f)
+        os.replace(tmp, WHALE_CURSOR_FILE)
+    except Exception as e:
+        logger.exception("Could not save whale cursors: %s", e)
+
+
+def _tokentx_params(contract: str, **params) -> dict:
+    return {
+        "module": "account",
+        "action": "tokentx",
+        "contractaddress": contract,
+        "apikey": ETHERSCAN_API_KEY,
+        **params,
+    }
+
+
+def _tokentx_rows(data: dict, symbol: str) -> Optional[list[dict]]:
+    if data.get("status") == "1" and isinstance(data.get("result"), list):
+        return data["result"]
+    if "no transactions" in str(data.get("message", "")).lower():
         return []
+    logger.debug("Etherscan tokentx error for %s: %s", symbol, data.get("message") or data.get("result"))
+    return None
+
+
+def _tokentx(contract: str, symbol: str, **params) -> Optional[list[dict]]:
+    """One rate-limited tokentx request. Returns rows ([] when none), or None on error."""
+    _limiter.acquire()
     try:
-        r = requests.get(
-            ETHERSCAN_URL,
-            params={
-                "module": "account",
-                "action": "tokentx",
-                "contractaddress": contract,
-                "page": 1,
-                "offset": 50,
-                "sort": "desc",
-                "apikey": ETHERSCAN_API_KEY,
-            },
-            timeout=TIMEOUT,
-        )
+        r = http_client.get(ETHERSCAN_URL, params=_tokentx_params(contract, **params), timeout=TIMEOUT)
         r.raise_for_status()
         data = r.json()
     except Exception as e:
         logger.debug("Etherscan tokentx failed for %s: %s", symbol, e)
-        return []
+        return None
+    return _tokentx_rows(data, symbol)
+
+
+async def _tokentx_async(http, contract: str, symbol: str, **params) -> Optional[list[dict]]:
+    await _limiter.acquire_async()
+    try:
+        data = await http.get_json(ETHERSCAN_URL, params=_tokentx_params(contract, **params), timeout=TIMEOUT)
+    except Exception as e:
+        logger.debug("Etherscan tokentx failed for %s: %s", symbol, e)
+        return None
+    return _tokentx_rows(data, symbol)
 
-    if data.get("status") != "1" or not data.get("result"):
-        return []
 
+def _tx_key(tx: dict) -> str:
+    return f"{tx.get('hash', '')}:{tx.get('logIndex') or (tx.get('to', '') + tx.get('value', ''))}"
+
+
+def _scan_pages(symbol: str, cursor: Optional[dict]) -> Generator[dict, Optional[list[dict]], Optional[list[dict]]]:
+    """
+    Drive one contract scan: yields tokentx params, is sent each reply's rows
+    (None on error) and returns all rows, or None on error. Shared by the sync
+    and async scans, which only differ in how a request is made.
+    Without a cursor, only the latest page is read (as a starting point); with one,
+    scanning restarts at its block (inclusive) and pages forward until caught up.
+    A scan that hits WHALE_MAX_PAGES (Etherscan serves at most 10,000 rows per
+    query anyway) resyncs to the latest page, so the cursor never lags further
+    behind each run; transfers between the two are skipped and logged, which
+    trades completeness for alerts that are still current.
+    """
+    if not cursor:
+        return (yield dict(LATEST_PAGE))
+    rows: list[dict] = []
+    for page in range(1, WHALE_MAX_PAGES + 1):
+        batch = yield {
+            "startblock": cursor["block"], "endblock": 99999999,
+            "page": page, "offset": WHALE_PAGE_SIZE, "sort": "asc",
+        }
+        if batch is None:
+            return None
+        rows.extend(batch)
+        if len(batch) < WHALE_PAGE_SIZE:
+            break
+    else:
+        latest = yield dict(LATEST_PAGE)
+        if not latest:
+            logger.info("Whale scan for %s capped at %d pages; continuing next run", symbol, WHALE_MAX_PAGES)
+            return rows
+        scanned_to = max(int(tx.get("blockNumber", 0)) for tx in rows)
+        resync_at = min(int(tx.get("blockNumber", 0)) for tx in latest)
+        if resync_at > scanned_to + 1:
+            logger.warning(
+                "Whale scan for %s capped at %d pages; skipped blocks %d-%d to resync",
+                symbol, WHALE_MAX_PAGES, scanned_to + 1, resync_at - 1,
+            )
+        known = {_tx_key(tx) for tx in rows}
+        rows.extend(tx for tx in latest if _tx_key(tx) not in known)
+    return rows
+
+
+def _advance(rows: list[dict], cursor: Optional[dict]) -> tuple[list[dict], dict]:
+    """
+    Return (transfers not seen before, new cursor). The cursor holds the last
+    scanned block and the transfers already seen in it.
+    """
+    seen = set(cursor.get("seen", [])) if cursor else set()
+    fresh = [tx for tx in rows if _tx_key(tx) not in seen]
+    if not rows:
+        return fresh, cursor or {}
+
+    last_block = max(int(tx.get("blockNumber", 0)) for tx in rows)
+    last_keys = {_tx_key(tx) for tx in rows if int(tx.get("blockNumber", 0)) == last_block}
+    if cursor and cursor.get("block") == last_block:
+        last_keys |= seen
+    return fresh, {"block": last_block, "seen": sorted(last_keys)}
+
+
+def _scan_contract(contract: str, symbol: str, cursor: Optional[dict]) -> Optional[tuple[list[dict], dict]]:
+    """Return (new transfers, new cursor) for a contract, or None on error."""
+    steps = _scan_pages(symbol, cursor)
+    try:
+        params = next(steps)
+        while True:
+            params = steps.send(_tokentx(contract, symbol, **params))
+    except StopIteration as done:
+        rows = done.value
+    return None if rows is None else _advance(rows, cursor)
+
+
+async def _scan_contract_async(http, contract: str, symbol: str, cursor: Optional[dict]) -> Optional[tuple[list[dict], dict]]:
+    steps = _scan_pages(symbol, cursor)
+    try:
+        params = next(steps)
+        while True:
+            params = steps.send(await _tokentx_async(http, contract, symbol, **params))
+    except StopIteration as done:
+        rows = done.value
+    return None if rows is None else _advance(rows, cursor)
+
+
+def _whale_transfers(rows: list[dict], decimals: int, symbol: str, usd_per: float) -> list[dict]:
+    """Transfers worth at least MIN_USD, as {from, to, value, value_usd, symbol, hash}."""
     results = []
-    for tx in data["result"]:
+    for tx in rows:
         raw = tx.get("value", "0")
         amount, usd = _format_value(raw, decimals, usd_per)
         if usd < MIN_USD:
@@ -78,19 +233,83 @@ def _fetch_token_transfers(contract: str, decimals: int, symbol: str, usd_per: f
     return results
 
 
+def _fetch_token_transfers(
+    contract: str, decimals: int, symbol: str, usd_per: float, cursor: Optional[dict] = None
+) -> tuple[list[dict], Optional[dict]]:
+    """Fetch transfers since cursor and filter by min USD. Returns (whale transfers, new cursor or None on error)."""
+    if not ETHERSCAN_API_KEY:
+        return [], None
+    scanned = _scan_contract(contract, symbol, cursor)
+    if scanned is None:
+        return [], None
+    rows, new_cursor = scanned
+    return _whale_transfers(rows, decimals, symbol, usd_per), new_cursor
+
+
 def get_whale_alerts() -> Optional[str]:
     """
-    Fetch recent large transfers (USDT, USDC, WETH) and return formatted string.
+    Fetch large transfers (USDT, USDC, WETH) made since the last run and return formatted string.
+    Contracts are queried concurrently under ETHERSCAN_RPS; per-contract block cursors
+    are saved so each run only sees new transfers.
     """
     if not ETHERSCAN_API_KEY:
         logger.warning("ETHERSCAN_API_KEY not set, skipping whale alerts")
         return None
+    with metrics.timed("whale_alerts_seconds"):
+        return _whale_alerts()
+
 
+def _whale_alerts() -> Optional[str]:
+    tokens = [
+        (USDT, 6, "USDT", _usd_price(USDT_COIN_ID, USDT_USD)),
+        (USDC, 6, "USDC", _usd_price(USDC_COIN_ID, USDC_USD)),
+        (WETH, 18, "WETH", _usd_price(WETH_COIN_ID, WETH_USD)),
+    ]
+    cursors = _load_cursors()
     all_txs = []
-    all_txs.extend(_fetch_token_transfers(USDT, 6, "USDT", USDT_USD))
-    all_txs.extend(_fetch_token_transfers(USDC, 6, "USDC", USDC_USD))
-    all_txs.extend(_fetch_token_transfers(WETH, 18, "WETH", WETH_USD))
+    with ThreadPoolExecutor(max_workers=len(tokens), thread_name_prefix="whale") as pool:
+        futures = [pool.submit(_fetch_token_transfers, *token, cursors.get(token[0])) for token in tokens]
+        for token, fut in zip(tokens, futures):
+            txs, new_cursor = fut.result()
+            all_txs.extend(txs)
+            if new_cursor:
+                cursors[token[0]] = new_cursor
+    _save_cursors(cursors)
+    return format_alerts(all_txs)
+
+
+async def get_whale_alerts_async(http) -> Optional[str]:
+    """get_whale_alerts() for the async runtime (http: aio_http.AsyncHTTP)."""
+    import asyncio
+
+    if not ETHERSCAN_API_KEY:
+        logger.warning("ETHERSCAN_API_KEY not set, skipping whale alerts")
+        return None
+    with metrics.timed("whale_alerts_seconds"):
+        tokens = [
+            (USDT, 6, "USDT", await _usd_price_async(http, USDT_COIN_ID, USDT_USD)),
+            (USDC, 6, "USDC", await _usd_price_async(http, USDC_COIN_ID, USDC_USD)),
+            (WETH, 18, "WETH", await _usd_price_async(http, WETH_COIN_ID, WETH_USD)),
+        ]
+        cursors = _load_cursors()
+        scans = await asyncio.gather(*(
+            _scan_contract_async(http, contract, symbol, cursors.get(contract))
+            for contract, _, symbol, _ in tokens
+        ))
+        all_txs = []
+        for (contract, decimals, symbol, usd_per), scanned in zip(tokens, scans):
+            if scanned is None:
+                continue
+            rows, new_cursor = scanned
+            all_txs.extend(_whale_transfers(rows, decimals, symbol, usd_per))
+            if new_cursor:
+                cursors[contract] = new_cursor
+        _save_cursors(cursors)
+        return format_alerts(all_txs)
+
 
+def format_alerts(all_txs: list[dict]) -> Optional[str]:
+    """Format the five largest transfers; None if there are none."""
     all_txs.sort(key=lambda x: x["value_usd"], reverse=True)
     top = all_txs[:5]
 